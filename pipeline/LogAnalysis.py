@@ -20,6 +20,9 @@ Finding `panic` ERROR entry on a year
 (Ideally we should not do so, cuz the total size of the log files will be HUGE!!)
 $python3 LogAnalysis.py 2019
 
+Finding `panic` ERROR entry in logs already downloaded (i.e: by download-logs.sh), no AWS calls
+$python3 LogAnalysis.py --local logs/<profile>/logs
+
 ==== VERSION ====
 
 1. APR 9, 2019
@@ -39,41 +42,53 @@ $python3 LogAnalysis.py 2019
     * change the column name from 'FileName' to 'col_string', the previous name is confusing indeed
     * use a string array (name: keywords) to store ERROR keywords
 
+5. Queries go through utils.athena.AthenaExecutor
+    * one Athena client, keyword queries are submitted together and polled with backoff
+    * all result pages are read, not only the first 1000 rows
+
+6. Partitioned log table
+    * the table is partitioned by year/month/day (partition projection over the S3 layout)
+      so only the requested date is scanned, a year is still a big scan though
+    * all keywords are matched in one scan, each row is tagged with its keyword
+
+7. Local mode
+    * --local LOG_DIR scans plain and .gz logs on disk with utils.logscan, same result.txt format
+
 """
 from __future__ import print_function
 
+import os
 import sys
-import time
-import boto3
-
-# Function for executing athena queries
-def run_query(query, database, s3_output, need_results=False):
-    client = boto3.client('athena', region_name='us-west-2')
-    print('Executing query: ' + query)
-    response = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={
-            'Database': database
-        },
-        ResultConfiguration={
-            'OutputLocation': s3_output,
-        }
-    )
-
-    results = None
-    if need_results:
-        while True:
-            time.sleep(5)
-            status = client.get_query_execution(QueryExecutionId=response['QueryExecutionId'])
-            if status['QueryExecution']['Status']['State'] in ['SUCCEEDED', 'FAILED']:
-                break
-        results = client.get_query_results(QueryExecutionId=response['QueryExecutionId'])
-    print('Execution ID: ' + response['QueryExecutionId'])
-
-    return (response, results)
-
-def parse_logs(database, table, keywords, pvar, s3_input, s3_output):
+import tempfile
+
+from utils import logscan
+from utils.athena import AthenaExecutor
+
+S3_LOGS = 's3://harmony-benchmark/logs'
+PARTITIONS = ['year', 'month', 'day']
+
+def partition_filter(date):
+    """
+    WHERE clause for a `YYYY`, `YYYY/MM` or `YYYY/MM/DD` argument, so only that prefix of the logs is scanned.
+    """
+    parts = [p for p in date.strip('/').split('/') if p]
+    if not 1 <= len(parts) <= len(PARTITIONS) or not all(p.isdigit() for p in parts):
+        raise ValueError("invalid date %s, expected YYYY[/MM[/DD]]" % date)
+    return " AND ".join("%s = %d" % (name, int(p)) for name, p in zip(PARTITIONS, parts))
+
+def keyword_query(database, table, keywords, pvar, date):
+    """
+    One scan for all `keywords`, each row is tagged with the index of the first keyword it matched.
+    """
+    tag = " ".join("WHEN col_string LIKE %s THEN %d" % (keyword, i) for i, keyword in enumerate(keywords))
+    match = " OR ".join("col_string LIKE %s" % keyword for keyword in keywords)
+    return "SELECT CASE %s END AS keyword, %s, * FROM %s.%s WHERE %s AND (%s);" % (
+        tag, pvar, database, table, partition_filter(date), match)
+
+def parse_logs(executor, table, keywords, pvar, date):
+    database = executor.database
     drop_table = "DROP TABLE IF EXISTS %s.%s;" %(database, table)
+    # partitions are projected from the s3://.../logs/YYYY/MM/DD layout, no MSCK REPAIR needed
     create_table = \
         """
         CREATE EXTERNAL TABLE IF NOT EXISTS %s.%s (
@@ -84,44 +99,91 @@ def parse_logs(database, table, keywords, pvar, s3_input, s3_output):
         `col5` string,
         `col6` string
          )
+         PARTITIONED BY (`year` int, `month` int, `day` int)
          ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe'
          WITH SERDEPROPERTIES (
            'serialization.format' = ' ',
             'field.delim' = ' ',
             'collection.delim' = 'undefined',
             'mapkey.delim' = 'undefined'
-         ) LOCATION '%s'
-         TBLPROPERTIES ('has_encrypted_data'='false');""" % (database, table, s3_input)
-
-    # create table
-    queries = [drop_table, create_table]
-    for q in queries:
-        run_query(q, database, s3_output)
-
-    ret = 0
-    for keyword in keywords:
-    # Query definitions
-        query = "SELECT %s, * FROM %s.%s where col_string LIKE %s;" % (pvar, database, table, keyword)
-        (response, results) = run_query(query, database, s3_output, True)
-
+         ) LOCATION '%s/'
+         TBLPROPERTIES (
+            'has_encrypted_data'='false',
+            'projection.enabled'='true',
+            'projection.year.type'='integer',
+            'projection.year.range'='2018,2099',
+            'projection.month.type'='integer',
+            'projection.month.range'='1,12',
+            'projection.month.digits'='2',
+            'projection.day.type'='integer',
+            'projection.day.range'='1,31',
+            'projection.day.digits'='2',
+            'storage.location.template'='%s/${year}/${month}/${day}'
+         );""" % (database, table, S3_LOGS, S3_LOGS)
+
+    # create table, the keyword query needs it to exist
+    for q in [drop_table, create_table]:
+        executor.run(q)
+
+    execution_id = executor.run(keyword_query(database, table, keywords, pvar, date))
+
+    return write_results(keywords, ((int(row[0]), row[1]) for row in executor.rows(execution_id)), date)
+
+def write_results(keywords, matches, label):
+    """
+    Append the matches, (keyword index, log path) pairs, to result.txt grouped by keyword.
+    Matches are spooled to disk per keyword since the match count has to be written before them.
+    """
+    counts = [0] * len(keywords)
+    spools = [tempfile.TemporaryFile(mode='w+') for _ in keywords]
+    try:
+        for i, path in matches:
+            counts[i] += 1
+            print("%s in log: %s" % (keywords[i], path), file=spools[i])
         with open('result.txt', 'a') as f:
-            if results and len(results['ResultSet']['Rows']) > 1:
-                ret += len(results['ResultSet']['Rows']) - 1
-                print("%d match found for keyword %s on %s" % (len(results['ResultSet']['Rows'])-1, keyword, sys.argv[1]), file=f)
-                for r in results['ResultSet']['Rows'][1:]:
-                    print("%s in log: %s" % (keyword, r['Data'][0]['VarCharValue']), file=f)
-            else:
-                print("no match found for keyword %s on %s" % (keyword, sys.argv[1]), file=f)
-    return ret
+            for keyword, count, spool in zip(keywords, counts, spools):
+                if count:
+                    print("%d match found for keyword %s on %s" % (count, keyword, label), file=f)
+                    spool.seek(0)
+                    for line in spool:
+                        f.write(line)
+                else:
+                    print("no match found for keyword %s on %s" % (keyword, label), file=f)
+    finally:
+        for spool in spools:
+            spool.close()
+    return sum(counts)
+
+def parse_local_logs(log_dir, keywords):
+    """
+    Same as `parse_logs` for logs already on local disk, no AWS calls.
+    """
+    def matches():
+        for path, counts, error in logscan.scan(log_dir, keywords):
+            if error is not None:
+                print("skipping %s: %s" % (path, error))
+            for i, count in enumerate(counts):
+                for _ in range(count):
+                    yield i, path
+    return write_results(keywords, matches(), log_dir)
+
+KEYWORDS = ["'panic%'", "'fatal%'"]
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--local':
+        if len(sys.argv) < 3 or not os.path.isdir(sys.argv[2]):
+            sys.exit("Need to input a log directory \nusage: python3 LogAnalysis.py --local LOG_DIR")
+        sys.exit(parse_local_logs(sys.argv[2], KEYWORDS))
+
     # Athena configuration
 
     if len(sys.argv) < 2:
         sys.exit("Need to input a valid timestampe argument \nusage: python3 LogAnalysis.py YYYY/MM/DD")
 
-    s3_input = 's3://harmony-benchmark/logs/' + sys.argv[1]
-    print("s3_input path: " + s3_input)
+    try:
+        print("s3_input partitions: " + partition_filter(sys.argv[1]))
+    except ValueError as e:
+        sys.exit(str(e))
 
     s3_output = 's3://athena-harmony-benchmark/logs/' + sys.argv[1]
     print("s3_output path:" + s3_output)
@@ -129,16 +191,17 @@ def main():
     # Athena database and table definition
     database = 'harmony'
 
+    executor = AthenaExecutor(database, s3_output)
+
     # create database if not exist
     create_database = "CREATE DATABASE IF NOT EXISTS %s;" % (database)
-    run_query(create_database, database, s3_output)
+    executor.run(create_database)
 
     ret = 0
     # run queries: find panic
-    table = 'FindingPanic4'
-    keywords = ["'panic%'", "'fatal%'"]
+    table = 'FindingPanic5'
     pvar = '"$path"'
-    ret += parse_logs(database, table, keywords, pvar, s3_input, s3_output)
+    ret += parse_logs(executor, table, KEYWORDS, pvar, sys.argv[1])
 
     sys.exit(ret)
 
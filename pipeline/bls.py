@@ -11,18 +11,25 @@ import json
 import argparse
 import os
 import math
+import sys
+import time
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from pyhmy import (
     util
 )
 import requests
 
+from utils import rpc
+from utils.stats import percentile
 from fund import (
     get_network_config,
     get_endpoints,
 )
 
 env = os.environ.copy()
+DEFAULT_WORKERS = 64
 
 
 def parse_args():
@@ -30,55 +37,90 @@ def parse_args():
     parser.add_argument("command", help="What BLS key function to do on network. Supported commands:\n\n"
                                         "\t`ref`  \tGet reference/configured BLS keys per node for network.\n\n"
                                         "\t`dist` \tGet current distribution of bls keys with IP address.\n\n"
-                                        "\t`diff` \tGet missing BLS keys per node for network.\n\n")
+                                        "\t`diff` \tGet missing, duplicated, misplaced and orphan BLS keys as JSON.\n\n"
+                                        "\t`watch`\tContinuously poll nodes and print BLS key changes only.\n\n")
     parser.add_argument("--shard", default=None, help="Specify a shard for a command", type=int)
     parser.add_argument("--raw", action="store_true", help="Disable pretty printing")
+    parser.add_argument("--workers", default=DEFAULT_WORKERS, type=int,
+                        help=f"Max number of nodes queried at once (default {DEFAULT_WORKERS})")
+    parser.add_argument("--timeout", default=3, type=float, help="Timeout in seconds per node (default 3)")
+    parser.add_argument("--interval", default=2, type=float,
+                        help="Poll interval in seconds for changing/unreachable nodes in `watch` (default 2)")
+    parser.add_argument("--max_interval", default=30, type=float,
+                        help="Poll interval in seconds that stable nodes back off to in `watch` (default 30)")
     return parser.parse_args()
 
 
-def get_metadata(endpoint):
-    url = endpoint
-    payload = json.dumps({"id": "1", "jsonrpc": "2.0",
-                          "method": "hmy_getNodeMetadata",
-                          "params": []})
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=3)
-    return json.loads(response.content)["result"]
-
-
-def get_bls_keys_on_node(endpoint):
-    """
-    WARNING: This is subject to change in the future
-    """
-    try:
-        metadata = get_metadata(endpoint)
-    except Exception:  # Do not halt on any exception
-        return None
-    bls_keys = metadata["blskey"]
-    return bls_keys
+def get_metadata(endpoint, timeout=3):
+    return rpc.call(endpoint, "hmy_getNodeMetadata", [], timeout=timeout)
 
 
-def get_bls_distribution(shard):
+def get_shard_ips(shard):
     """
     Assumes that this is executed on a machine that has access to internal nodes.
     """
-    distribution = []
     log_dir = f"{os.path.dirname(os.path.realpath(__file__))}/logs/{os.environ['HMY_PROFILE']}"
     assert os.path.isdir(log_dir)
     shard_log_path = f"{log_dir}/shard{shard}.txt"
     assert os.path.isfile(shard_log_path)
     with open(shard_log_path, 'r') as f:
-        ip_list = f.readlines()
-    for ip in ip_list:
-        ip = ip.strip()
-        if ip:
-            distribution.append({
-                'ip': ip,
-                'bls-keys': get_bls_keys_on_node(f"http://{ip}:9500/")
-            })
-    return distribution
+        return [ip.strip() for ip in f.readlines() if ip.strip()]
+
+
+def scan_node(shard, ip, timeout=3):
+    """
+    Returns the BLS keys of one node along with the request latency and outcome.
+    `bls-keys` is None if the node could not be reached.
+    """
+    start = time.time()
+    node = {'shard': shard, 'ip': ip, 'bls-keys': None, 'status': 'ok'}
+    try:
+        node['bls-keys'] = get_metadata(f"http://{ip}:9500/", timeout)["blskey"]
+    except requests.exceptions.Timeout:
+        node['status'] = 'timeout'
+    except Exception:  # Do not halt on any exception
+        node['status'] = 'error'
+    node['latency'] = time.time() - start
+    return node
+
+
+def scan_nodes(shards, workers=DEFAULT_WORKERS, timeout=3):
+    """
+    Query every node of all `shards` at once through a bounded thread pool.
+
+    Yields node results (see `scan_node`) as they arrive, in no particular order.
+    """
+    yield from scan_targets([(shard, ip) for shard in shards for ip in get_shard_ips(shard)], workers, timeout)
+
+
+def scan_targets(targets, workers=DEFAULT_WORKERS, timeout=3):
+    """
+    Same as `scan_nodes` but for an explicit list of (shard, ip) `targets`.
+    """
+    if not targets:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(targets))) as executor:
+        futures = [executor.submit(scan_node, shard, ip, timeout) for shard, ip in targets]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def print_scan_summary(nodes):
+    latencies = sorted(n['latency'] for n in nodes if n['status'] == 'ok')
+    timeouts = [n for n in nodes if n['status'] == 'timeout']
+    errors = [n for n in nodes if n['status'] == 'error']
+    print(f"{util.Typgpy.HEADER}Scanned {len(nodes)} node(s): {len(latencies)} ok, {len(timeouts)} timed out, "
+          f"{len(errors)} unreachable{util.Typgpy.ENDC}")
+    if latencies:
+        print(f"{util.Typgpy.HEADER}Latency p50: {percentile(latencies, 50):.3f}s, "
+              f"p90: {percentile(latencies, 90):.3f}s, p99: {percentile(latencies, 99):.3f}s, "
+              f"max: {latencies[-1]:.3f}s{util.Typgpy.ENDC}")
+    for n in timeouts + errors:
+        print(f"{util.Typgpy.WARNING}Shard {n['shard']}: {n['ip']} {n['status']}{util.Typgpy.ENDC}")
+
+
+def get_shards():
+    return [args.shard] if args.shard is not None else list(range(int(config['benchmark']['shards'])))
 
 
 def get_all_test_keys():
@@ -105,17 +147,62 @@ def get_total_keys(config):
 def get_all_reference_keys(config):
     """
     Returns a 2d array where the rows are machines and the columns are keys
+
+    Raises ValueError if the test key file holds fewer keys than the network needs.
     """
     stride = get_stride(config)
     test_keys = get_all_test_keys()
     keys_per_node = config['multikey']['keys_per_node']
-    keys = []
-    for i in range(stride):
-        lst = []
-        for j in range(i, stride*keys_per_node, stride):
-            lst.append(test_keys[j].replace(".key", ""))
-        keys.append(lst)
-    return keys
+    if len(test_keys) < get_total_keys(config):
+        raise ValueError(f"blskey-test.txt has {len(test_keys)} key(s), {get_total_keys(config)} needed "
+                         f"for {stride} node(s) of {keys_per_node} key(s)")
+    return [[k.replace(".key", "") for k in test_keys[i:stride * keys_per_node:stride]] for i in range(stride)]
+
+
+def build_key_index(ref_key, shard_count):
+    """
+    Returns a dict of BLS key -> (machine slot, shard) for the reference layout `ref_key`.
+    """
+    return {k: (i, i % shard_count) for i, lst in enumerate(ref_key) for k in lst}
+
+
+def diff_keys(index, nodes, shards):
+    """
+    Compare the keys reported by `nodes` (see `scan_node`) against the reference `index`,
+    restricted to `shards`, in one pass over the reported keys.
+
+    Returns a dict with:
+        `missing`: keys not found on any node, grouped by machine slot.
+        `duplicated`: keys found on more than one node.
+        `misplaced`: keys found on a node of the wrong shard.
+        `orphan`: keys found on a node but not in the reference layout.
+        `unreachable`: nodes that could not be queried.
+    """
+    shards = set(shards)
+    seen, misplaced, orphan, unreachable = {}, [], [], []
+    for node in nodes:
+        if node['bls-keys'] is None:
+            unreachable.append({'shard': node['shard'], 'ip': node['ip'], 'status': node['status']})
+            continue
+        for k in node['bls-keys']:
+            seen.setdefault(k, []).append({'shard': node['shard'], 'ip': node['ip']})
+            if k not in index:
+                orphan.append({'key': k, 'shard': node['shard'], 'ip': node['ip']})
+            elif index[k][1] != node['shard']:
+                misplaced.append({'key': k, 'machine': index[k][0], 'expected-shard': index[k][1],
+                                  'shard': node['shard'], 'ip': node['ip']})
+
+    missing = {}
+    for k, (machine, shard) in index.items():
+        if shard in shards and k not in seen:
+            missing.setdefault(machine, {'machine': machine, 'shard': shard, 'keys': []})['keys'].append(k)
+    return {
+        'missing': sorted(missing.values(), key=lambda m: m['machine']),
+        'duplicated': [{'key': k, 'nodes': v} for k, v in seen.items() if len(v) > 1],
+        'misplaced': misplaced,
+        'orphan': orphan,
+        'unreachable': unreachable,
+    }
 
 
 def handle_ref():
@@ -137,67 +224,130 @@ def handle_ref():
 
 
 def handle_dst():
-    def handle(shard):
-        dist = get_bls_distribution(shard)
+    nodes = []
+    for node in scan_nodes(get_shards(), args.workers, args.timeout):
+        nodes.append(node)
         if args.raw:
-            print(dist)
+            print(json.dumps(node))
         else:
-            for d in dist:
-                print(f"Shard {shard}: {d['ip']}")
-                if d['bls-keys'] is None:
-                    print("\tUnable to get BLS key(s)")
-                elif not d['bls-keys']:
-                    print("\tNo BLS key(s)")
-                else:
-                    for el in d['bls-keys']:
-                        print(f"\t{el}")
-            print("")
+            print(f"Shard {node['shard']}: {node['ip']} ({node['latency']:.3f}s)")
+            if node['bls-keys'] is None:
+                print("\tUnable to get BLS key(s)")
+            elif not node['bls-keys']:
+                print("\tNo BLS key(s)")
+            else:
+                for el in node['bls-keys']:
+                    print(f"\t{el}")
+    if not args.raw:
+        print("")
+        print_scan_summary(nodes)
 
-    if args.shard is not None:
-        handle(args.shard)
+
+def handle_diff():
+    """
+    Prints the diff report (see `diff_keys`) as JSON, the scan summary goes to stderr.
+    """
+    shards = get_shards()
+    index = build_key_index(get_all_reference_keys(config), config['benchmark']['shards'])
+    nodes = list(scan_nodes(shards, args.workers, args.timeout))
+    report = diff_keys(index, nodes, shards)
+    report['shards'] = shards
+    report['missing-key-count'] = sum(len(m['keys']) for m in report['missing'])
+    if args.raw:
+        print(json.dumps(report))
     else:
-        for s in range(int(config['benchmark']['shards'])):
-            handle(s)
+        print(json.dumps(report, indent=2))
+        with contextlib.redirect_stdout(sys.stderr):
+            print_scan_summary(nodes)
 
 
-def handle_diff():
-    ref_key = get_all_reference_keys(config)
-    shard_count = config['benchmark']['shards']
-
-    def handle(shard):
-        missing = []
-        dist = get_bls_distribution(shard)
-        present_keys = set()
-        for d in dist:
-            if d['bls-keys'] is not None:
-                for k in d['bls-keys']:
-                    present_keys.add(k)
-        for i, lst in enumerate(ref_key):
-            if i % shard_count == shard:
-                for k in lst:
-                    if k not in present_keys:
-                        if not all(x not in present_keys for x in lst):
-                            print(f"{util.Typgpy.FAIL}Keys in group: {lst} were not distributed properly.{util.Typgpy.ENDC}")
-                        missing.append(lst)
-                        break
+class KeyWatcher:
+    """
+    Keeps the last known BLS key set per node and reports only what changed between polls.
 
-        if args.raw:
-            print(missing)
-        else:
-            if not missing:
-                print(f"Shard {shard}: No BLS key is missing!")
-            else:
-                for i, row in enumerate(missing):
-                    print(f"Shard {shard}: Missing machine {i}")
-                    for el in row:
-                        print(f"\t{el}")
-            print("")
+    A node that is unchanged since its last poll has its poll interval doubled (up to `max_interval`),
+    a node whose keys changed or that became unreachable is polled again after `interval`.
+    """
 
-    if args.shard is not None:
-        handle(args.shard)
+    def __init__(self, targets, interval=2, max_interval=30):
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.keys = {}
+        self.status = {}
+        self.delay = {t: interval for t in targets}
+        self.next_poll = {t: 0 for t in targets}
+
+    def due(self, now):
+        return [t for t, at in self.next_poll.items() if at <= now]
+
+    def update(self, node, now):
+        """
+        Record one `scan_node` result, returns the list of change events (dicts) for that node.
+        """
+        target = (node['shard'], node['ip'])
+        events, base = [], {'time': now, 'shard': node['shard'], 'ip': node['ip']}
+        prev_status = self.status.get(target)
+        self.status[target] = node['status']
+        if node['bls-keys'] is None:
+            if prev_status != node['status']:
+                events.append(dict(base, event='unreachable', status=node['status']))
+        else:
+            keys = set(node['bls-keys'])
+            prev_keys = self.keys.get(target)
+            if prev_status not in (None, 'ok'):
+                events.append(dict(base, event='reachable'))
+            if prev_keys is not None:
+                added, removed = sorted(keys - prev_keys), sorted(prev_keys - keys)
+                if added:
+                    events.append(dict(base, event='added', keys=added))
+                if removed:
+                    events.append(dict(base, event='removed', keys=removed))
+            elif prev_status is not None:
+                events.append(dict(base, event='added', keys=sorted(keys)))
+            self.keys[target] = keys
+        stable = not events and node['status'] == 'ok'
+        self.delay[target] = min(self.delay[target] * 2, self.max_interval) if stable else self.interval
+        self.next_poll[target] = now + self.delay[target]
+        return events
+
+
+def print_watch_event(event):
+    if args.raw:
+        print(json.dumps(event), flush=True)
+        return
+    stamp = time.strftime('%H:%M:%S', time.localtime(event['time']))
+    prefix = f"[{stamp}] Shard {event['shard']}: {event['ip']}"
+    if event['event'] == 'unreachable':
+        print(f"{util.Typgpy.FAIL}{prefix} unreachable ({event['status']}){util.Typgpy.ENDC}", flush=True)
+    elif event['event'] == 'reachable':
+        print(f"{util.Typgpy.OKGREEN}{prefix} reachable again{util.Typgpy.ENDC}", flush=True)
     else:
-        for s in range(int(config['benchmark']['shards'])):
-            handle(s)
+        color = util.Typgpy.OKGREEN if event['event'] == 'added' else util.Typgpy.FAIL
+        sign = '+' if event['event'] == 'added' else '-'
+        print(f"{color}{prefix} {event['event']} {len(event['keys'])} key(s){util.Typgpy.ENDC}", flush=True)
+        for k in event['keys']:
+            print(f"\t{sign} {k}", flush=True)
+
+
+def handle_watch():
+    targets = [(shard, ip) for shard in get_shards() for ip in get_shard_ips(shard)]
+    watcher = KeyWatcher(targets, args.interval, args.max_interval)
+    nodes = list(scan_targets(watcher.due(time.time()), args.workers, args.timeout))
+    for node in nodes:
+        watcher.update(node, time.time())
+    if not args.raw:
+        print_scan_summary(nodes)
+        print(f"Watching {len(targets)} node(s) holding {sum(len(k) for k in watcher.keys.values())} key(s), "
+              f"only changes are printed...", flush=True)
+    while True:
+        now = time.time()
+        due = watcher.due(now)
+        if not due:
+            time.sleep(max(min(watcher.next_poll.values()) - now, 0.1))
+            continue
+        for node in scan_targets(due, args.workers, args.timeout):
+            for event in watcher.update(node, time.time()):
+                print_watch_event(event)
 
 
 if __name__ == "__main__":
@@ -212,6 +362,11 @@ if __name__ == "__main__":
         handle_dst()
     elif args.command == "diff":
         handle_diff()
+    elif args.command == "watch":
+        try:
+            handle_watch()
+        except KeyboardInterrupt:
+            pass
     else:
         print(f"{util.Typgpy.FAIL}Unknown argument...{util.Typgpy.ENDC}")
         exit(-1)
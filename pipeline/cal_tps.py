@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Calculate the number of consensus and TPS based on leader and validator log files.
+
+Each log is read once and all logs are parsed in parallel, the headline
+numbers are the same as the ones of the former cal_tps.sh.
+
+Example usage:
+    python3 cal_tps.py logs/$TS/all-leaders.txt logs/$TS/all-validators.txt
+    python3 cal_tps.py logs/$TS/all-leaders.txt logs/$TS/all-validators.txt --format json
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+from utils import tps
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Consensus and TPS statistics from leader and validator logs')
+    parser.add_argument("leaders", help="File with the list of leader log files, one per line")
+    parser.add_argument("validators", nargs="?", default=None,
+                        help="File with the list of validator log files, one per line")
+    parser.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                        help="Output format (default text)")
+    parser.add_argument("--processes", type=int, default=None, help="Number of parser processes (default #cpus)")
+    return parser.parse_args()
+
+
+def read_list(path):
+    if not path:
+        return []
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def print_text(summary):
+    print(f"{summary['shards']} shards, {summary['consensus']} consensus, {summary['total-tps']} total TPS, "
+          f"{summary['nodes']} nodes")
+    for leader in summary['leaders']:
+        print(f"{leader['node']}, {leader['consensus']}, {leader['avg-tps']:.6g}")
+    block_time = summary['block-time']
+    if block_time['count']:
+        print(f"block time mean: {block_time['mean']:.3f}s, p50: {block_time['p50']:.3f}s, "
+              f"p99: {block_time['p99']:.3f}s")
+
+
+def print_csv(summary):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["role", "node", "consensus", "avg_tps", "tps_p50", "tps_p99",
+                     "block_time_mean", "block_time_p50", "block_time_p99", "path"])
+    for s in summary['leaders']:
+        writer.writerow(["leader", s['node'], s['consensus'], s['avg-tps'], s['tps']['p50'], s['tps']['p99'],
+                         s['block-time']['mean'], s['block-time']['p50'], s['block-time']['p99'], s['path']])
+    for s in summary['validators']:
+        writer.writerow(["validator", s['node'], s['consensus'], "", "", "", "", "", "", s['path']])
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = tps.analyze(read_list(args.leaders), read_list(args.validators), args.processes)
+    if args.format == "json":
+        print(json.dumps(summary, indent=2))
+    elif args.format == "csv":
+        print_csv(summary)
+    else:
+        print_text(summary)
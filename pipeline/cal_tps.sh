@@ -1,5 +1,7 @@
 #!/bin/bash
 
+# Kept for existing callers, the analysis is done by cal_tps.py in a single pass per log file.
+
 function usage
 {
    ME=$(basename $0)
@@ -11,6 +13,8 @@ This script calculate the number of consensus and TPS based on leader log and va
 list_of_leaders contains a list of leader log files
 list_of_validators contains a list of validator log files
 
+See \`python3 cal_tps.py --help\` for JSON/CSV output.
+
 EOT
    exit 0
 }
@@ -19,37 +23,4 @@ if [ "$#" -ne 2 ]; then
    usage
 fi
 
-LEADERS=$1
-VALIDATORS=$2
-
-FILES=( $(cat $LEADERS) )
-
-if [ -n "$VALIDATORS" ]; then
-   NUM_NODES=$(wc -l $VALIDATORS $LEADERS | tail -n 1 | awk ' { print $1 } ')
-fi
-
-NUM_SHARDS=${#FILES[@]}
-SUM=0
-NUM_CONSENSUS=0
-
-declare -A TPS
-
-for f in "${FILES[@]}"; do
-   leader=$( echo $(basename $f) | cut -f 2 -d\- )
-   num_consensus=$(grep HOORAY $f | wc -l)
-   if [ $num_consensus -gt 0 ]; then
-      avg_tps=$(grep TPS $f | cut -f 2 -d: | cut -f 1 -d , | awk '{s+=$1} END {print s/NR}')
-      printf -v avg_tps_int %.0f $avg_tps
-   else
-      avg_tps=0
-      avg_tps_int=0
-   fi
-   TPS[$leader]="$num_consensus, $avg_tps"
-   NUM_CONSENSUS=$(expr $NUM_CONSENSUS + $num_consensus )
-   SUM=$( expr $SUM + $avg_tps_int )
-done
-
-echo $NUM_SHARDS shards, $NUM_CONSENSUS consensus, $SUM total TPS, $NUM_NODES nodes
-for t in "${!TPS[@]}"; do
-   echo $t, ${TPS[$t]}
-done
+exec python3 "$(dirname "$0")/cal_tps.py" "$@"
@@ -2,6 +2,9 @@
 """
 This is a script to consolidate all given balances without the use of an endpoint.
 
+Keys are decrypted in memory (in parallel) and transactions are signed locally,
+nothing is imported into the CLI's keystore.
+
 Note that this takes a config JSON file to dictate which accounts to consolidate.
 Each element of the JSON array represents 1 account's information.
 
@@ -41,29 +44,39 @@ Example usage:
 """
 
 import json
-import time
 import sys
-import shutil
 import argparse
 import os
+import time
 from decimal import Decimal
+from multiprocessing import Pool
 from multiprocessing.pool import ThreadPool
+from queue import Queue
+from threading import Thread, Lock, Event
 
 from pyhmy import (
-    cli,
     util
 )
 
+from utils import (
+    rpc,
+    signing,
+)
+from utils.balances import BalanceCache
+from utils.confirmation import ConfirmationTracker
+from utils.scheduler import (
+    ShardScheduler,
+    chunks,
+)
+from utils.sender import SendError, TransactionSender
 from fund import (
-    setup,
     get_network_config,
     get_chain_id,
     get_endpoints,
-    get_balance_from_node_ip,
 )
 
-prefix = "consolidation_"
-added_key_names = []
+progress_lock = Lock()
+progress = {}
 
 
 def parse_args():
@@ -71,101 +84,174 @@ def parse_args():
     parser.add_argument("dest_address", help="The Bech32 address of the account to send all the money to")
     parser.add_argument("--config", dest="config", default="consolidate_config.json",
                         help="path to the config file for this script (default is `consolidate_config.json`)")
-    parser.add_argument("--timeout", dest="timeout", default=120, help="timeout for each transaction")
-    parser.add_argument("--gas_price", dest="gas_price", default=1, help="Gas price for all transactions (default 1)")
-    parser.add_argument("--gas_limit", dest="gas_limit", default=21000,
+    parser.add_argument("--gas_price", dest="gas_price", default=1, type=int,
+                        help="Gas price in Nano for all transactions (default 1)")
+    parser.add_argument("--gas_limit", dest="gas_limit", default=21000, type=int,
                         help="Gas limit for all transactions (default 21000)")
     parser.add_argument("--amount", dest="amount", help="Max amount to consolidate for each given account. Per shard. "
                                                         "Default is all funds.", default=None, type=float)
     parser.add_argument("--check", action="store_true", help="Spot check balances after transfers")
+    parser.add_argument("--check_timeout", dest="check_timeout", default=90, type=int,
+                        help="Max seconds to wait for transaction receipts when checking (default 90)")
     parser.add_argument("--force", action="store_true", help="Send transactions even if network appears to be offline")
+    parser.add_argument("--concurrency", dest="concurrency", default=8, type=int,
+                        help="Number of concurrent transaction submitters per shard (default 8)")
+    parser.add_argument("--batch_size", dest="batch_size", default=rpc.DEFAULT_BATCH_SIZE, type=int,
+                        help=f"Max number of calls per JSON-RPC batch request (default {rpc.DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--workers", dest="workers", default=os.cpu_count(), type=int,
+                        help="Number of processes used to decrypt keystore files (default is the CPU count)")
     return parser.parse_args()
 
 
+def load_key(job):
+    """
+    Decrypt the key of one config element, returns the raw private key bytes.
+
+    Runs in a worker process since the keystore KDF (scrypt) is CPU bound.
+    """
+    j, src_info = job
+    # Passphrase parsing
+    if "passphrase-file-path" in src_info.keys():
+        pw_path = src_info['passphrase-file-path']
+        assert os.path.isfile(pw_path), f"`{pw_path}` is not a file."
+        with open(pw_path, 'r') as f:
+            passphrase = f.read().strip()
+    elif "passphrase" in src_info.keys():
+        passphrase = src_info['passphrase']
+    else:
+        passphrase = ''  # CLI default passphrase
+
+    # Load key
+    if "keystore-file-path" in src_info.keys():
+        ks_path = src_info['keystore-file-path']
+        assert os.path.isfile(ks_path), f"`{ks_path}` is not a file."
+        try:
+            return signing.load_private_key(ks_path, passphrase).to_bytes()
+        except ValueError as e:
+            raise RuntimeError(f"Could not import key for config {j}: {e}") from e
+    elif "private-key" in src_info.keys():
+        return bytes.fromhex(src_info['private-key'].replace("0x", ""))
+    else:
+        raise RuntimeError(f"No key to import for config {j}")
+
+
 def load_accounts():
     accs_info = []
     assert os.path.isfile(args.config), f"`{args.config}` is not a file"
     with open(args.config, 'r') as f:
         config = json.load(f)
-    cli_dir = cli.get_account_keystore_path()
-    for j, src_info in enumerate(config):
-        sys.stdout.write(f"Key import progress: {j}/{len(config)}   \r")
-        sys.stdout.flush()
-        # Passphrase parsing
-        if "passphrase-file-path" in src_info.keys():
-            pw_path = src_info['passphrase-file-path']
-            assert os.path.isfile(pw_path), f"`{pw_path}` is not a file."
-            with open(pw_path, 'r') as f:
-                passphrase = f.read().strip()
-        elif "passphrase" in src_info.keys():
-            passphrase = src_info['passphrase']
-        else:
-            passphrase = ''  # CLI default passphrase
-
-        # Load key
-        acc_name = f"{prefix}{j}"
-        cli.remove_account(acc_name)
-        if "keystore-file-path" in src_info.keys():
-            ks_path = src_info['keystore-file-path']
-            assert os.path.isfile(ks_path), f"`{ks_path}` is not a file."
-            os.makedirs(f"{cli_dir}/{acc_name}")
-            shutil.copy(ks_path, f"{cli_dir}/{acc_name}")
-            address = cli.get_address(acc_name)
-            if address is None:
-                raise RuntimeError(f"Could not import key for config {j}")
-            added_key_names.append(acc_name)
-        elif "private-key" in src_info.keys():
-            cli.single_call(f"hmy keys import-private-key {src_info['private-key']} {acc_name}")
-            address = cli.get_address(acc_name)
-            if address is None:
-                raise RuntimeError(f"Could not import key for config {j}")
-        else:
-            raise RuntimeError(f"No key to import for config {j}")
-
-        accs_info.append({
-            'address': address,
-            'passphrase': passphrase
-        })
+    with Pool(max(args.workers, 1)) as pool:
+        for j, raw_key in enumerate(pool.imap(load_key, enumerate(config))):
+            sys.stdout.write(f"Key import progress: {j + 1}/{len(config)}   \r")
+            sys.stdout.flush()
+            private_key = signing.keys.PrivateKey(raw_key)
+            accs_info.append({
+                'address': signing.get_address(private_key),
+                'private-key': private_key
+            })
     return accs_info
 
 
-def consolidate(shard):
-    if shard >= len(endpoints):
-        return
-    transactions = []
-    total_amt = 0
-    overhead = Decimal(args.gas_price * args.gas_limit) * Decimal(1e-18) + Decimal(1e-18)
+def fetch_balances(shard, accounts, queue):
+    """
+    Producer: batched balance and nonce lookups, each account is queued as soon as its batch arrives.
+    """
+    for chunk in chunks(accounts, args.batch_size):
+        addresses = [acc['address'] for acc in chunk]
+        try:
+            balances = balance_cache.get_many(addresses, shard)
+            nonces = rpc.get_nonces(endpoints[shard], addresses, batch_size=args.batch_size, block="pending")
+        except Exception as e:  # Do not halt the shard on one bad batch.
+            print(f"{util.Typgpy.FAIL}Shard {shard}: could not fetch balances for {len(chunk)} "
+                  f"account(s): {e}{util.Typgpy.ENDC}")
+            with progress_lock:
+                progress[shard]["failed"] += len(chunk)
+            continue
+        for acc in chunk:
+            queue.put((acc, balances[acc['address']], nonces[acc['address']]))
+
+
+def submit_transfers(shard, queue, results):
+    """
+    Consumer: sign and submit each account's transfer as soon as it is queued.
+    """
+    gas_price = args.gas_price * 10 ** 9  # Nano to atto
+    overhead = Decimal(gas_price * args.gas_limit) * Decimal(1e-18) + Decimal(1e-18)
     max_amount = float('inf') if args.amount is None else Decimal(args.amount) + overhead
-    print(f"{util.Typgpy.HEADER}Consolidating funds for shard {shard} ({len(accounts_info)} transaction(s)){util.Typgpy.ENDC}")
-    for acc in accounts_info:
-        acc_bal = json.loads(cli.single_call(f"hmy --node={endpoints[shard]} balances {acc['address']}"))[0]
-        assert acc_bal["shard"] == shard, f"balance for shard {shard} does not match endpoint"
-        amount = round(Decimal(min(acc_bal["amount"], max_amount)) - overhead, 18)
-        total_amt += amount
-        transactions.append({
-            "from": acc['address'],
-            "to": args.dest_address,
-            "from-shard": str(shard),
-            "to-shard": str(shard),
-            "gas-price": str(args.gas_price),
-            "gas-limit": str(args.gas_limit),
-            "passphrase-string": acc['passphrase'],
-            "amount": str(amount)
-        })
-    filename = f"./{prefix}fund{shard}.json"
-    with open(filename, 'w') as f:
-        json.dump(transactions, f, indent=4)
-    command = f"hmy --node={endpoints[shard]} transfer --file {filename} --chain-id {chain_id} --timeout 0"
-    print(f"{util.Typgpy.HEADER}Transaction for shard {shard}:\n{util.Typgpy.OKGREEN}"
-          f"{cli.single_call(command, timeout=int(args.timeout) * len(endpoints) * len(accounts_info))}"
-          f"{util.Typgpy.ENDC}")
-    return total_amt
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        acc, balance, nonce = item
+        amount = round(Decimal(min(balance, max_amount)) - overhead, 18)
+        if amount <= 0:
+            with progress_lock:
+                progress[shard]["skipped"] += 1
+            continue  # Nothing left to consolidate once gas is paid.
+        sender = TransactionSender(endpoints[shard], acc['private-key'], shard, chain_id,
+                                   gas_price=gas_price, gas_limit=args.gas_limit)
+        sender.nonces.seed(nonce)
+        try:
+            res = sender.send([{"from": acc['address'], "to": args.dest_address, "amount": amount}])
+        except SendError as e:  # Do not halt the shard on one bad submission.
+            res = e.results + [dict(t, error=str(e)) for t in e.window]
+        except Exception as e:
+            res = [{"from": acc['address'], "to": args.dest_address, "amount": amount, "error": str(e)}]
+        balance_cache.invalidate(acc['address'], shard)
+        with progress_lock:
+            results.extend(res)
+            for r in res:
+                if "error" in r:
+                    progress[shard]["failed"] += 1
+                    print(f"{util.Typgpy.FAIL}Transaction error on shard {shard} from {r['from']}: "
+                          f"{r['error']}{util.Typgpy.ENDC}")
+                else:
+                    progress[shard]["sent"] += 1
+                    progress[shard]["amount"] += r["amount"]
+
+
+def consolidate(shard, accounts):
+    """
+    Streaming consolidation of `accounts` on `shard`: the balance fetcher feeds a bounded
+    queue that `--concurrency` submitters drain right away.
+
+    Returns a result dict per transaction.
+    """
+    if shard >= len(endpoints):
+        return []
+    queue = Queue(maxsize=args.batch_size * 2)
+    results = []
+    with progress_lock:
+        progress[shard] = {"total": len(accounts), "sent": 0, "failed": 0, "skipped": 0, "amount": Decimal(0)}
+    submitters = [Thread(target=submit_transfers, args=(shard, queue, results), name=f"shard{shard}-submit{i}")
+                  for i in range(max(args.concurrency, 1))]
+    for t in submitters:
+        t.start()
+    try:
+        fetch_balances(shard, accounts, queue)
+    finally:
+        for _ in submitters:
+            queue.put(None)
+        for t in submitters:
+            t.join()
+    balance_cache.invalidate(args.dest_address, shard)
+    return results
+
+
+def report_progress(done, interval=5):
+    start = time.time()
+    while not done.wait(interval):
+        with progress_lock:
+            line = " | ".join(f"s{shard}: {p['sent'] + p['failed'] + p['skipped']}/{p['total']} "
+                              f"({p['sent'] / (time.time() - start):.1f} tx/s, {p['amount']:.2f} ONE)"
+                              for shard, p in sorted(progress.items()))
+            total = sum(p["amount"] for p in progress.values())
+        print(f"{util.Typgpy.OKBLUE}{line} | total: {total:.2f} ONE{util.Typgpy.ENDC}")
 
 
 if __name__ == "__main__":
     args = parse_args()
     assert os.path.isfile(args.config), f"`{args.config}` is not a file."
-    setup()
     net_config = get_network_config()
     chain_id = get_chain_id(net_config)
     endpoints = get_endpoints(net_config)
@@ -175,11 +261,11 @@ if __name__ == "__main__":
     if os.environ['HMY_PROFILE'] is None:
         raise RuntimeError("Profile is not set, exiting...")
 
-    print(f"{util.Typgpy.BOLD}Importing keys{util.Typgpy.ENDC}")
+    print(f"{util.Typgpy.BOLD}Loading keys{util.Typgpy.ENDC}")
     accounts_info = load_accounts()
-    init_bal = 0
-    for bal in get_balance_from_node_ip(args.dest_address, endpoints):
-        init_bal += bal["amount"]
+    balance_cache = BalanceCache(endpoints, batch_size=args.batch_size)
+    balance_cache.sweep([args.dest_address])  # Account balances are streamed in by the pipeline.
+    init_bal = sum(balance_cache.get(args.dest_address, shard) for shard in range(len(endpoints)))
 
     print(f"{util.Typgpy.OKBLUE}Consolidating funds to: {util.Typgpy.OKGREEN}{args.dest_address}{util.Typgpy.ENDC}")
     print(f"{util.Typgpy.OKBLUE}Consolidating using endpoints: {util.Typgpy.OKGREEN}{endpoints}{util.Typgpy.ENDC}")
@@ -189,32 +275,42 @@ if __name__ == "__main__":
     if input("Consolidate accounts?\n[Y]/n > ") != 'Y':
         exit()
 
-    pool = ThreadPool(processes=len(endpoints))
-    i, total_amount = 0, 0
-    while i < len(endpoints):
-        threads = []
-        for _ in range(os.cpu_count()):
-            threads.append(pool.apply_async(consolidate, (i,)))
-            i += 1
-            if i >= len(endpoints):
-                break
-        for t in threads:
-            total_amount += t.get()
+    trackers = {}
+
+    def track(shard, results):
+        trackers[shard] = ConfirmationTracker(endpoints[shard], batch_size=args.batch_size)
+        for res in results:
+            if "hash" in res:
+                trackers[shard].add(res["hash"], res)
+
+    done = Event()
+    reporter = Thread(target=report_progress, args=(done,), name="progress", daemon=True)
+    reporter.start()
+    # One job per shard and no retries, the pipeline handles its own errors and a retry would double send.
+    scheduler = ShardScheduler(consolidate, concurrency=1, retries=0, report_interval=0)
+    shard_results = scheduler.run({shard: [accounts_info] for shard in range(len(endpoints))}, finalize=track)
+    done.set()
+    total_amount = sum(res["amount"] for r in shard_results.values() for res in r["results"] if "error" not in res)
+    print(f"{util.Typgpy.HEADER}Consolidated {total_amount} ONE from {len(accounts_info)} account(s) on "
+          f"{len(endpoints)} shard(s){util.Typgpy.ENDC}")
 
     exit_code = 0
     print(f"{util.Typgpy.HEADER}Finished sending transactions!{util.Typgpy.ENDC}")
     if args.check:
-        print(f"{util.Typgpy.HEADER}Sleeping 90 seconds before checking balances{util.Typgpy.ENDC}")
-        time.sleep(90)
-        post_bal = 0
-        for bal in get_balance_from_node_ip(args.dest_address, endpoints):
-            post_bal += bal["amount"]
-        if total_amount < post_bal - init_bal:
-            print(f"{util.Typgpy.FAIL}{args.dest_address} did not get funded!{util.Typgpy.ENDC}")
-            exit_code = 1
+        tx_count = sum(len(t.pending) for t in trackers.values())
+        print(f"{util.Typgpy.HEADER}Waiting up to {args.check_timeout} seconds for {tx_count} "
+              f"transaction receipt(s){util.Typgpy.ENDC}")
+        pool = ThreadPool(processes=len(endpoints))
+        confirmed = all(pool.map(lambda t: t.wait(timeout=args.check_timeout), trackers.values()))
+        if tx_count < sum(r["sent"] + r["failed"] for r in shard_results.values()):
+            confirmed = False  # Could not track every transaction, fall back to the balance check.
+        if confirmed:
+            print(f"{util.Typgpy.HEADER}All {tx_count} transaction(s) confirmed!{util.Typgpy.ENDC}")
         else:
-            print(f"{util.Typgpy.HEADER}Successfully consolidated funds!{util.Typgpy.ENDC}")
-    print(f"{util.Typgpy.BOLD}Removing imported keys{util.Typgpy.ENDC}")
-    for name in added_key_names:
-        cli.remove_account(name)
+            post_bal = sum(balance_cache.get(args.dest_address, shard) for shard in range(len(endpoints)))
+            if total_amount < post_bal - init_bal:
+                print(f"{util.Typgpy.FAIL}{args.dest_address} did not get funded!{util.Typgpy.ENDC}")
+                exit_code = 1
+            else:
+                print(f"{util.Typgpy.HEADER}Successfully consolidated funds!{util.Typgpy.ENDC}")
     exit(exit_code)
@@ -108,7 +108,10 @@ function generate_distribution
 {
    if [[ $AZ_VM -gt 0 && -f $ROOTDIR/azure/configs/raw_ip.txt ]]; then
       echo "Merge raw_ip.txt from Azure"
-      cat $ROOTDIR/azure/configs/raw_ip.txt | grep -vE '^ node' >> raw_ip.txt
+      # tag the Azure nodes with their region so the distribution balances them across the shards
+      for ips in $ROOTDIR/azure/configs/*.ips; do
+         grep -vE '^ node' $ips | awk -v region=$(basename $ips .ips) ' NF { print $1, $2, region, "azure" } ' >> raw_ip.txt
+      done
       cp $ROOTDIR/azure/configs/*.ips logs/$TS
    fi
    if [  -f "$IP_FILE" ]; then
@@ -2,7 +2,8 @@
 """
 This is a script to fund accounts without the use of an endpoint.
 
-Note that this script assumes that the faucet key is in the CLI's keystore.
+Note that this script assumes that the faucet key is in the CLI's keystore (with an empty passphrase).
+Transactions are signed locally with that key and submitted over RPC.
 
 Example usage:
     python3 fund.py --amount 100000 --shards "0, 2, 3"
@@ -10,35 +11,50 @@ Example usage:
 
 import json
 import sys
-import time
 import argparse
 import os
 import csv
-from multiprocessing.pool import ThreadPool
+from multiprocessing import Pool
 from threading import Lock
-from decimal import Decimal
 
 from pyhmy import (
     cli,
     util
 )
 import pyhmy
-import requests
+
+from utils import (
+    bech32,
+    rpc,
+    signing,
+)
+from utils.balances import BalanceCache
+from utils.confirmation import ConfirmationTracker
+from utils.ledger import FundingLedger
+from utils.scheduler import (
+    ShardScheduler,
+    chunks,
+)
+from utils.sender import (
+    SendError,
+    TransactionSender,
+    DEFAULT_WINDOW,
+)
 
 faucet_addr = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"  # Assumes that this is in the CLI's keystore.
 accounts = [
     "one17dcjcyauyr43rqh29sa9zeyvfvqc54yzuwyd64",
 ]
-fund_log_lock = Lock()
-fund_log = {
-    "block-height": 0,
-    "funded-accounts": {}
-}
+balance_cache = None
+senders = {}
+senders_lock = Lock()
+fund_log = None
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Funding script for a new network')
-    parser.add_argument("--timeout", dest="timeout", default=120, help="timeout for each transaction")
+    parser.add_argument("--timeout", dest="timeout", default=120, type=int,
+                        help="Max seconds to wait for transaction receipts after sending (default 120)")
     parser.add_argument("--amount", dest="amount", default="1000", type=str, help="Amount to fund each account")
     parser.add_argument("--accounts", dest="accounts", default=None, help="String in CSV format of one1... addresses")
     parser.add_argument("--shards", dest="shards", default=None,
@@ -49,6 +65,14 @@ def parse_args():
                                                        "Note the file format assumption. "
                                                        "If given, the `amount` and `accounts` options are ignored. ",
                         default=None)
+    parser.add_argument("--batch_size", dest="batch_size", default=rpc.DEFAULT_BATCH_SIZE, type=int,
+                        help=f"Max number of calls per JSON-RPC batch request (default {rpc.DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--window", dest="window", default=DEFAULT_WINDOW, type=int,
+                        help=f"Max number of transactions in flight per shard (default {DEFAULT_WINDOW})")
+    parser.add_argument("--chunk_size", dest="chunk_size", default=500, type=int,
+                        help="Number of accounts per scheduled funding job (default 500)")
+    parser.add_argument("--workers", dest="workers", default=1, type=int,
+                        help="Number of processes used to validate the CSV (default 1, in-process)")
     p_arg = parser.parse_args()
     p_arg.accounts = accounts if p_arg.accounts is None else [el.strip()
                                                               for el in p_arg.accounts.split(",")
@@ -67,49 +91,26 @@ def setup():
 
 
 def load_log():
+    """
+    Replay the funding ledger, the block height is fetched once per run
+    to detect a network reset since the ledger was written.
+    """
     global fund_log
     log_dir = f"{os.path.dirname(os.path.realpath(__file__))}/logs/{os.environ['HMY_PROFILE']}"
-    file = f"{log_dir}/funding.json"
-    if os.path.isfile(file):
-        with open(file, 'r') as f:
-            loaded_fund_log = json.load(f)
-        curr_height = json.loads(cli.single_call(f"hmy blockchain "
-                                                 f"latest-header -n {endpoints[0]}"))["result"]["blockNumber"]
-        if loaded_fund_log['block-height'] <= curr_height:
-            fund_log = loaded_fund_log
+    fund_log = FundingLedger(f"{log_dir}/funding.jsonl")
+    fund_log.load(curr_height=rpc.get_block_number(endpoints[0]), legacy_path=f"{log_dir}/funding.json")
 
 
 def save_log():
-    fund_log["block-height"] = json.loads(cli.single_call(f"hmy blockchain "
-                                                          f"latest-header -n {endpoints[0]}"))["result"]["blockNumber"]
-    log_dir = f"{os.path.dirname(os.path.realpath(__file__))}/logs/{os.environ['HMY_PROFILE']}"
-    file = f"{log_dir}/funding.json"
-    with open(file, 'w') as f:
-        json.dump(fund_log, f, indent=4)
+    fund_log.close()
 
 
 def get_balance(address, endpoint):
-    url = endpoint
-    payload = json.dumps({"id": "1", "jsonrpc": "2.0",
-                          "method": "hmy_getBalance",
-                          "params": [address, "latest"]})
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
-    atto_bal = int(json.loads(response.content)["result"], 16)
-    return float(Decimal(atto_bal) / Decimal(1e18))
+    return rpc.get_balance(endpoint, address)
 
 
 def get_nonce(endpoint, address):
-    url = endpoint
-    payload = "{\"jsonrpc\": \"2.0\", \"method\": \"hmy_getTransactionCount\"," \
-              "\"params\": [\"" + address + "\", \"latest\"],\"id\": 1}"
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = requests.request('POST', url, headers=headers, data=payload, allow_redirects=False, timeout=30)
-    return int(json.loads(response.content)["result"], 16)
+    return rpc.get_nonce(endpoint, address)
 
 
 def get_network_config():
@@ -149,128 +150,131 @@ def get_endpoints(config):
     return eps
 
 
-def fund(shard, data=None):
-    if not data:
-        return fund_from_param(shard)
-    return fund_from_csv_data(shard, data)
+def fund(shard, data):
+    """
+    Fund one chunk of `data` on `shard`, only CSV funding checks the current balance first.
+    """
+    if shard >= len(endpoints):
+        return []
+    return fund_from_data(shard, data, check_balance=args.csv is not None)
+
+
+def get_sender(shard):
+    """
+    Per-shard faucet sender, so that every job on a shard shares one nonce counter.
+    """
+    with senders_lock:
+        if shard not in senders:
+            senders[shard] = TransactionSender(endpoints[shard], faucet_key, shard, chain_id, window=args.window)
+        return senders[shard]
 
 
-def fund_from_param(shard):
-    if shard >= len(endpoints):
-        return
-    transactions = []
-    nonce = get_nonce(endpoints[shard], faucet_addr)
-    print(f"{util.Typgpy.HEADER}Preparing transactions for shard {shard} "
-          f"({len(args.accounts)} transaction(s)){util.Typgpy.ENDC}")
-    for acc in args.accounts:
-        fund_log_lock.acquire()
-        if dat['address'] not in fund_log['funded-accounts'].keys():
-            fund_log['funded-accounts'][dat['address']] = {str(i): 0 for i in range(len(endpoints))}
-        balance_log = fund_log['funded-accounts'][dat['address']]
-        fund_log_lock.release()
-        fund_amount = float(args.amount) - balance_log[str(shard)]  # WARNING: Always fund the difference.
-        if fund_amount > 0 or args.force:
-            transactions.append({
-                "from": faucet_addr,
-                "to": acc,
-                "from-shard": str(shard),
-                "to-shard": str(shard),
-                "passphrase-string": "",
-                "amount": str(fund_amount) if fund_amount > 0 else str(args.amount),
-                "nonce": str(nonce),
-            })
-            nonce += 1
-    filename = f"./fund-{os.environ['HMY_PROFILE']}.s{shard}.json"
-    with open(filename, 'w') as f:
-        json.dump(transactions, f, indent=4)
-    command = f"hmy --node={endpoints[shard]} transfer --file {filename} --chain-id {chain_id} --timeout 0"
-    if transactions:
-        print(f"{util.Typgpy.HEADER}Sending {len(transactions)} transaction(s) on shard {shard}!{util.Typgpy.ENDC}")
-        try:
-            print(f"{util.Typgpy.HEADER}Transaction for shard {shard}:\n{util.Typgpy.OKGREEN}"
-                  f"{cli.single_call(command, timeout=int(args.timeout) * len(endpoints) * len(args.accounts))} "
-                  f"{util.Typgpy.ENDC}")
-        except Exception as e:
-            print(f"{util.Typgpy.FAIL}Transaction error: {e}{util.Typgpy.ENDC}")
-    else:
-        print(f"{util.Typgpy.FAIL}No transactions to send on shard {shard}!{util.Typgpy.ENDC}")
+def send_funds(shard, transactions):
+    """
+    Every transfer is credited in the funding log before it is submitted, so that a run killed
+    at any point does not fund the same account twice when restarted. Rejected transfers are debited back.
+    """
+    if not transactions:
+        return []
 
+    def on_submit(window):
+        for res in window:
+            fund_log.add(res['to'], shard, float(res['amount']))
 
-# TODO: generalize funding code to remove code duplication
-def fund_from_csv_data(shard, data):
-    if shard >= len(endpoints):
-        return
+    def on_sent(window_results):
+        for res in window_results:
+            balance_cache.invalidate(res['to'], shard)
+            if "error" in res:
+                fund_log.add(res['to'], shard, -float(res['amount']))
+                print(f"{util.Typgpy.FAIL}Transaction error on shard {shard} to {res['to']}: "
+                      f"{res['error']}{util.Typgpy.ENDC}")
+
+    try:
+        return get_sender(shard).send(transactions, on_submit=on_submit, on_sent=on_sent)
+    except SendError as e:
+        # Unknown whether the node took the failed window, the balance check decides.
+        failed = [dict(t, error=str(e)) for t in e.window]
+        on_sent(failed)
+        return e.results + failed
+
+
+def fund_from_data(shard, data, check_balance):
     transactions = []
-    nonce = get_nonce(endpoints[shard], faucet_addr)
-    print(f"{util.Typgpy.HEADER}Preparing transactions for shard {shard} "
-          f"({len(data)} transaction(s)){util.Typgpy.ENDC}")
+    balances = balance_cache.get_many([dat['address'] for dat in data], shard) if check_balance else {}
     for dat in data:
-        fund_log_lock.acquire()
-        if dat['address'] not in fund_log['funded-accounts'].keys():
-            fund_log['funded-accounts'][dat['address']] = {str(i): 0 for i in range(len(endpoints))}
-        balance_log = fund_log['funded-accounts'][dat['address']]
-        fund_log_lock.release()
-        fund_amount = float(dat['amount']) - balance_log[str(shard)]  # WARNING: Always fund the difference.
-        balance = get_balance(dat['address'], endpoints[shard])
-        if fund_amount > 0 and balance < fund_amount or args.force:
+        fund_amount = float(dat['amount']) - fund_log.get(dat['address'], shard)  # WARNING: Always fund the difference.
+        if check_balance:
+            should_fund = fund_amount > 0 and balances[dat['address']] < fund_amount
+        else:
+            should_fund = fund_amount > 0
+        if should_fund or args.force:
             transactions.append({
-                "from": faucet_addr,
                 "to": dat['address'],
-                "from-shard": str(shard),
-                "to-shard": str(shard),
-                "passphrase-string": "",
-                "amount": str(fund_amount) if fund_amount > 0 else str(dat['amount']),
-                "nonce": str(nonce),
+                "to-shard": shard,
+                "amount": fund_amount if fund_amount > 0 else dat['amount'],
             })
-            nonce += 1
-    filename = f"./fund-{os.environ['HMY_PROFILE']}.s{shard}.json"
-    with open(filename, 'w') as f:
-        json.dump(transactions, f, indent=4)
-    command = f"hmy --node={endpoints[shard]} transfer --file {filename} --chain-id {chain_id} --timeout 0"
-    if transactions:
-        print(f"{util.Typgpy.HEADER}Sending {len(transactions)} transaction(s) on shard {shard}!{util.Typgpy.ENDC}")
-        try:
-            print(f"{util.Typgpy.HEADER}Transaction for shard {shard}:\n{util.Typgpy.OKGREEN}"
-                  f"{cli.single_call(command, timeout=int(args.timeout) * len(endpoints) * len(args.accounts))} "
-                  f"{util.Typgpy.ENDC}")
-        except Exception as e:
-            print(f"{util.Typgpy.FAIL}Transaction error: {e}{util.Typgpy.ENDC}")
-    else:
-        print(f"{util.Typgpy.FAIL}No transactions to send on shard {shard}!{util.Typgpy.ENDC}")
+    return send_funds(shard, transactions)
+
+
+def parse_csv_row(raw_amount, raw_address):
+    """
+    Returns the funding candidate of a CSV row, None if the row should be skipped.
+
+    Raises ValueError if the row has a malformed address or amount.
+    """
+    if not (raw_address and raw_address.startswith('one1') and raw_amount):
+        return None
+    if not bech32.is_valid_address(raw_address):
+        raise ValueError("not a valid one1 address")
+    return {
+        'amount': float(raw_amount.replace(',', '')),
+        'address': raw_address
+    }
+
+
+def _parse_csv_row_safe(row):
+    try:
+        return parse_csv_row(*row), None
+    except ValueError as e:
+        return None, (row[1], e)
 
 
 def parse_csv():
+    """
+    Streams the CSV rows through the in-process address validation,
+    spread over a process pool if `--workers` is more than 1.
+    """
     data = []
     if args.csv is not None:
         with open(args.csv, 'r') as f:
-            for row in csv.DictReader(f):
-                raw_amount, raw_address = row['funded'].strip(), row['validator address'].strip()
-                if raw_address and raw_address.startswith('one1') and raw_amount:
-                    sys.stdout.write(f"\rLoading address: {raw_address} to funding candidate from CSV.")
-                    sys.stdout.flush()
-                    try:
-                        cli.single_call(f"hmy utility bech32-to-addr {raw_address}")
-                        data.append({
-                            'amount': float(raw_amount.replace(',', '')),
-                            'address': raw_address
-                        })
-                    except Exception as e:  # catch all to not halt script
-                        print(f"{util.Typgpy.FAIL}\nError when parsing CSV file (addr `{raw_address}`). {e}{util.Typgpy.ENDC}")
+            rows = ((row['funded'].strip(), row['validator address'].strip()) for row in csv.DictReader(f))
+            pool = Pool(args.workers) if args.workers > 1 else None
+            try:
+                results = pool.imap(_parse_csv_row_safe, rows, chunksize=1000) if pool \
+                    else map(_parse_csv_row_safe, rows)
+                for dat, err in results:
+                    if err is not None:
+                        print(f"{util.Typgpy.FAIL}\nError when parsing CSV file (addr `{err[0]}`). {err[1]}{util.Typgpy.ENDC}")
                         print(f"{util.Typgpy.WARNING}Skipping...{util.Typgpy.ENDC}")
+                    elif dat is not None:
+                        data.append(dat)
+                        if len(data) % 1000 == 0:
+                            sys.stdout.write(f"\rLoaded {len(data)} funding candidate(s) from CSV.")
+                            sys.stdout.flush()
+            finally:
+                if pool:
+                    pool.close()
+        print(f"\rLoaded {len(data)} funding candidate(s) from CSV.")
     return data
 
 
 def get_balance_from_node_ip(address, endpoint_list):
     """
-    Assumes that endpoints provided are ips and that the CLI
-    only returns the balances for a specific shard.
+    Assumes that endpoints provided are ips and that each
+    endpoint only returns the balances for its own shard.
     """
-    balances = []
-    for endpoint in endpoint_list:
-        cli_bal = json.loads(cli.single_call(f"hmy --node={endpoint} balances {address}"))
-        assert len(cli_bal) == 1, f"Expect CLI to only return balances for 1 shard. Got: {cli_bal}"
-        balances.append(cli_bal[0])
-    return balances
+    return [{"shard": shard, "amount": get_balance(address, endpoint)}
+            for shard, endpoint in enumerate(endpoint_list)]
 
 
 if __name__ == "__main__":
@@ -279,7 +283,9 @@ if __name__ == "__main__":
         print(f"{util.Typgpy.HEADER}No accounts to fund...{util.Typgpy.ENDC}")
         exit()
     setup()
-    assert cli.get_accounts(faucet_addr), f"`{faucet_addr}` is not found in CLI's keystore"
+    faucet_names = cli.get_accounts(faucet_addr)
+    assert faucet_names, f"`{faucet_addr}` is not found in CLI's keystore"
+    faucet_key = signing.load_private_key_from_cli(cli.get_account_keystore_path(), faucet_names[0])
     net_config = get_network_config()
     chain_id = get_chain_id(net_config)
     endpoints = get_endpoints(net_config)
@@ -308,24 +314,6 @@ if __name__ == "__main__":
         exit()
 
     print("")
-    pool = ThreadPool(processes=len(endpoints))
-    shard_iter = iter(args.shards)
-    threads = []
-
-    try:
-        while True:
-            threads.clear()
-            for _ in range(os.cpu_count()):
-                i = next(shard_iter)
-                threads.append(pool.apply_async(fund, (i, csv_data)))
-            for t in threads:
-                t.get()
-    except StopIteration:
-        for t in threads:
-            t.get()
-        threads.clear()
-
-    print(f"{util.Typgpy.HEADER}Finished sending transactions!{util.Typgpy.ENDC}")
     if csv_data:
         check_data = csv_data
     else:
@@ -335,27 +323,62 @@ if __name__ == "__main__":
                 'amount': args.amount,
                 'address': addr
             })
-    print(f"{util.Typgpy.HEADER}Sleeping 60 seconds before checking balances{util.Typgpy.ENDC}")
-    time.sleep(60)
-    print(f"{util.Typgpy.HEADER}Checking {len(check_data)} balances....{util.Typgpy.ENDC}")
+    target_amounts = {dat['address']: float(dat['amount']) for dat in check_data}
+    trackers = {}
+
+    def confirm(shard, results):
+        tracker = ConfirmationTracker(endpoints[shard], batch_size=args.batch_size)
+        for res in results:
+            if "hash" in res:
+                tracker.add(res["hash"], res)
+        print(f"{util.Typgpy.HEADER}Shard {shard}: waiting up to {args.timeout} seconds for {len(tracker.pending)} "
+              f"transaction receipt(s){util.Typgpy.ENDC}")
+        tracker.wait(timeout=args.timeout)
+        trackers[shard] = tracker
+        return {"confirmed": len(tracker.confirmed), "unconfirmed": len(tracker.unconfirmed())}
+
+    balance_cache = BalanceCache(endpoints, batch_size=args.batch_size)
+    if args.csv is not None:
+        balance_cache.sweep([dat['address'] for dat in check_data], [s for s in args.shards if s < len(endpoints)])
+    # One submitter per shard: a shard's chunks share one sender and its nonce counter, concurrent windows
+    # would interleave their nonces. A failed chunk is safe to retry, what it submitted is already
+    # credited in the funding log. Failed transactions end up in the balance check below.
+    scheduler = ShardScheduler(fund, concurrency=1)
+    jobs = {shard: chunks(check_data, args.chunk_size) for shard in args.shards if shard < len(endpoints)}
+    shard_results = scheduler.run(jobs, finalize=confirm)
+    print(f"{util.Typgpy.HEADER}Finished sending transactions!{util.Typgpy.ENDC}")
+
+    to_check = {}
+    for shard, shard_result in sorted(shard_results.items()):
+        tracker = trackers[shard]
+        for res in tracker.unconfirmed():
+            fund_log.add(res['to'], shard, -float(res['amount']))  # Balance check below decides.
+        to_check[shard] = [res['to'] for res in tracker.unconfirmed()]
+        for res in shard_result["results"]:
+            if "error" in res:
+                to_check[shard].extend([res['to']] if 'to' in res else [dat['address'] for dat in res['chunk']])
+        print(f"{util.Typgpy.HEADER}Shard {shard}: {shard_result['sent']} sent, {shard_result['confirmed']} confirmed, "
+              f"{shard_result['unconfirmed']} unconfirmed, {shard_result['failed']} rejected "
+              f"in {shard_result['elapsed']:.1f}s{util.Typgpy.ENDC}")
+
+    check_count = sum(len(addrs) for addrs in to_check.values())
+    print(f"{util.Typgpy.HEADER}Checking {check_count} balances of unconfirmed transactions....{util.Typgpy.ENDC}")
     failed = False
-    for j, dat in enumerate(check_data):
-        fund_log_lock.acquire()
-        if dat['address'] not in fund_log['funded-accounts'].keys():
-            fund_log['funded-accounts'][dat['address']] = {str(i): 0 for i in range(len(endpoints))}
-        balance_log = fund_log['funded-accounts'][dat['address']]
-        fund_log_lock.release()
-        for shard in args.shards:
-            balance = get_balance(dat['address'], endpoints[int(shard)])
+    for shard, addresses in to_check.items():
+        if not addresses:
+            continue
+        balances = balance_cache.get_many(addresses, shard)
+        for address, balance in balances.items():
             print(json.dumps({
-                'address': dat['address'],
+                'address': address,
                 'balance': balance,
                 'shard': int(shard)
             }))
-            balance_log[shard] = max(balance_log[str(shard)], balance)
-            save_log()
-            if balance < float(dat["amount"]):
-                print(f"{util.Typgpy.FAIL}{dat['address']} did not get funded on shard {shard}{util.Typgpy.ENDC}")
+            fund_log.update_max(address, shard, balance)
+            if balance < target_amounts[address]:
+                print(f"{util.Typgpy.FAIL}{address} did not get funded on shard {shard}{util.Typgpy.ENDC}")
                 failed = True
+    save_log()
+    print(f"{util.Typgpy.HEADER}Read {balance_cache.reads} balance(s) in total{util.Typgpy.ENDC}")
     if not failed:
-        print(f"{util.Typgpy.HEADER}Successfully checked {len(check_data)} balances!{util.Typgpy.ENDC}")
+        print(f"{util.Typgpy.HEADER}Successfully funded {len(check_data)} account(s)!{util.Typgpy.ENDC}")
@@ -4,7 +4,7 @@ import argparse
 import logging
 import sys
 
-from utils import utils
+from utils import distribution, utils
 
 logging.basicConfig(level=logging.INFO, format='%(threadName)s %(asctime)s - %(name)s - %(levelname)s - %(message)s')
 LOGGER = logging.getLogger(__file__)
@@ -14,8 +14,9 @@ LOGGER.setLevel(logging.INFO)
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='This script helps you to genereate distribution config')
     parser.add_argument('--ip_list_file', type=str, dest='ip_list_file',
-                        default='raw_ip.txt', help="the file containing available raw ips")
+                        default='raw_ip.txt', help="the file containing available raw ips, 'ip node_name_tag [region [cloud]]' per line")
     # If the ip_list_file is None we need to use the region, node_name_tag and region_config to collect raw_ip                        
+    parser.add_argument('--profile', type=str, dest='profile', default='default', help="AWS profile")
     parser.add_argument('--region', type=str, dest='region_number',
                         default="4", help="region number")
     parser.add_argument('--node_name_tag', type=str,
@@ -31,11 +32,16 @@ if __name__ == "__main__":
                         dest='distribution_config', default='distribution_config.txt')
     args = parser.parse_args()
 
-    if args.ip_list_file == None:
-        utils.generate_distribution_config2(
-                args.region_number, args.node_name_tag, args.region_config,
+    if not args.ip_list_file:
+        rows = utils.generate_distribution_config2(
+                args.profile, args.region_number, args.node_name_tag, args.region_config,
                 args.shard_number, args.explorer_number, args.client_number, args.distribution_config, args.commander_number)
     else:
-        utils.generate_distribution_config3(args.shard_number, args.explorer_number, args.client_number,
-                                            args.ip_list_file, args.distribution_config, args.commander_number)
+        rows = utils.generate_distribution_config3(args.shard_number, args.explorer_number, args.client_number,
+                                                   args.ip_list_file, args.distribution_config, args.commander_number)
+    if not rows:
+        sys.exit(1)
+    for shard, localities in sorted(distribution.shard_localities(rows).items()):
+        LOGGER.info("shard %d: %d validators, %s" % (shard, sum(localities.values()), ", ".join(
+            "%s%s:%d" % (cloud + "/" if cloud else "", region, count) for (cloud, region), count in sorted(localities.items()))))
     LOGGER.info("Done writing %s" % args.distribution_config)
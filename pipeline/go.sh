@@ -344,7 +344,7 @@ function analyze_logs
    find logs/$TS/leader -name zerolog-validator-*.log > logs/$TS/all-leaders.txt
    find logs/$TS/validator -name zerolog-validator-*.log > logs/$TS/all-validators.txt
    logging analyzing logs in $(cat logs/$TS/all-leaders.txt)
-   ${THEPWD}/cal_tps.sh logs/$TS/all-leaders.txt logs/$TS/all-validators.txt | tee ${THEPWD}/logs/$TS/tps.txt
+   python3 ${THEPWD}/cal_tps.py logs/$TS/all-leaders.txt logs/$TS/all-validators.txt | tee ${THEPWD}/logs/$TS/tps.txt
    expense analysis
 }
 
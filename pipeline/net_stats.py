@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Block propagation latency from leader and validator logs, port of tools/net_stats.sh.
+
+Every log file is read once (in parallel) to extract the leader's block send
+times and the validators' `Received Announce Message` times. Round r of a shard
+is the r-th send of its leader and the r-th receive on each validator. Per round
+the time it took for 50%, 90% and 100% of the validators that got the block is
+computed with NumPy over a (validators x rounds) matrix.
+
+The log layout is the same as net_stats.sh:
+    <logdir>/distribution_config.txt
+    <logdir>/leader/tmp_log/log-<session>/leader-<ip>-*.log
+    <logdir>/validator/tmp_log/log-<session>/validator-<ip>-*.log
+
+Example usage:
+    python3 net_stats.py -D 20181109.215322
+    python3 net_stats.py -D 20181109.215322 -p p2 --json
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+PATTERNS = {
+    'p1': 'START BLOCK PROPAGATION',
+    'p2': '"Size":3[3|4]',
+    'p3': 'Stop encoding block',
+}
+RECEIVED = 'Received Announce Message'
+QUANTILES = (50, 90, 100)
+MISSING = np.iinfo(np.int64).max
+
+_time = re.compile(r'"t":"(.*)Z"')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Block propagation latency report')
+    parser.add_argument("-D", dest="logdir", default=os.getcwd(), help="Root directory of the log files")
+    parser.add_argument("-S", dest="session", default=None,
+                        help="Session ID (default: inferred from the log directory name)")
+    parser.add_argument("-p", dest="pattern", default="p1", choices=sorted(PATTERNS.keys()),
+                        help="Leader log pattern generation. p1: 'START BLOCK PROPAGATION', "
+                             "p2: legacy '\"Size\":3[3|4]', p3: even older 'Stop encoding block'")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--processes", type=int, default=None, help="Number of parser processes (default #cpus)")
+    return parser.parse_args()
+
+
+def read_distribution(path):
+    """
+    Returns a dict of shard -> {'leader': ip or None, 'validators': [ip, ...]}.
+    """
+    shards = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4 or fields[2] not in ('leader', 'validator'):
+                continue
+            shard = shards.setdefault(int(fields[3]), {'leader': None, 'validators': []})
+            if fields[2] == 'leader':
+                shard['leader'] = fields[0]
+            else:
+                shard['validators'].append(fields[0])
+    return shards
+
+
+def extract_times(job):
+    """
+    Single pass over the log files of one node, returns the `t` timestamps (str, without the
+    trailing Z) of the lines matching `pattern`, in log order.
+    """
+    paths, pattern = job
+    pattern = re.compile(pattern)
+    times = []
+    for path in paths:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if pattern.search(line):
+                    m = _time.search(line)
+                    if m:
+                        times.append(m.group(1))
+    return times
+
+
+def to_ns(times):
+    return np.array(times, dtype='datetime64[ns]').astype(np.int64)
+
+
+def propagation(sent, received):
+    """
+    `sent` is an int64 array of send times (ns) per round, `received` an int64 (nodes x rounds)
+    array of receive times (ns) with MISSING where a node has no receive for that round.
+
+    Returns a dict of quantile -> array of latency (s, NaN if no node received) per round for that
+    fraction of the nodes that received the block, plus `received`, the number of nodes per round.
+    """
+    present = received != MISSING
+    # Differences stay in int64 ns, epoch nanoseconds do not fit in a float64 without rounding.
+    delays = np.sort(np.where(present, received - sent[np.newaxis, :], MISSING), axis=0)
+    counts = np.count_nonzero(present, axis=0)
+    curves = {'received': counts}
+    for q in QUANTILES:
+        if not delays.shape[0]:
+            curves[q] = np.full(len(sent), np.nan)
+            continue
+        idx = np.clip(np.ceil(counts * q / 100).astype(np.int64) - 1, 0, delays.shape[0] - 1)
+        curve = np.take_along_axis(delays, idx[np.newaxis, :], axis=0)[0] / 1e9
+        curve[counts == 0] = np.nan
+        curves[q] = curve
+    return curves
+
+
+def analyze(logdir, session, pattern, processes=None):
+    shards = read_distribution(os.path.join(logdir, 'distribution_config.txt'))
+    jobs, keys = [], []
+    for s, nodes in sorted(shards.items()):
+        if nodes['leader'] is not None:
+            keys.append((s, 'leader', nodes['leader']))
+            jobs.append((sorted(glob.glob(f"{logdir}/leader/tmp_log/log-{session}/leader-{nodes['leader']}-*.log")),
+                         pattern))
+        for ip in nodes['validators']:
+            paths = sorted(glob.glob(f"{logdir}/validator/tmp_log/log-{session}/validator-{ip}-*.log"))
+            if paths:
+                keys.append((s, 'validator', ip))
+                jobs.append((paths, RECEIVED))
+    with Pool(max(1, min(processes or cpu_count(), len(jobs)))) as pool:
+        extracted = dict(zip(keys, pool.map(extract_times, jobs, chunksize=1)))
+
+    report = {'shards': {}}
+    for s in sorted(shards.keys()):
+        sent = [times for (shard, role, _), times in extracted.items() if shard == s and role == 'leader']
+        if not sent or not sent[0]:
+            continue
+        sent = to_ns(sent[0])
+        rows = [times for (shard, role, _), times in extracted.items() if shard == s and role == 'validator']
+        received = np.full((len(rows), len(sent)), MISSING, dtype=np.int64)
+        for i, times in enumerate(rows):
+            times = to_ns(times[:len(sent)])
+            received[i, :len(times)] = times
+        curves = propagation(sent, received)
+        report['shards'][s] = {
+            'rounds': len(sent),
+            'validators': len(rows),
+            'received': curves['received'].tolist(),
+            **{f"p{q}": [None if np.isnan(v) else float(v) for v in curves[q]] for q in QUANTILES},
+        }
+
+    full = np.array([v for shard in report['shards'].values() for v in shard['p100'] if v is not None])
+    if len(full):
+        report.update({'min': float(full.min()), 'max': float(full.max()), 'avg': float(full.mean()),
+                       'median': float(np.median(full))})
+    return report
+
+
+def print_report(report):
+    for s, shard in report['shards'].items():
+        for r in range(shard['rounds']):
+            latencies = ", ".join("-" if shard[f"p{q}"][r] is None else f"p{q} {shard[f'p{q}'][r]:.9f}s"
+                                  for q in QUANTILES)
+            print(f"shard{s}/round{r}: {latencies} ({shard['received'][r]}/{shard['validators']} received)")
+    for key in ('min', 'max', 'avg', 'median'):
+        if key in report:
+            print(f"{key}:{report[key]}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logdir = os.path.abspath(args.logdir)
+    session = args.session or os.path.basename(logdir)
+    report = analyze(logdir, session, PATTERNS[args.pattern], args.processes)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -1,32 +1,20 @@
 import argparse
 import ipaddress
+import json
 import logging
+import os
 from pprint import pprint
+import re
 import sys
 import time
 import uuid
 
 import boto3
+import botocore.exceptions
 
 logger = logging.getLogger(__name__)
 
 
-def list_hosted_zones(client):
-    """List hosted zones in Route 53.
-    
-    :param client: the Route 53 client.
-    :return: zone objects.
-    :rtype: generator
-    """
-    kwargs = dict()
-    while True:
-        resp = client.list_hosted_zones(**kwargs)
-        yield from resp['HostedZones']
-        if not resp['IsTruncated']:
-            break
-        kwargs.update(Marker=resp['NextMarker'])
-
-
 def get_rrsets(client, zone_id, name, rrtype=None):
     """Get resource record sets.
 
@@ -60,20 +48,139 @@ def get_rrsets(client, zone_id, name, rrtype=None):
                 kwargs[f'StartRecord{arg_name}'] = arg_value
 
 
+def list_all_rrsets(client, zone_id):
+    """List every resource record set in a zone.
+
+    :param client: the Route 53 client.
+    :param zone_id: the hosted zone ID.
+    :type zone_id: `str`
+    :return: resource record sets.
+    :rtype: generator
+    """
+    kwargs = dict(HostedZoneId=zone_id)
+    while True:
+        resp = client.list_resource_record_sets(**kwargs)
+        yield from resp['ResourceRecordSets']
+        if not resp['IsTruncated']:
+            return
+        for arg_name in ('Name', 'Type', 'Identifier'):
+            try:
+                kwargs[f'StartRecord{arg_name}'] = resp[f'NextRecord{arg_name}']
+            except KeyError:
+                kwargs.pop(f'StartRecord{arg_name}', None)
+
+
+DEFAULT_CACHE_FILE = os.path.expanduser('~/.cache/r53update.json')
+DEFAULT_CACHE_TTL = 300
+
+
+class Route53Cache:
+    """Cache of hosted zones and zone record sets.
+
+    Zones are kept on disk and refetched after `ttl` seconds.  Record sets
+    are kept in memory only: every run lists a zone once, so the "already
+    up to date" decision never rests on records another run or a manual
+    edit may have changed since.  Changes submitted by this run are
+    applied to the cached record sets of their zone.
+    A cache file of `None` keeps the zones in memory only.
+    """
+
+    def __init__(self, client, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self._data = dict(zones={}, rrsets={})
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self._data['zones'].update(json.load(f).get('zones', {}))
+            except (OSError, ValueError) as e:
+                logger.warning(f"ignoring unreadable cache {path!r}: {e}")
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry['time'] < self.ttl
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.tmp.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(dict(zones=self._data['zones']), f)
+        os.replace(tmp, self.path)
+
+    def get_zone(self, name):
+        """Get a hosted zone by its exact name.
+
+        Uses `list_hosted_zones_by_name`, which starts right at the zone,
+        instead of listing every zone in the account.
+
+        :param name: the zone name, with the trailing dot.
+        :return: the zone object, or `None` if there is no such zone.
+        """
+        entry = self._data['zones'].get(name)
+        if not self._fresh(entry):
+            logger.debug(f"looking up zone {name!r}")
+            resp = self.client.list_hosted_zones_by_name(DNSName=name, MaxItems='1')
+            zone = next((zone for zone in resp['HostedZones']
+                         if zone['Name'] == name), None)
+            if zone is None:
+                # not cached, the zone may get created by another run
+                return None
+            entry = self._data['zones'][name] = dict(time=time.time(), zone=zone)
+        return entry['zone']
+
+    def add_zone(self, zone):
+        self._data['zones'][zone['Name']] = dict(time=time.time(), zone=zone)
+
+    def get_rrsets(self, zone_id, refresh=False):
+        """Get all record sets of a zone, indexed by (name, type).
+
+        The whole zone is read in one `list_resource_record_sets` sweep.
+        """
+        entry = self._data['rrsets'].get(zone_id)
+        if refresh or not self._fresh(entry):
+            logger.debug(f"listing record sets of zone {zone_id!r}")
+            entry = self._data['rrsets'][zone_id] = dict(
+                    time=time.time(), rrsets=list(list_all_rrsets(self.client, zone_id)))
+        rrsets = {}
+        for rrset in entry['rrsets']:
+            rrsets.setdefault((rrset['Name'], rrset['Type']), []).append(rrset)
+        return rrsets
+
+    def apply_changes(self, zone_id, changes):
+        """Apply a submitted change batch to the cached record sets of a zone."""
+        entry = self._data['rrsets'].get(zone_id)
+        if entry is None:
+            return
+        rrsets = entry['rrsets']
+        for change in changes:
+            rrset = change['ResourceRecordSet']
+            key = (rrset['Name'], rrset['Type'], rrset.get('SetIdentifier'))
+            rrsets[:] = [r for r in rrsets
+                         if (r['Name'], r['Type'], r.get('SetIdentifier')) != key]
+            if change['Action'] != 'DELETE':
+                rrsets.append(rrset)
+
+    def invalidate_rrsets(self, zone_id):
+        self._data['rrsets'].pop(zone_id, None)
+
+
 DEFAULT_SHARD_FORMAT = 's{shard}'
 DEFAULT_LEADER_FORMAT = 'l{shard}'
 DEFAULT_ZONE_FORMAT = '{network}.hmny.io.'
 
 
-def _find_parent(zones, name):
+def _find_parent(cache, name):
     labels = name.split('.')
     for idx in range(len(labels)):
         subzone_name = '.'.join(labels[:idx])
         parent = '.'.join(labels[idx:])
-        try:
-            return zones[parent], subzone_name
-        except KeyError:
-            pass
+        if not parent:
+            break
+        zone = cache.get_zone(parent)
+        if zone is not None:
+            return zone, subzone_name
     return None, None
 
 
@@ -105,6 +212,235 @@ def _create_subzone(client, zone_name, parent_zone_id):
     return zone
 
 
+RRTYPE_BY_VERSION = {4: 'A', 6: 'AAAA'}
+RECORD_TTL = 300
+# Route 53 limits per ChangeResourceRecordSets request
+MAX_BATCH_RECORDS = 1000
+MAX_BATCH_VALUE_CHARS = 32000
+
+
+def read_manifest(spec):
+    """Read a batch manifest.
+
+    `spec` is either ``NETWORK=DIR``, where DIR holds ``shard<N>.txt`` files
+    with one node IP per line (such as ``logs/<profile>``), or a file with
+    ``NETWORK SHARD NODE...`` lines.  The first node of a shard is its leader.
+
+    :return: (network, shard, node IPs) tuples.
+    :rtype: list
+    :raise ValueError: if DIR of a ``NETWORK=DIR`` spec is not a directory,
+        or a node IP is malformed.
+    """
+    entries = []
+    network, sep, path = spec.partition('=')
+    if sep:
+        if not os.path.isdir(path):
+            raise ValueError(f"manifest directory {path!r} of network "
+                             f"{network!r} is not found")
+        for filename in sorted(os.listdir(path)):
+            m = re.fullmatch(r'shard(\d+)\.txt', filename)
+            if m is None:
+                continue
+            with open(os.path.join(path, filename)) as f:
+                nodes = [ipaddress.ip_address(line.split()[0])
+                         for line in f if line.strip()]
+            entries.append((network, int(m.group(1)), nodes))
+        return entries
+    with open(spec) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            entries.append((fields[0], int(fields[1]),
+                            [ipaddress.ip_address(ip) for ip in fields[2:]]))
+    return entries
+
+
+def _resolve_zone(args, r53, cache, zone_name):
+    logger.debug(f"retrieving zone ID for zone {zone_name!r}")
+    parent_zone, subzone_name = _find_parent(cache, zone_name)
+    if subzone_name is None:
+        # not found, not even potential parent
+        logger.error(f"zone {zone_name!r} is not found")
+        return None
+    logger.debug(f"parent {parent_zone['Name']!r}, subzone {subzone_name!r}")
+    if subzone_name == '':
+        # exact match
+        return parent_zone
+    if not args.create_zone:
+        logger.error(f"zone {zone_name!r} is not found; "
+                     f"add --create-zone to create in {parent_zone['Name']!r}")
+        return None
+    logger.info(f"zone {zone_name!r} is not found, "
+                f"creating in {parent_zone['Name']!r}")
+    zone = _create_subzone(r53, zone_name, parent_zone['Id'])
+    cache.add_zone(zone)
+    cache.invalidate_rrsets(parent_zone['Id'])
+    return zone
+
+
+def desired_rrsets(shard_name, leader_name, node_ips):
+    """Compute the records a shard should have.
+
+    :return: dict of (name, rrtype) -> sorted, deduplicated IP strings;
+        an empty list means the rrset should not exist.
+    """
+    desired = {}
+    for version, rrtype in RRTYPE_BY_VERSION.items():
+        desired[(shard_name, rrtype)] = sorted(
+                {ip for ip in node_ips if ip.version == version})
+        desired[(leader_name, rrtype)] = (
+                [node_ips[0]] if node_ips and node_ips[0].version == version
+                else [])
+    return {key: [str(ip) for ip in ips] for key, ips in desired.items()}
+
+
+def _matches(rrsets, ips):
+    if len(rrsets) != 1 or 'SetIdentifier' in rrsets[0]:
+        return False
+    rrset = rrsets[0]
+    values = sorted(ipaddress.ip_address(rr['Value'])
+                    for rr in rrset.get('ResourceRecords', []))
+    return (rrset.get('TTL') == RECORD_TTL and
+            values == sorted(ipaddress.ip_address(ip) for ip in ips))
+
+
+def plan_changes(rrsets, desired):
+    """Diff desired records against the current record sets of a zone.
+
+    A record set that differs is replaced with a single UPSERT, one that is
+    no longer wanted is deleted, and one that is already correct gets no
+    change at all.
+
+    :param rrsets: current record sets, as returned by
+        `Route53Cache.get_rrsets`.
+    :param desired: as returned by `desired_rrsets`.
+    :return: change groups, the changes of one group must be submitted in
+        the same batch.
+    :rtype: list
+    """
+    groups = []
+    for (name, rrtype), ips in desired.items():
+        current = rrsets.get((name, rrtype), [])
+        if not current and not ips:
+            continue
+        if ips and _matches(current, ips):
+            logger.debug(f"{name!r} {rrtype} is up to date")
+            continue
+        group = []
+        # weighted/latency record sets cannot be upserted into a simple one
+        stale = current if not ips or len(current) > 1 or (
+                current and 'SetIdentifier' in current[0]) else []
+        for old_rrset in stale:
+            logger.info(f"scheduling removal of {name!r} {rrtype} RRs")
+            group.append({'Action': 'DELETE', 'ResourceRecordSet': old_rrset})
+        if ips:
+            logger.info(f"scheduling {name!r} {rrtype} -> {', '.join(ips)}")
+            group.append({
+                'Action': 'UPSERT',
+                'ResourceRecordSet': {
+                    'Name': name,
+                    'Type': rrtype,
+                    'TTL': RECORD_TTL,
+                    'ResourceRecords': [{'Value': ip} for ip in ips],
+                },
+            })
+        groups.append(group)
+    return groups
+
+
+def _change_cost(change):
+    records = change['ResourceRecordSet'].get('ResourceRecords', [])
+    factor = 2 if change['Action'] == 'UPSERT' else 1
+    return (factor * len(records),
+            factor * sum(len(rr['Value']) for rr in records))
+
+
+def split_batches(groups, max_records=MAX_BATCH_RECORDS,
+                  max_chars=MAX_BATCH_VALUE_CHARS):
+    """Pack change groups into as few change batches as the limits allow."""
+    batches, batch, records, chars = [], [], 0, 0
+    for group in groups:
+        group_records, group_chars = map(sum, zip(*map(_change_cost, group)))
+        if batch and (records + group_records > max_records or
+                      chars + group_chars > max_chars):
+            batches.append(batch)
+            batch, records, chars = [], 0, 0
+        batch.extend(group)
+        records += group_records
+        chars += group_chars
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def submit_changes(r53, cache, zone_id, plan):
+    """Submit the changes of a zone.
+
+    :param plan: function of the zone's current record sets returning
+        change groups (see `plan_changes`); it is called again on a fresh
+        sweep of the zone if Route 53 rejects a batch built from stale
+        cached records.
+    :return: change IDs.
+    :rtype: list
+    """
+    change_ids = []
+    for attempt in range(2):
+        batches = split_batches(plan(cache.get_rrsets(zone_id,
+                                                      refresh=attempt > 0)))
+        try:
+            for batch in batches:
+                logger.debug(f"requesting change batch={batch!r}")
+                resp = r53.change_resource_record_sets(
+                        HostedZoneId=zone_id, ChangeBatch={'Changes': batch})
+                cache.apply_changes(zone_id, batch)
+                change_ids.append(resp['ChangeInfo']['Id'])
+                logger.info(f"request submitted, id={change_ids[-1]!r}")
+            return change_ids
+        except botocore.exceptions.ClientError as e:
+            cache.invalidate_rrsets(zone_id)
+            if e.response['Error']['Code'] != 'InvalidChangeBatch' or attempt:
+                raise
+            # the cached record sets were stale, replan from a fresh sweep
+            logger.info(f"change batch rejected ({e}), "
+                        f"retrying with fresh records")
+    return change_ids
+
+
+def wait_for_changes(r53, change_ids):
+    """Wait for all changes to be in sync, polling them together.
+
+    :return: whether all changes succeeded.
+    """
+    logger.info(f"waiting for {len(change_ids)} request(s) to finish "
+                f"(may take some time)")
+    pending = list(change_ids)
+    ok = True
+    backoff = 1.0
+    backoff_rate = 1.2
+    max_backoff = 10.0
+    while pending:
+        still_pending = []
+        for change_id in pending:
+            logger.debug(f"checking request {change_id!r} status")
+            resp = r53.get_change(Id=change_id)
+            status = resp['ChangeInfo']['Status']
+            logger.debug(f"request {change_id!r} status={status!r}")
+            if status == 'PENDING':
+                still_pending.append(change_id)
+            elif status != 'INSYNC':
+                logger.error(f"request {change_id!r} failed, "
+                             f"status={status!r}")
+                ok = False
+        pending = still_pending
+        if pending:
+            time.sleep(backoff)
+            backoff = min(backoff * backoff_rate, max_backoff)
+    if ok:
+        logger.info(f"request(s) succeeded")
+    return ok
+
+
 def main():
     logging.basicConfig()
     parser = argparse.ArgumentParser()
@@ -129,42 +465,59 @@ def main():
                                  (default: {DEFAULT_LEADER_FORMAT})""")
     parser.add_argument('--aws-profile', metavar='NAME',
                         help=f"""AWS config/credential profile name""")
-    parser.add_argument('network', metavar='NETWORK',
+    parser.add_argument('--cache-file', metavar='PATH',
+                        help=f"""hosted zone cache file
+                                 (default: {DEFAULT_CACHE_FILE})""")
+    parser.add_argument('--cache-ttl', type=float, metavar='SECONDS',
+                        help=f"""seconds before cached zones are refetched
+                                 (default: {DEFAULT_CACHE_TTL})""")
+    parser.add_argument('--no-cache', action='store_const', const=True,
+                        help="do not read or write the cache file")
+    parser.add_argument('--manifest', action='append', metavar='SPEC',
+                        help="""batch mode, update all shards of a manifest:
+                                NETWORK=DIR with DIR/shard<N>.txt node lists
+                                (such as logs/<profile>), or a file of
+                                `NETWORK SHARD NODE...` lines; may be repeated,
+                                replaces the NETWORK/SHARD/NODE arguments""")
+    parser.add_argument('network', metavar='NETWORK', nargs='?',
                         help="network ID (example: t0)")
-    parser.add_argument('shard', type=int, metavar='SHARD',
+    parser.add_argument('shard', type=int, metavar='SHARD', nargs='?',
                         help="shard ID (example: 0)")
     parser.add_argument('nodes', type=ipaddress.ip_address, nargs='*',
                         metavar='NODE', help="node IP (first is leader)")
     parser.set_defaults(zone_format=DEFAULT_ZONE_FORMAT,
                         shard_format=DEFAULT_SHARD_FORMAT,
-                        leader_format=DEFAULT_LEADER_FORMAT)
+                        leader_format=DEFAULT_LEADER_FORMAT,
+                        cache_file=DEFAULT_CACHE_FILE,
+                        cache_ttl=DEFAULT_CACHE_TTL)
     args = parser.parse_args()
 
-    # retrieve/sanitize cmdline args
-    format_args = dict(
-            network=args.network,
-            shard=args.shard,
-    )
-    def fmt(s):
-        r = s.format(**format_args)
-        logger.debug(f"formatted {s!r} -> {r!r}")
-        return r
-    zone_name = fmt(args.zone_format)
-    if not zone_name.endswith('.'):
-        zone_name += '.'
-    node_ips = args.nodes
     if args.debug:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
 
-    if node_ips:
+    if args.manifest:
+        if args.network is not None:
+            parser.error("NETWORK/SHARD/NODE cannot be given with --manifest")
+        try:
+            entries = [entry for spec in args.manifest
+                       for entry in read_manifest(spec)]
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read the manifest: {e}")
+        if not entries:
+            parser.error("no shards found in the manifest(s)")
+        if any(not nodes for _, _, nodes in entries) and not args.confirm_remove:
+            parser.error("some shards have no node IPs, their records will "
+                         "only be removed; add --confirm-remove to confirm this")
+    elif args.network is None or args.shard is None:
+        parser.error("NETWORK and SHARD are required without --manifest")
+    elif args.nodes:
         if args.confirm_remove:
             parser.error("--confirm-remove cannot be given with nodes")
-    else:
-        if not args.confirm_remove:
-            parser.error("no node IPs given, will only remove existing ones; "
-                         "add --confirm-remove to confirm this")
+    elif not args.confirm_remove:
+        parser.error("no node IPs given, will only remove existing ones; "
+                     "add --confirm-remove to confirm this")
 
     logger.debug("creating Route 53 client")
     session_kwargs = dict()
@@ -172,106 +525,79 @@ def main():
         session_kwargs.update(profile_name=args.aws_profile)
     session = boto3.Session(**session_kwargs)
     r53 = session.client('route53')
+    cache = Route53Cache(r53, None if args.no_cache else args.cache_file,
+                         args.cache_ttl)
+    try:
+        if args.manifest:
+            return _update_batch(args, r53, cache, entries)
+        return _update(args, r53, cache)
+    finally:
+        cache.save()
 
-    logger.debug(f"retrieving zone ID for zone {zone_name!r}")
-    zones = {zone['Name']: zone for zone in list_hosted_zones(r53)}
-    parent_zone, subzone_name = _find_parent(zones, zone_name)
-    logger.debug(f"parent {parent_zone['Name']!r}, subzone {subzone_name!r}")
-    if subzone_name is None:
-        # not found, not even potential parent
-        logger.error(f"zone {zone_name!r} is not found")
-        return 1
-    elif subzone_name == '':
-        # exact match
-        zone = parent_zone
-    elif not args.create_zone:
-        logger.error(f"zone {zone_name!r} is not found; "
-                     f"add --create-zone to create in {parent_zone['Name']!r}")
-        return 1
-    else:
-        logger.info(f"zone {zone_name!r} is not found, "
-                    f"creating in {parent_zone['Name']!r}")
-        zone = _create_subzone(r53, zone_name, parent_zone['Id'])
-    zone_id = zone['Id']
-
-    batch = []
-    rrtype_by_version = {4: 'A', 6: 'AAAA'}
-
-    shard_label = fmt(args.shard_format)
-    leader_label = fmt(args.leader_format)
-
-    def schedule_removal(label):
-        for rrtype in rrtype_by_version.values():
-            name = f'{label}.{zone_name}'
-            for old_rrset in get_rrsets(r53, zone_id, name, rrtype):
-                logger.info(f"scheduling removal of {name!r} {rrtype} RRs")
-                batch.append({
-                    'Action': 'DELETE',
-                    'ResourceRecordSet': old_rrset,
-                })
-
-    schedule_removal(shard_label)
-    schedule_removal(leader_label)
-
-    # classify by rrtype
-    nodes = {}
-    for node_ip in node_ips:
-        nodes.setdefault(node_ip.version, []).append(node_ip)
-
-    for version, addrs in nodes.items():
-        logger.debug(f"adding {len(addrs)} IPv{version} nodes")
-        assert addrs
-        batch.append({
-            'Action': 'CREATE',
-            'ResourceRecordSet': {
-                'Name': f'{shard_label}.{zone_name}',
-                'Type': rrtype_by_version[version],
-                'TTL': 300,
-                'ResourceRecords': [{'Value': str(addr)} for addr in addrs],
-            },
-        })
-
-    if node_ips:
-        leader = node_ips[0]
-        batch.append({
-            'Action': 'CREATE',
-            'ResourceRecordSet': {
-                'Name': f'{leader_label}.{zone_name}',
-                'Type': rrtype_by_version[leader.version],
-                'TTL': 300,
-                'ResourceRecords': [{'Value': str(leader)}],
-            },
-        })
-
-    if not batch:
-        logger.info(f"nothing to do; exiting")
+
+def _fmt(s, **format_args):
+    r = s.format(**format_args)
+    logger.debug(f"formatted {s!r} -> {r!r}")
+    return r
+
+
+def _zone_name(args, network, shard):
+    zone_name = _fmt(args.zone_format, network=network, shard=shard)
+    if not zone_name.endswith('.'):
+        zone_name += '.'
+    return zone_name
+
+
+def _update_batch(args, r53, cache, entries):
+    # group shards by zone, each zone gets the fewest batches possible
+    zones = {}
+    for network, shard, node_ips in entries:
+        zone_name = _zone_name(args, network, shard)
+        shard_name = f'{_fmt(args.shard_format, network=network, shard=shard)}.{zone_name}'
+        leader_name = f'{_fmt(args.leader_format, network=network, shard=shard)}.{zone_name}'
+        zones.setdefault(zone_name, {}).update(
+                desired_rrsets(shard_name, leader_name, node_ips))
+
+    change_ids = []
+    for zone_name, desired in zones.items():
+        zone = _resolve_zone(args, r53, cache, zone_name)
+        if zone is None:
+            return 1
+        change_ids += submit_changes(r53, cache, zone['Id'],
+                                     lambda rrsets: plan_changes(rrsets, desired))
+    if not change_ids:
+        # no change sent, nothing to wait for
+        logger.info(f"all records are up to date; nothing to do")
         return
+    if args.wait and not wait_for_changes(r53, change_ids):
+        return 1
+
 
-    logger.debug(f"requesting change batch={batch!r}")
-    resp = r53.change_resource_record_sets(
-            HostedZoneId=zone_id, ChangeBatch={'Changes': batch})
-    change_id = resp['ChangeInfo']['Id']
-    logger.info(f"request submitted, id={change_id!r}")
+def _update(args, r53, cache):
+    zone_name = _zone_name(args, args.network, args.shard)
+    zone = _resolve_zone(args, r53, cache, zone_name)
+    if zone is None:
+        return 1
 
-    if not args.wait:
+    shard_label = _fmt(args.shard_format, network=args.network, shard=args.shard)
+    leader_label = _fmt(args.leader_format, network=args.network, shard=args.shard)
+    desired = desired_rrsets(f'{shard_label}.{zone_name}',
+                             f'{leader_label}.{zone_name}', args.nodes)
+
+    def plan(rrsets):
+        # one shard's changes always go in a single batch
+        batch = [change for group in plan_changes(rrsets, desired)
+                 for change in group]
+        return [batch] if batch else []
+
+    change_ids = submit_changes(r53, cache, zone['Id'], plan)
+    if not change_ids:
+        # no change sent, nothing to wait for
+        logger.info(f"records are up to date; nothing to do")
         return
-    logger.info(f"waiting for the request to finish (may take some time)")
-    backoff = 1.0
-    backoff_rate = 1.2
-    max_backoff = 10.0
-    while True:
-        logger.debug(f"checking request status")
-        resp = r53.get_change(Id=change_id)
-        status = resp['ChangeInfo']['Status']
-        logger.debug(f"request status={status!r}")
-        if status != 'PENDING':
-            break
-        time.sleep(backoff)
-        backoff = min(backoff * backoff_rate, max_backoff)
-    if status != 'INSYNC':
-        logger.error(f"request failed, status={status!r}")
+
+    if args.wait and not wait_for_changes(r53, change_ids):
         return 1
-    logger.info(f"request succeeded")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,118 @@
+"""
+Athena query executor shared by the log analysis scripts.
+
+One client is reused for every query, many queries can be in flight at
+once and are polled together with exponential backoff, and results are
+read page by page (`NextToken`) so no row is dropped after the first page.
+
+Kept python2 compatible, `LogAnalysis.py` still runs on python2 hosts.
+"""
+
+import time
+
+DEFAULT_REGION = 'us-west-2'
+INITIAL_DELAY = 0.5
+MAX_DELAY = 16
+PAGE_SIZE = 1000
+DONE_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+
+class QueryError(RuntimeError):
+    """
+    Raised when a query ends in a FAILED or CANCELLED state.
+    """
+
+    def __init__(self, execution_id, state, reason):
+        super(QueryError, self).__init__("Query %s %s: %s" % (execution_id, state, reason))
+        self.execution_id = execution_id
+        self.state = state
+        self.reason = reason
+
+
+class AthenaExecutor(object):
+
+    def __init__(self, database, s3_output, client=None, region=DEFAULT_REGION,
+                 initial_delay=INITIAL_DELAY, max_delay=MAX_DELAY, sleep=time.sleep):
+        if client is None:
+            import boto3
+            client = boto3.client('athena', region_name=region)
+        self.client = client
+        self.database = database
+        self.s3_output = s3_output
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def start(self, query):
+        """
+        Submit `query` without waiting, returns its execution id.
+        """
+        print('Executing query: ' + query)
+        response = self.client.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={
+                'Database': self.database
+            },
+            ResultConfiguration={
+                'OutputLocation': self.s3_output,
+            }
+        )
+        print('Execution ID: ' + response['QueryExecutionId'])
+        return response['QueryExecutionId']
+
+    def wait(self, execution_ids):
+        """
+        Poll all `execution_ids` together until each one is done, the poll interval
+        doubles (up to `max_delay`) while nothing finishes and resets when one does.
+
+        Returns a dict of execution id -> `Status` dict of the finished query.
+        """
+        pending, done = list(execution_ids), {}
+        delay = self.initial_delay
+        while pending:
+            still_pending = []
+            for execution_id in pending:
+                status = self.client.get_query_execution(QueryExecutionId=execution_id)['QueryExecution']['Status']
+                if status['State'] in DONE_STATES:
+                    done[execution_id] = status
+                else:
+                    still_pending.append(execution_id)
+            if not still_pending:
+                break
+            delay = self.initial_delay if len(still_pending) < len(pending) else min(delay * 2, self.max_delay)
+            pending = still_pending
+            self.sleep(delay)
+        return done
+
+    def run(self, query):
+        """
+        Submit `query` and block until it is done, raises QueryError if it did not succeed.
+        """
+        execution_id = self.start(query)
+        self.check(execution_id, self.wait([execution_id])[execution_id])
+        return execution_id
+
+    @staticmethod
+    def check(execution_id, status):
+        if status['State'] != 'SUCCEEDED':
+            raise QueryError(execution_id, status['State'], status.get('StateChangeReason', 'unknown'))
+
+    def rows(self, execution_id, skip_header=True):
+        """
+        Yields every result row of a finished query as a list of column values (None for NULL),
+        fetching one page at a time.
+        """
+        kwargs = {'QueryExecutionId': execution_id, 'MaxResults': PAGE_SIZE}
+        first = True
+        while True:
+            page = self.client.get_query_results(**kwargs)
+            rows = page['ResultSet']['Rows']
+            if first and skip_header:
+                rows = rows[1:]
+            first = False
+            for row in rows:
+                yield [col.get('VarCharValue') for col in row['Data']]
+            token = page.get('NextToken')
+            if not token:
+                return
+            kwargs['NextToken'] = token
@@ -0,0 +1,72 @@
+import unittest
+
+from utils.athena import AthenaExecutor, QueryError
+
+
+class StubAthena:
+    """
+    Athena client stub, a query finishes after `polls` status checks and pages its rows `page_size` at a time.
+    """
+
+    def __init__(self, rows=(), polls=2, page_size=3, state='SUCCEEDED'):
+        self.rows = [["header"]] + [[r] for r in rows]
+        self.polls = polls
+        self.page_size = page_size
+        self.state = state
+        self.started = []
+        self.checks = {}
+        self.pages = 0
+
+    def start_query_execution(self, QueryString, QueryExecutionContext, ResultConfiguration):
+        self.started.append(QueryString)
+        execution_id = f"q{len(self.started)}"
+        self.checks[execution_id] = 0
+        return {"QueryExecutionId": execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        self.checks[QueryExecutionId] += 1
+        state = self.state if self.checks[QueryExecutionId] >= self.polls else 'RUNNING'
+        return {"QueryExecution": {"Status": {"State": state, "StateChangeReason": "stub"}}}
+
+    def get_query_results(self, QueryExecutionId, MaxResults, NextToken=None):
+        self.pages += 1
+        start = int(NextToken or 0)
+        page = {"ResultSet": {"Rows": [{"Data": [{"VarCharValue": v} for v in r]}
+                                       for r in self.rows[start:start + self.page_size]]}}
+        if start + self.page_size < len(self.rows):
+            page["NextToken"] = str(start + self.page_size)
+        return page
+
+
+class TestAthenaExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+
+    def executor(self, client):
+        return AthenaExecutor("db", "s3://out", client=client, sleep=self.delays.append)
+
+    def test_pages_all_rows(self):
+        client = StubAthena(rows=[f"s3://logs/{i}" for i in range(10)])
+        executor = self.executor(client)
+        execution_id = executor.run("SELECT 1")
+        self.assertEqual([r[0] for r in executor.rows(execution_id)], [f"s3://logs/{i}" for i in range(10)])
+        self.assertEqual(client.pages, 4)
+
+    def test_queries_polled_together_with_backoff(self):
+        client = StubAthena(polls=4)
+        executor = self.executor(client)
+        ids = [executor.start(q) for q in ("a", "b", "c")]
+        statuses = executor.wait(ids)
+        self.assertEqual(set(statuses), set(ids))
+        self.assertEqual(self.delays, [1, 2, 4])
+        self.assertEqual(list(client.checks.values()), [4, 4, 4])
+
+    def test_failed_query_raises(self):
+        executor = self.executor(StubAthena(polls=1, state='FAILED'))
+        with self.assertRaises(QueryError):
+            executor.run("SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
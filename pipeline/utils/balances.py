@@ -0,0 +1,73 @@
+"""
+Balance snapshot cache shared by the funding and consolidation scripts.
+
+Balances are keyed by (address, shard) and remember the block height they
+were read at. The cache is filled with batched sweeps and an entry is only
+dropped when this tool itself sends a transaction touching that account,
+so pre-checks and post-checks read each balance at most twice per run.
+"""
+
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+from utils import rpc
+
+
+class BalanceCache:
+
+    def __init__(self, endpoints, batch_size=rpc.DEFAULT_BATCH_SIZE):
+        self.endpoints = endpoints
+        self.batch_size = batch_size
+        self.reads = 0
+        self._balances = {}
+        self._lock = Lock()
+
+    def _fetch(self, addresses, shard):
+        endpoint = self.endpoints[shard]
+        height = rpc.get_block_number(endpoint)
+        balances = rpc.get_balances(endpoint, addresses, batch_size=self.batch_size)
+        with self._lock:
+            self.reads += len(balances)
+            for address, balance in balances.items():
+                self._balances[(address, shard)] = (height, balance)
+        return balances
+
+    def sweep(self, addresses, shards=None):
+        """
+        Fill the cache for all `addresses` on all `shards` (default all), one thread per shard.
+        """
+        shards = range(len(self.endpoints)) if shards is None else shards
+        addresses = list(dict.fromkeys(addresses))
+        with ThreadPool(processes=max(len(shards), 1)) as pool:
+            pool.map(lambda shard: self._fetch(addresses, shard), shards)
+
+    def get_many(self, addresses, shard, min_height=None):
+        """
+        Balances of `addresses` on `shard`, only missing or invalidated entries
+        (or ones read before `min_height`) are fetched, in one batched call.
+        """
+        result, missing = {}, []
+        with self._lock:
+            for address in addresses:
+                entry = self._balances.get((address, shard))
+                if entry is None or (min_height is not None and entry[0] < min_height):
+                    missing.append(address)
+                else:
+                    result[address] = entry[1]
+        if missing:
+            result.update(self._fetch(missing, shard))
+        return result
+
+    def get(self, address, shard, min_height=None):
+        return self.get_many([address], shard, min_height)[address]
+
+    def get_snapshot(self, address, shard):
+        """
+        Returns the cached (block height, balance) or None.
+        """
+        with self._lock:
+            return self._balances.get((address, shard))
+
+    def invalidate(self, address, shard):
+        with self._lock:
+            self._balances.pop((address, shard), None)
@@ -0,0 +1,81 @@
+import unittest
+
+from utils.balances import BalanceCache
+from utils.sender_test import StubNode
+
+ADDR1 = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"
+ADDR2 = "one17dcjcyauyr43rqh29sa9zeyvfvqc54yzuwyd64"
+
+
+class Chain:
+    """
+    Balances (in ONE) and block height served by the stub node of one shard, every balance read is counted.
+    """
+
+    def __init__(self, balances, height=10):
+        self.balances = dict(balances)
+        self.height = height
+        self.reads = []
+        self.node = StubNode(handlers={
+            "hmy_blockNumber": lambda params: {"result": hex(self.height)},
+            "hmy_getBalance": self.get_balance,
+        })
+
+    def get_balance(self, params):
+        self.reads.append(params[0])
+        return {"result": hex(self.balances[params[0]] * 10 ** 18)}
+
+
+class TestBalanceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.chains = [Chain({ADDR1: 1, ADDR2: 2}), Chain({ADDR1: 3, ADDR2: 4}, height=20)]
+        endpoints = []
+        for chain in self.chains:
+            server, endpoint = chain.node.serve()
+            self.addCleanup(server.shutdown)
+            endpoints.append(endpoint)
+        self.cache = BalanceCache(endpoints)
+
+    def test_reads_once(self):
+        self.assertEqual(self.cache.get_many([ADDR1, ADDR2], 0), {ADDR1: 1, ADDR2: 2})
+        self.assertEqual(self.cache.get_many([ADDR1, ADDR2], 0), {ADDR1: 1, ADDR2: 2})
+        self.assertEqual(self.chains[0].reads, [ADDR1, ADDR2])
+        # One batch for both addresses.
+        self.assertEqual(self.chains[0].node.batch_sizes, [2])
+        self.assertEqual(self.cache.get_snapshot(ADDR2, 0), (10, 2))
+        self.assertEqual(self.cache.reads, 2)
+
+    def test_invalidate(self):
+        self.cache.get_many([ADDR1, ADDR2], 0)
+        self.chains[0].balances[ADDR1] = 5
+        self.chains[0].balances[ADDR2] = 6
+        self.cache.invalidate(ADDR1, 0)
+        # Only the invalidated entry is read again, the other one stays as cached.
+        self.assertEqual(self.cache.get_many([ADDR1, ADDR2], 0), {ADDR1: 5, ADDR2: 2})
+        self.assertEqual(self.chains[0].reads, [ADDR1, ADDR2, ADDR1])
+        # Invalidating one shard keeps the other.
+        self.cache.get(ADDR1, 1)
+        self.cache.invalidate(ADDR1, 0)
+        self.assertEqual(self.cache.get_snapshot(ADDR1, 1), (20, 3))
+        self.assertIsNone(self.cache.get_snapshot(ADDR1, 0))
+
+    def test_min_height(self):
+        self.cache.get(ADDR1, 0)
+        self.chains[0].height = 15
+        self.chains[0].balances[ADDR1] = 7
+        self.assertEqual(self.cache.get(ADDR1, 0, min_height=10), 1)
+        self.assertEqual(self.cache.get(ADDR1, 0, min_height=12), 7)
+        self.assertEqual(self.cache.get_snapshot(ADDR1, 0), (15, 7))
+
+    def test_sweep(self):
+        self.cache.sweep([ADDR1, ADDR2, ADDR1])
+        self.assertEqual([chain.reads for chain in self.chains], [[ADDR1, ADDR2], [ADDR1, ADDR2]])
+        self.assertEqual(self.cache.get_many([ADDR1, ADDR2], 1), {ADDR1: 3, ADDR2: 4})
+        self.assertEqual(self.cache.reads, 4)
+        self.cache.sweep([ADDR2], shards=[0])
+        self.assertEqual([len(chain.reads) for chain in self.chains], [3, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Minimal bech32 (BIP-0173) encoding for `one1...` addresses.
+
+Only what the pipeline needs to go between bech32 and the 20 byte
+account address without calling `hmy utility`.
+"""
+
+HRP = "one"
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+_CHARSET_REV = {c: i for i, c in enumerate(CHARSET)}
+_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+
+
+def _polymod(values):
+    chk = 1
+    for v in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ v
+        for i in range(5):
+            chk ^= _GENERATOR[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _hrp_expand(hrp):
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+
+def _create_checksum(hrp, data):
+    polymod = _polymod(_hrp_expand(hrp) + data + [0, 0, 0, 0, 0, 0]) ^ 1
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+
+def _convert_bits(data, from_bits, to_bits, pad=True):
+    acc, bits, ret = 0, 0, []
+    max_v = (1 << to_bits) - 1
+    for value in data:
+        if value < 0 or value >> from_bits:
+            return None
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            ret.append((acc >> bits) & max_v)
+    if pad:
+        if bits:
+            ret.append((acc << (to_bits - bits)) & max_v)
+    elif bits >= from_bits or ((acc << (to_bits - bits)) & max_v):
+        return None
+    return ret
+
+
+def decode(address):
+    """
+    Decode a bech32 string into (hrp, data bytes).
+
+    Raises ValueError if `address` is not valid bech32.
+    """
+    if address.lower() != address and address.upper() != address:
+        raise ValueError(f"mixed case in `{address}`")
+    address = address.lower()
+    pos = address.rfind('1')
+    if pos < 1 or pos + 7 > len(address) or len(address) > 90:
+        raise ValueError(f"bad separator position in `{address}`")
+    hrp, data = address[:pos], []
+    for c in address[pos + 1:]:
+        if c not in _CHARSET_REV:
+            raise ValueError(f"invalid character `{c}` in `{address}`")
+        data.append(_CHARSET_REV[c])
+    if _polymod(_hrp_expand(hrp) + data) != 1:
+        raise ValueError(f"bad checksum for `{address}`")
+    decoded = _convert_bits(data[:-6], 5, 8, pad=False)
+    if decoded is None:
+        raise ValueError(f"bad padding in `{address}`")
+    return hrp, bytes(decoded)
+
+
+def encode(hrp, raw):
+    data = _convert_bits(raw, 8, 5)
+    return hrp + '1' + ''.join(CHARSET[d] for d in data + _create_checksum(hrp, data))
+
+
+def to_bytes(address):
+    """
+    Returns the 20 byte account address of a `one1...` address.
+    """
+    hrp, raw = decode(address)
+    if hrp != HRP or len(raw) != 20:
+        raise ValueError(f"`{address}` is not a {HRP}1 address")
+    return raw
+
+
+def from_bytes(raw):
+    return encode(HRP, raw)
+
+
+def is_valid_address(address):
+    """
+    Checks the HRP, checksum and length of a `one1...` address.
+    """
+    try:
+        to_bytes(address)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,32 @@
+import unittest
+
+from utils import bech32
+
+FAUCET_ADDR = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"
+
+
+class TestBech32(unittest.TestCase):
+
+    def test_round_trip(self):
+        raw = bech32.to_bytes(FAUCET_ADDR)
+        self.assertEqual(len(raw), 20)
+        self.assertEqual(bech32.from_bytes(raw), FAUCET_ADDR)
+
+    def test_keystore_address(self):
+        # Address field of tools/.hmy/keystore.beta/one1shzkj8tty2wu230wsjc7lp9xqkwhch2ea7sjhc.key
+        raw = bech32.to_bytes("one1shzkj8tty2wu230wsjc7lp9xqkwhch2ea7sjhc")
+        self.assertEqual(raw.hex(), "85c5691d6b229dc545ee84b1ef84a6059d7c5d59")
+
+    def test_invalid_addresses(self):
+        self.assertTrue(bech32.is_valid_address(FAUCET_ADDR))
+        self.assertTrue(bech32.is_valid_address(FAUCET_ADDR.upper()))
+        self.assertFalse(bech32.is_valid_address(FAUCET_ADDR[:-1] + "q"))  # Checksum
+        self.assertFalse(bech32.is_valid_address(FAUCET_ADDR[:-2]))  # Length
+        self.assertFalse(bech32.is_valid_address("bc1" + FAUCET_ADDR[4:]))  # HRP
+        self.assertFalse(bech32.is_valid_address(bech32.encode("one", bytes(19))))  # Payload length
+        self.assertFalse(bech32.is_valid_address("one1Zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"))  # Mixed case
+        self.assertFalse(bech32.is_valid_address("one1bksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"))  # Charset
+
+
+if __name__ == '__main__':
+    unittest.main()
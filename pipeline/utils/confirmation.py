@@ -0,0 +1,89 @@
+"""
+Receipt based confirmation tracking for submitted transactions.
+
+Instead of sleeping a fixed amount of time after sending, poll
+`hmy_getTransactionReceipt` for all outstanding hashes in JSON-RPC batches,
+backing off while nothing new lands and finishing as soon as every
+transaction is either confirmed or timed out.
+"""
+
+import time
+
+from utils import rpc
+
+DEFAULT_TIMEOUT = 120
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 16
+
+
+class ConfirmationTracker:
+    """
+    Tracks transaction hashes submitted to one shard endpoint.
+    """
+
+    def __init__(self, endpoint, batch_size=rpc.DEFAULT_BATCH_SIZE):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.pending = {}
+        self.confirmed = {}
+        self.failed = {}
+        self.timed_out = {}
+
+    def add(self, tx_hash, info=None):
+        """
+        Record a submitted transaction, `info` is returned with its outcome.
+        """
+        self.pending[tx_hash] = info
+
+    def poll(self):
+        """
+        One batched receipt sweep over the pending hashes, returns the number of newly settled transactions.
+        """
+        hashes = list(self.pending.keys())
+        receipts = rpc.batch_call(self.endpoint, [("hmy_getTransactionReceipt", [h]) for h in hashes],
+                                  self.batch_size, error_ok=True)
+        settled = 0
+        for tx_hash, receipt in zip(hashes, receipts):
+            if receipt is None or isinstance(receipt, rpc.RPCError):
+                continue
+            info = self.pending.pop(tx_hash)
+            status = receipt.get("status", 1)
+            if isinstance(status, str):
+                status = int(status, 16)
+            if status == 1:
+                self.confirmed[tx_hash] = info
+            else:
+                self.failed[tx_hash] = info
+            settled += 1
+        return settled
+
+    def wait(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Poll until every transaction settled or `timeout` seconds passed.
+
+        The poll interval doubles (up to MAX_POLL_INTERVAL) while no receipt shows up
+        and resets to MIN_POLL_INTERVAL as soon as some do.
+        Anything still pending at the deadline is moved to `timed_out`.
+
+        Returns True if every tracked transaction was confirmed successfully.
+        """
+        deadline = time.time() + timeout
+        interval = MIN_POLL_INTERVAL
+        while self.pending:
+            try:
+                settled = self.poll()
+            except Exception:  # Do not halt on a flaky endpoint, the deadline still applies.
+                settled = 0
+            if not self.pending or time.time() >= deadline:
+                break
+            interval = MIN_POLL_INTERVAL if settled else min(interval * 2, MAX_POLL_INTERVAL)
+            time.sleep(min(interval, max(deadline - time.time(), 0)))
+        self.timed_out.update(self.pending)
+        self.pending.clear()
+        return not self.failed and not self.timed_out
+
+    def unconfirmed(self):
+        """
+        Infos of every transaction that failed or timed out.
+        """
+        return list(self.failed.values()) + list(self.timed_out.values())
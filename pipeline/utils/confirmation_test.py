@@ -0,0 +1,91 @@
+import unittest
+
+from utils import confirmation
+from utils.sender_test import StubNode
+
+
+class FakeClock:
+    """
+    Stands in for the `time` module of utils.confirmation, sleeping only moves the clock forward.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestConfirmationTracker(unittest.TestCase):
+
+    def setUp(self):
+        # tx hash -> receipt, a hash is pending until it has one.
+        self.receipts = {}
+        self.polls = 0
+        self.node = StubNode(handlers={"hmy_getTransactionReceipt": self.receipt})
+        server, self.endpoint = self.node.serve()
+        self.addCleanup(server.shutdown)
+        self.clock = FakeClock()
+        self.time = confirmation.time
+        confirmation.time = self.clock
+
+    def tearDown(self):
+        confirmation.time = self.time
+
+    def receipt(self, params):
+        if params[0] == "0xbad":
+            return {"error": {"code": -32000, "message": "unknown"}}
+        return {"result": self.receipts.get(params[0])}
+
+    def test_receipt_status(self):
+        tracker = confirmation.ConfirmationTracker(self.endpoint, batch_size=2)
+        for h in ("0x1", "0x2", "0x3", "0x4", "0xbad"):
+            tracker.add(h, {"hash": h})
+        self.receipts.update({"0x1": {"status": "0x1"}, "0x2": {"status": "0x0"}, "0x3": {"status": 1},
+                              "0x4": {}})
+        self.assertEqual(tracker.poll(), 4)
+        self.assertEqual(sorted(tracker.confirmed), ["0x1", "0x3", "0x4"])
+        self.assertEqual(list(tracker.failed), ["0x2"])
+        # An error reply for one hash leaves it pending.
+        self.assertEqual(list(tracker.pending), ["0xbad"])
+        self.assertEqual(self.node.batch_sizes, [2, 2, 1])
+
+    def test_backoff(self):
+        tracker = confirmation.ConfirmationTracker(self.endpoint)
+        tracker.add("0x1", "first")
+        tracker.add("0x2", "second")
+        start = self.clock.now
+
+        def land(params):
+            # 0x1 lands on the third poll, 0x2 never does.
+            if params[0] == "0x1":
+                self.polls += 1
+            if self.polls == 3 and params[0] == "0x1":
+                self.receipts["0x1"] = {"status": "0x1"}
+            return self.receipt(params)
+
+        self.node.handlers["hmy_getTransactionReceipt"] = land
+        self.assertFalse(tracker.wait(timeout=60))
+        # Doubles while nothing lands, starts over when something does, capped, and cut at the deadline.
+        self.assertEqual(self.clock.sleeps, [2, 4, 1, 2, 4, 8, 16, 16, 7])
+        self.assertEqual(self.clock.now, start + 60)
+        self.assertEqual(list(tracker.confirmed), ["0x1"])
+        self.assertEqual(tracker.unconfirmed(), ["second"])
+        self.assertEqual(tracker.pending, {})
+
+    def test_flaky_endpoint(self):
+        tracker = confirmation.ConfirmationTracker(self.endpoint)
+        tracker.add("0x1")
+        self.node.batch_error = {"code": -32603, "message": "overloaded"}
+        self.assertFalse(tracker.wait(timeout=10))
+        self.assertEqual(list(tracker.timed_out), ["0x1"])
+        self.assertEqual(sum(self.clock.sleeps), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Distribution config planner.
+
+Nodes are read from an IP inventory, one `ip node_name_tag [region [cloud]]`
+line per node. When the region is not given it is the first `-` separated field
+of the node name tag (the region number or code the launch tools put there).
+
+Commanders, leaders and explorer nodes are taken from the head of the inventory
+in that order, so pre-launched leader and explorer IPs prepended to raw_ip.txt
+keep their role, and clients from the tail. Validators are grouped by
+(cloud, region) and dealt to the shards round robin, which gives every shard the
+same number of validators (+/- 1) and the same share of every region (+/- 1).
+Clients are dealt the same way.
+"""
+
+PORT = 9000
+
+
+def node(ip, name, region=None, cloud=None):
+    return {
+        'ip': ip,
+        'name': name,
+        'region': region if region is not None else name.split('-', 1)[0],
+        'cloud': cloud or '',
+    }
+
+
+def locality(node):
+    return (node['cloud'], node['region'])
+
+
+def parse_inventory(lines):
+    """
+    Returns the list of node dicts of the `ip node_name_tag [region [cloud]]` lines, blank lines are skipped.
+    """
+    nodes = []
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) < 2:
+            raise ValueError("Invalid inventory line, expected 'ip node_name_tag [region [cloud]]': %r" % line)
+        nodes.append(node(*fields[:4]))
+    return nodes
+
+
+def read_inventory(path):
+    with open(path, 'r') as f:
+        return parse_inventory(f)
+
+
+def required_nodes(shard_number, explorer_number=0, client_number=0, commander_number=0):
+    # A leader and a validator per shard, plus one spare node as generate_distribution_config always required.
+    return shard_number * 2 + explorer_number + client_number + commander_number + 1
+
+
+def deal(nodes, shard_number):
+    """
+    Spreads `nodes` over the shards: grouped by locality (in order of first appearance),
+    then round robin. Returns a list of (node, shard) in the same order as `nodes`.
+    """
+    first_seen = {}
+    for n in nodes:
+        first_seen.setdefault(locality(n), len(first_seen))
+    # Stable sort, nodes of a locality keep their inventory order.
+    order = sorted(range(len(nodes)), key=lambda i: first_seen[locality(nodes[i])])
+    shards = [0] * len(nodes)
+    for position, i in enumerate(order):
+        shards[i] = position % shard_number
+    return list(zip(nodes, shards))
+
+
+def plan(nodes, shard_number, explorer_number=0, client_number=0, commander_number=0):
+    """
+    Assigns a role and a shard to every node.
+
+    Returns a list of (node, role, shard) in distribution config order, or None when
+    there are not enough nodes.
+    """
+    if shard_number < 1 or len(nodes) < required_nodes(shard_number, explorer_number, client_number,
+                                                       commander_number):
+        return None
+    head = commander_number + shard_number + explorer_number
+    commanders = nodes[:commander_number]
+    leaders = nodes[commander_number:commander_number + shard_number]
+    explorers = nodes[commander_number + shard_number:head]
+    validators = nodes[head:len(nodes) - client_number]
+    clients = nodes[len(nodes) - client_number:]
+
+    rows = [(n, 'commander', i) for i, n in enumerate(commanders)]
+    rows.extend((n, 'leader', i) for i, n in enumerate(leaders))
+    rows.extend((n, 'explorer_node', i) for i, n in enumerate(explorers))
+    rows.extend((n, 'validator', shard) for n, shard in deal(validators, shard_number))
+    rows.extend((n, 'client', shard) for n, shard in deal(clients, shard_number))
+    return rows
+
+
+def render(rows):
+    return ''.join(['%s %d %s %d %s\n' % (n['ip'], PORT, role, shard, n['name']) for n, role, shard in rows])
+
+
+def write(rows, path):
+    """
+    Writes the distribution config of `rows` with a single write.
+    """
+    data = render(rows)
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def shard_localities(rows):
+    """
+    Returns a dict of shard -> {locality: number of validators}, to check the balance of a plan.
+    """
+    summary = {}
+    for n, role, shard in rows:
+        if role == 'validator':
+            localities = summary.setdefault(shard, {})
+            localities[locality(n)] = localities.get(locality(n), 0) + 1
+    return summary
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import distribution
+
+
+def inventory(count, regions):
+    return ["10.0.%d.%d %s-NODE-test" % (i // 256, i % 256, regions[i % len(regions)]) for i in range(count)]
+
+
+class TestDistribution(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_inventory(self):
+        nodes = distribution.parse_inventory(["1.1.1.1 4-NODE-x\n", "\n", "2.2.2.2 node-7 eastus azure\n"])
+        self.assertEqual([(n['ip'], n['region'], n['cloud']) for n in nodes],
+                         [("1.1.1.1", "4", ""), ("2.2.2.2", "eastus", "azure")])
+        with self.assertRaises(ValueError):
+            distribution.parse_inventory(["1.1.1.1\n"])
+
+    def test_not_enough_nodes(self):
+        nodes = distribution.parse_inventory(inventory(6, ["1"]))
+        self.assertIsNone(distribution.plan(nodes, 2, 0, 2))
+        self.assertIsNotNone(distribution.plan(nodes, 2, 0, 1))
+
+    def test_roles_keep_head_and_tail(self):
+        nodes = distribution.parse_inventory(inventory(12, ["1", "2"]))
+        rows = distribution.plan(nodes, 2, 2, 2, 1)
+        roles = [(n['ip'], role, shard) for n, role, shard in rows]
+        self.assertEqual(roles[:5], [("10.0.0.0", "commander", 0), ("10.0.0.1", "leader", 0),
+                                     ("10.0.0.2", "leader", 1), ("10.0.0.3", "explorer_node", 0),
+                                     ("10.0.0.4", "explorer_node", 1)])
+        self.assertEqual([r[:2] for r in roles[-2:]], [("10.0.0.10", "client"), ("10.0.0.11", "client")])
+        self.assertEqual(len(set(ip for ip, _, _ in roles)), 12)
+
+    def test_regions_balanced(self):
+        # Region 1 holds half of the fleet, a plain round robin would put it all in shard 0.
+        nodes = distribution.parse_inventory(inventory(10000, ["1", "2", "1", "3"]))
+        rows = distribution.plan(nodes, 4, 0, 0)
+        summary = distribution.shard_localities(rows)
+        for region in ("1", "2", "3"):
+            counts = [summary[shard].get(("", region), 0) for shard in range(4)]
+            self.assertLessEqual(max(counts) - min(counts), 1)
+        sizes = [sum(summary[shard].values()) for shard in range(4)]
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_write(self):
+        path = os.path.join(self.dir, "distribution_config.txt")
+        rows = distribution.plan(distribution.parse_inventory(inventory(5, ["4"])), 2)
+        distribution.write(rows, path)
+        with open(path) as f:
+            self.assertEqual(f.readline(), "10.0.0.0 9000 leader 0 4-NODE-test\n")
+            self.assertEqual(len(f.readlines()), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,45 +1,200 @@
-import utils
+import hashlib
+import json
+import os
+import threading
+import time
 
+from botocore.exceptions import ClientError
 
-def get_launch_template_name(region_number):
-    return 'benchmark-' + utils.CONFIG[region_number][utils.REGION_NAME]
+from utils import mylogger, utils
 
+LOGGER = mylogger.getLogger(__file__)
+DEFAULT_CACHE_FILE = os.path.expanduser('~/.cache/launch_templates.json')
+# Versions are immutable, the TTL only bounds how long a template deleted by hand goes unnoticed.
+DEFAULT_CACHE_TTL = 24 * 3600
+# Versions created here carry the hash of their data in the description.
+HASH_PREFIX = 'sha256:'
+NOT_FOUND = 'InvalidLaunchTemplateName.NotFoundException'
+ALREADY_EXISTS = 'InvalidLaunchTemplateName.AlreadyExistsException'
 
-def create(ec2_client, region_number):
+
+def get_launch_template_name(region_number, region_config='configuration.txt'):
+    return 'benchmark-' + utils.get_region_config(region_config)[region_number][utils.REGION_NAME]
+
+
+def get_launch_template_data(region_number, region_config='configuration.txt'):
+    region = utils.get_region_config(region_config)[region_number]
+    user_data = utils.USER_DATA_BASE64
+    return {
+        'IamInstanceProfile': {
+            'Name': utils.IAM_INSTANCE_PROFILE
+        },
+        'ImageId': region[utils.REGION_AMI],
+        # 'InstanceType': instance_type,
+        'KeyName':  region[utils.REGION_KEY],
+        'UserData': user_data.decode('ascii') if isinstance(user_data, bytes) else user_data,
+        'SecurityGroupIds': [
+            region[utils.REGION_SECURITY_GROUP_ID]
+        ],
+        # 'InstanceInitiatedShutdownBehavior': 'stop',
+        'TagSpecifications': [
+            {
+                'ResourceType': 'instance',
+                'Tags': [
+                    {
+                        'Key': 'LaunchTemplate',
+                        'Value': 'Yes'
+                    }
+                ]
+            }
+        ],
+        # 'InstanceMarketOptions': {
+        #     'MarketType': 'spot',
+        #     'SpotOptions': {
+        #         'MaxPrice': 'string',
+        #         'SpotInstanceType': 'one-time'|'persistent',
+        #         'BlockDurationMinutes': 123,
+        #         'InstanceInterruptionBehavior': 'hibernate'|'stop'|'terminate'
+        #     }
+        # },
+    }
+
+
+def data_hash(data):
+    return HASH_PREFIX + hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def create(ec2_client, region_number, region_config='configuration.txt'):
+    data = get_launch_template_data(region_number, region_config)
     return ec2_client.create_launch_template(
         # DryRun=True,
-        LaunchTemplateName=get_launch_template_name(region_number),
-        LaunchTemplateData={
-            'IamInstanceProfile': {
-                'Name': utils.IAM_INSTANCE_PROFILE
-            },
-            'ImageId': utils.CONFIG[region_number][utils.REGION_AMI],
-            # 'InstanceType': instance_type,
-            'KeyName':  utils.CONFIG[region_number][utils.REGION_KEY],
-            'UserData': utils.USER_DATA_BASE64,
-            'SecurityGroupIds': [
-                utils.CONFIG[region_number][utils.REGION_SECURITY_GROUP_ID]
-            ],
-            # 'InstanceInitiatedShutdownBehavior': 'stop',
-            'TagSpecifications': [
-                {
-                    'ResourceType': 'instance',
-                    'Tags': [
-                        {
-                            'Key': 'LaunchTemplate',
-                            'Value': 'Yes'
-                        }
-                    ]
-                }
-            ],
-            # 'InstanceMarketOptions': {
-            #     'MarketType': 'spot',
-            #     'SpotOptions': {
-            #         'MaxPrice': 'string',
-            #         'SpotInstanceType': 'one-time'|'persistent',
-            #         'BlockDurationMinutes': 123,
-            #         'InstanceInterruptionBehavior': 'hibernate'|'stop'|'terminate'
-            #     }
-            # },
-        }
+        LaunchTemplateName=get_launch_template_name(region_number, region_config),
+        VersionDescription=data_hash(data),
+        LaunchTemplateData=data
     )
+
+
+def describe_versions(ec2_client, name):
+    """
+    Returns a dict of data hash -> version number of the versions of template `name` created here,
+    or None when there is no such template.
+    """
+    versions = {}
+    kwargs = {'LaunchTemplateName': name}
+    while True:
+        try:
+            res = ec2_client.describe_launch_template_versions(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == NOT_FOUND:
+                return None
+            raise
+        for version in res['LaunchTemplateVersions']:
+            description = version.get('VersionDescription') or ''
+            if description.startswith(HASH_PREFIX):
+                versions.setdefault(description, version['VersionNumber'])
+        if not res.get('NextToken'):
+            return versions
+        kwargs['NextToken'] = res['NextToken']
+
+
+class LaunchTemplateManager(object):
+    """
+    Launch templates of the benchmark regions, one version per distinct LaunchTemplateData.
+
+    The versions of a region's template are looked up once per AWS profile and kept in an
+    on-disk cache (`path`, None for memory only) for `ttl` seconds. A new version is created only when the
+    hash of the template data (AMI, key, security group, user data, ...) has none yet, so
+    repeated deploys with the same data make no template API call at all.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._region_locks = {}
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self._data = json.load(f)
+            except (IOError, OSError, ValueError) as e:
+                LOGGER.warning("ignoring unreadable launch template cache %s: %s" % (path, e))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._data)
+        if not os.path.isdir(os.path.dirname(self.path) or '.'):
+            os.makedirs(os.path.dirname(self.path))
+        tmp = self.path + '.tmp.%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, self.path)
+
+    def invalidate(self, region_number, profile='default', region_config='configuration.txt'):
+        with self._lock:
+            self._data.pop(self._key(region_number, profile, region_config), None)
+
+    def _key(self, region_number, profile, region_config):
+        # Profiles may be different accounts, their templates and versions are unrelated.
+        return '/'.join([profile, utils.get_region_config(region_config)[region_number][utils.REGION_NAME],
+                         get_launch_template_name(region_number, region_config)])
+
+    def _region_lock(self, key):
+        with self._lock:
+            return self._region_locks.setdefault(key, threading.Lock())
+
+    def get_version(self, ec2_client, region_number, profile='default', region_config='configuration.txt'):
+        """
+        Version (str) of the region's launch template holding the current template data,
+        created if needed. `ec2_client` is the client of `profile` in that region.
+        """
+        key = self._key(region_number, profile, region_config)
+        name = get_launch_template_name(region_number, region_config)
+        data = get_launch_template_data(region_number, region_config)
+        digest = data_hash(data)
+        with self._region_lock(key):
+            entry = self._data.get(key)
+            if entry is not None and time.time() - entry['time'] < self.ttl and digest in entry['versions']:
+                return str(entry['versions'][digest])
+            if entry is None or time.time() - entry['time'] >= self.ttl:
+                versions = describe_versions(ec2_client, name)
+                entry = {'time': time.time(), 'exists': versions is not None, 'versions': versions or {}}
+            if digest not in entry['versions']:
+                versions = dict(entry['versions'])
+                versions[digest] = self._create(ec2_client, name, data, digest, entry['exists'])
+                entry = dict(entry, exists=True, versions=versions)
+            with self._lock:
+                self._data[key] = entry
+        self.save()
+        return str(entry['versions'][digest])
+
+    def _create(self, ec2_client, name, data, digest, exists):
+        if not exists:
+            try:
+                res = ec2_client.create_launch_template(
+                    LaunchTemplateName=name, VersionDescription=digest, LaunchTemplateData=data)
+                return res['LaunchTemplate']['LatestVersionNumber']
+            except ClientError as e:
+                # Created by a concurrent deploy since the lookup.
+                if e.response.get('Error', {}).get('Code') != ALREADY_EXISTS:
+                    raise
+        res = ec2_client.create_launch_template_version(
+            LaunchTemplateName=name, VersionDescription=digest, LaunchTemplateData=data)
+        return res['LaunchTemplateVersion']['VersionNumber']
+
+
+TEMPLATES = None
+TEMPLATES_LOCK = threading.Lock()
+
+
+def get_version(ec2_client, region_number, profile='default', region_config='configuration.txt'):
+    """
+    LaunchTemplateManager.get_version of the process wide manager.
+    """
+    global TEMPLATES
+    with TEMPLATES_LOCK:
+        if TEMPLATES is None:
+            TEMPLATES = LaunchTemplateManager()
+    return TEMPLATES.get_version(ec2_client, region_number, profile, region_config)
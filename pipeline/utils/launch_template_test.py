@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from botocore.exceptions import ClientError
+
+from utils import launch_template, utils
+
+
+class StubEC2:
+    """
+    EC2 client stub holding launch templates, versions are paged `page_size` at a time.
+    """
+
+    def __init__(self, page_size=2):
+        self.page_size = page_size
+        self.templates = {}
+        self.calls = []
+
+    def describe_launch_template_versions(self, LaunchTemplateName, NextToken=None):
+        self.calls.append('describe')
+        if LaunchTemplateName not in self.templates:
+            raise ClientError({'Error': {'Code': launch_template.NOT_FOUND}}, 'DescribeLaunchTemplateVersions')
+        versions = self.templates[LaunchTemplateName]
+        start = int(NextToken or 0)
+        res = {'LaunchTemplateVersions': [{'VersionNumber': i + 1, 'VersionDescription': d}
+                                          for i, d in enumerate(versions[start:start + self.page_size], start)]}
+        if start + self.page_size < len(versions):
+            res['NextToken'] = str(start + self.page_size)
+        return res
+
+    def create_launch_template(self, LaunchTemplateName, VersionDescription, LaunchTemplateData):
+        self.calls.append('create')
+        self.templates[LaunchTemplateName] = [VersionDescription]
+        return {'LaunchTemplate': {'LatestVersionNumber': 1}}
+
+    def create_launch_template_version(self, LaunchTemplateName, VersionDescription, LaunchTemplateData):
+        self.calls.append('create_version')
+        self.templates[LaunchTemplateName].append(VersionDescription)
+        return {'LaunchTemplateVersion': {'VersionNumber': len(self.templates[LaunchTemplateName])}}
+
+
+class TestLaunchTemplateManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.region_config = os.path.join(self.dir, 'configuration.txt')
+        with open(self.region_config, 'w') as f:
+            f.write('1,us-east-1,key-1,sg-1,virginia,ami-1,sg-id-1\n')
+        self.set_user_data('v1')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def set_user_data(self, content):
+        userdata = os.path.join(self.dir, 'userdata.sh')
+        with open(userdata, 'w') as f:
+            f.write(content)
+        utils.get_user_data(userdata)
+
+    def get_version(self, path, client, profile='default'):
+        return launch_template.LaunchTemplateManager(path).get_version(client, '1', profile, self.region_config)
+
+    def test_versions_follow_the_data(self):
+        client = StubEC2()
+        path = os.path.join(self.dir, 'templates.json')
+        self.assertEqual(self.get_version(path, client), '1')
+        self.assertEqual(client.calls, ['describe', 'create'])
+        # Same data in a later deploy: served from the cache file.
+        self.assertEqual(self.get_version(path, client), '1')
+        self.assertEqual(client.calls, ['describe', 'create'])
+        self.set_user_data('v2')
+        self.assertEqual(self.get_version(path, client), '2')
+        self.assertEqual(client.calls[2:], ['create_version'])
+
+    def test_profiles_do_not_share_versions(self):
+        path = os.path.join(self.dir, 'templates.json')
+        self.set_user_data('v2')
+        self.assertEqual(self.get_version(path, StubEC2()), '1')
+        other = StubEC2()
+        other.templates['benchmark-us-east-1'] = ['manual', 'manual']
+        self.assertEqual(self.get_version(path, other, profile='other'), '3')
+        self.assertEqual(other.calls, ['describe', 'create_version'])
+
+    def test_finds_existing_versions(self):
+        client = StubEC2()
+        digest = launch_template.data_hash(launch_template.get_launch_template_data('1', self.region_config))
+        client.templates['benchmark-us-east-1'] = ['manual', 'sha256:old', digest]
+        self.assertEqual(self.get_version(None, client), '3')
+        self.assertEqual(client.calls, ['describe', 'describe'])
+
+
+if __name__ == "__main__":
+    unittest.main()
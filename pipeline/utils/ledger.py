@@ -0,0 +1,123 @@
+"""
+Append-only funding ledger.
+
+Keeps the amount funded per address and shard as a JSON Lines journal.
+Every update is one appended (and flushed) line, so a crashed run loses
+nothing that was recorded and a restarted run resumes where it stopped.
+The journal is periodically compacted into one line per (address, shard)
+with an atomic file replace.
+
+Journal lines are either a block height marker `{"block-height": 123}`
+or an absolute funded amount `{"address": "one1...", "shard": 0, "funded": 100.0}`.
+"""
+
+import json
+import os
+from threading import Lock
+
+DEFAULT_COMPACT_EVERY = 10000
+
+
+class FundingLedger:
+
+    def __init__(self, path, compact_every=DEFAULT_COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self.block_height = 0
+        self._funded = {}
+        self._lock = Lock()
+        self._file = None
+        self._appended = 0
+
+    def load(self, curr_height=None, legacy_path=None):
+        """
+        Replay the journal. If `curr_height` is given and the journal was written at a higher
+        block height (i.e: the network was reset) the journal is discarded.
+
+        If there is no journal yet, the legacy `funding.json` at `legacy_path` is imported.
+        """
+        with self._lock:
+            self._funded.clear()
+            if os.path.isfile(self.path):
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.decoder.JSONDecodeError:
+                            continue  # Torn last line from a crash.
+                        if "block-height" in record:
+                            self.block_height = record["block-height"]
+                        else:
+                            self._funded[(record["address"], int(record["shard"]))] = record["funded"]
+            elif legacy_path is not None and os.path.isfile(legacy_path):
+                with open(legacy_path, 'r') as f:
+                    legacy = json.load(f)
+                self.block_height = legacy['block-height']
+                for address, shards in legacy['funded-accounts'].items():
+                    for shard, funded in shards.items():
+                        self._funded[(address, int(shard))] = funded
+            if curr_height is not None and self.block_height > curr_height:
+                self._funded.clear()
+            if curr_height is not None:
+                self.block_height = curr_height
+        self.compact()
+
+    def get(self, address, shard):
+        with self._lock:
+            return self._funded.get((address, int(shard)), 0)
+
+    def set(self, address, shard, funded):
+        with self._lock:
+            self._set(address, int(shard), funded)
+        self._maybe_compact()
+
+    def add(self, address, shard, amount):
+        with self._lock:
+            key = (address, int(shard))
+            self._set(address, key[1], self._funded.get(key, 0) + amount)
+        self._maybe_compact()
+
+    def update_max(self, address, shard, funded):
+        with self._lock:
+            key = (address, int(shard))
+            if funded > self._funded.get(key, 0):
+                self._set(address, key[1], funded)
+        self._maybe_compact()
+
+    def _set(self, address, shard, funded):
+        self._funded[(address, shard)] = funded
+        self._append({"address": address, "shard": shard, "funded": funded})
+
+    def _append(self, record):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._appended += 1
+
+    def _maybe_compact(self):
+        if self._appended >= self.compact_every and self._appended > len(self._funded):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the journal as one line per (address, shard) and swap it in atomically.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = f"{self.path}.tmp"
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps({"block-height": self.block_height}) + "\n")
+                for (address, shard), funded in self._funded.items():
+                    f.write(json.dumps({"address": address, "shard": shard, "funded": funded}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._appended = 0
+
+    def close(self):
+        self.compact()
@@ -0,0 +1,158 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import fund
+from utils import bech32
+from utils.balances import BalanceCache
+from utils.ledger import FundingLedger
+from utils.sender_test import TEST_KEY, StubNode
+
+ADDR1 = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"
+ADDR2 = "one17dcjcyauyr43rqh29sa9zeyvfvqc54yzuwyd64"
+
+
+class TestFundingLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "funding.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lines(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_resume_after_crash(self):
+        ledger = FundingLedger(self.path)
+        ledger.load(curr_height=10)
+        ledger.add(ADDR1, 0, 100)
+        ledger.add(ADDR1, 0, 50)
+        ledger.set(ADDR2, "1", 7)
+        # Crash: no close, and the last write was torn.
+        with open(self.path, "a") as f:
+            f.write('{"address": "%s", "shard": 0, "fun' % ADDR2)
+
+        resumed = FundingLedger(self.path)
+        resumed.load(curr_height=12)
+        self.assertEqual(resumed.get(ADDR1, 0), 150)
+        self.assertEqual(resumed.get(ADDR2, 1), 7)
+        self.assertEqual(resumed.get(ADDR2, 0), 0)
+        # Appending after the replay does not run into the torn line.
+        resumed.add(ADDR2, 0, 1)
+        resumed2 = FundingLedger(self.path)
+        resumed2.load()
+        self.assertEqual(resumed2.get(ADDR2, 0), 1)
+        self.assertEqual(resumed2.block_height, 12)
+
+    def test_network_reset_discards_journal(self):
+        ledger = FundingLedger(self.path)
+        ledger.load(curr_height=100)
+        ledger.add(ADDR1, 0, 100)
+        ledger.close()
+        reset = FundingLedger(self.path)
+        reset.load(curr_height=5)
+        self.assertEqual(reset.get(ADDR1, 0), 0)
+        self.assertEqual(reset.block_height, 5)
+
+    def test_compaction(self):
+        ledger = FundingLedger(self.path, compact_every=5)
+        ledger.load(curr_height=1)
+        for _ in range(4):
+            ledger.add(ADDR1, 0, 1)
+        self.assertEqual(len(self.lines()), 1 + 4)
+        ledger.add(ADDR1, 0, 1)
+        # One block height marker plus one line per (address, shard).
+        self.assertEqual(self.lines(), [{"block-height": 1}, {"address": ADDR1, "shard": 0, "funded": 5}])
+        ledger.update_max(ADDR1, 0, 3)
+        ledger.update_max(ADDR2, 2, 3)
+        ledger.close()
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+        reloaded = FundingLedger(self.path)
+        reloaded.load()
+        self.assertEqual((reloaded.get(ADDR1, 0), reloaded.get(ADDR2, 2)), (5, 3))
+
+    def test_import_legacy(self):
+        legacy_path = os.path.join(self.dir, "funding.json")
+        with open(legacy_path, "w") as f:
+            json.dump({"block-height": 20, "funded-accounts": {ADDR1: {"0": 100, "1": 30}}}, f)
+        ledger = FundingLedger(self.path)
+        ledger.load(curr_height=25, legacy_path=legacy_path)
+        self.assertEqual((ledger.get(ADDR1, 0), ledger.get(ADDR1, 1)), (100, 30))
+        self.assertEqual(self.lines()[0], {"block-height": 25})
+        # Once the journal exists the legacy file is not read again.
+        ledger.add(ADDR1, 0, 1)
+        os.remove(legacy_path)
+        reloaded = FundingLedger(self.path)
+        reloaded.load(legacy_path=legacy_path)
+        self.assertEqual(reloaded.get(ADDR1, 0), 101)
+
+
+class KillingNode(StubNode):
+    """
+    Kills the submitting process right after it handled `kill_after` batches, before replying.
+    """
+
+    def __init__(self, kill_after):
+        super().__init__()
+        self.kill_after = kill_after
+        self.batches = 0
+        self.pid = None
+
+    def handle(self, req):
+        reply = super().handle(req)
+        if req["method"] == "hmy_sendRawTransaction" and req["id"] == 0:
+            self.batches += 1
+        if self.batches == self.kill_after and self.pid is not None:
+            os.kill(self.pid, signal.SIGKILL)
+            self.pid = None
+        return reply
+
+
+class TestFundResume(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "funding.jsonl")
+        self.node = KillingNode(kill_after=2)
+        self.server, endpoint = self.node.serve()
+        fund.args = argparse.Namespace(window=5, csv=None, force=False)
+        fund.endpoints, fund.faucet_key, fund.chain_id = [endpoint], TEST_KEY, "testnet"
+        fund.balance_cache = BalanceCache(fund.endpoints)
+        self.data = [{"address": bech32.from_bytes(bytes([i + 1]) * 20), "amount": 10} for i in range(15)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.dir)
+        fund.senders.clear()
+
+    def run_fund(self):
+        fund.senders.clear()
+        fund.fund_log = FundingLedger(self.path)
+        fund.fund_log.load()
+        return fund.fund_from_data(0, self.data, check_balance=False)
+
+    def test_restart_after_kill_mid_chunk(self):
+        proc = multiprocessing.get_context("fork").Process(target=self.run_fund)
+        proc.start()
+        self.node.pid = proc.pid
+        proc.join(10)
+        self.assertEqual(proc.exitcode, -signal.SIGKILL)
+        # Killed while waiting for the reply to the second window, both windows reached the node.
+        self.assertEqual(len(self.node.accepted), 10)
+
+        results = self.run_fund()
+        self.assertEqual([r["to"] for r in results], [dat["address"] for dat in self.data[10:]])
+        self.assertEqual(len(self.node.accepted), 15)
+        self.assertTrue(all(fund.fund_log.get(dat["address"], 0) == 10 for dat in self.data))
+
+
+if __name__ == "__main__":
+    unittest.main()
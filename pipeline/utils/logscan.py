@@ -0,0 +1,118 @@
+"""
+Local keyword scanner for node logs already on disk (i.e: pulled by download-logs.sh).
+
+Matches the same SQL LIKE keywords as the Athena path against the first
+space-delimited field of every line, with all keywords folded into one
+compiled regex. Plain files are memory-mapped, `.gz` files are streamed in
+large blocks, and files are spread across a process pool.
+
+Kept python2 compatible, `LogAnalysis.py` still runs on python2 hosts.
+"""
+
+import gzip
+import mmap
+import os
+import re
+from multiprocessing import Pool, cpu_count
+
+BLOCK_SIZE = 16 * 1024 * 1024
+
+_pattern = None
+
+
+def like_to_regex(keyword):
+    """
+    Regex for an SQL LIKE `keyword` (optionally single quoted) that matches a whole
+    space-delimited field, meant to be anchored at the start of a line.
+    """
+    keyword = keyword.strip("'")
+    parts = []
+    for c in keyword:
+        if c == '%':
+            parts.append('[^ \n]*')
+        elif c == '_':
+            parts.append('[^ \n]')
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts) + '(?=[ \n]|$)'
+
+
+def compile_keywords(keywords):
+    """
+    One regex for all `keywords`, group `k<i>` is set when keyword i matched (the first keyword wins).
+
+    Returns a (first line, other lines) pair of patterns: the second one starts with a literal
+    newline instead of a multiline `^`, which lets `re` skip ahead with a fast literal search.
+    """
+    body = '(?:' + '|'.join('(?P<k%d>%s)' % (i, like_to_regex(k)) for i, k in enumerate(keywords)) + ')'
+    return re.compile(body.encode('utf-8')), re.compile(('\n' + body).encode('utf-8'))
+
+
+def _count(pattern, data, counts):
+    first, rest = pattern
+    m = first.match(data)
+    if m:
+        counts[int(m.lastgroup[1:])] += 1
+    for m in rest.finditer(data):
+        counts[int(m.lastgroup[1:])] += 1
+
+
+def scan_file(pattern, path, num_keywords):
+    """
+    Returns the number of matching lines per keyword in `path`.
+    """
+    counts = [0] * num_keywords
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            tail = b''
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                block = tail + block
+                end = block.rfind(b'\n') + 1
+                _count(pattern, block[:end], counts)
+                tail = block[end:]
+            _count(pattern, tail, counts)
+    elif os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                _count(pattern, data, counts)
+            finally:
+                data.close()
+    return counts
+
+
+def _init_worker(keywords):
+    global _pattern
+    _pattern = (compile_keywords(keywords), len(keywords))
+
+
+def _scan_worker(path):
+    try:
+        return path, scan_file(_pattern[0], path, _pattern[1]), None
+    except (IOError, OSError, EOFError) as e:  # i.e: truncated .gz, do not halt the scan
+        return path, [0] * _pattern[1], str(e)
+
+
+def find_logs(log_dir):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(log_dir) for name in names)
+
+
+def scan(log_dir, keywords, processes=None):
+    """
+    Scan every file under `log_dir` for `keywords`.
+
+    Yields (path, counts per keyword, error or None) in no particular order.
+    """
+    paths = find_logs(log_dir)
+    if not paths:
+        return
+    processes = min(processes or cpu_count(), len(paths))
+    pool = Pool(processes, initializer=_init_worker, initargs=(keywords,))
+    try:
+        for result in pool.imap_unordered(_scan_worker, paths):
+            yield result
+    finally:
+        pool.terminate()
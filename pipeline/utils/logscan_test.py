@@ -0,0 +1,47 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import logscan
+
+KEYWORDS = ["'panic%'", "'fatal%'"]
+
+
+class TestLogScan(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, "shard0", "10.0.0.1"))
+        self.plain = os.path.join(self.dir, "shard0", "10.0.0.1", "validator.log")
+        with open(self.plain, "w") as f:
+            f.write("panic: runtime error\nINFO not a panic\nfatal error: oom\npanicky\nxpanic\nfatal")
+        self.gz = os.path.join(self.dir, "shard0", "10.0.0.1", "leader.log.gz")
+        with gzip.open(self.gz, "wt") as f:
+            f.write("fatal\n" * 3 + "INFO ok\npanic")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_like_semantics(self):
+        pattern = logscan.compile_keywords(KEYWORDS)
+        self.assertEqual(logscan.scan_file(pattern, self.plain, 2), [2, 2])
+        exact = logscan.compile_keywords(["'panic'"])
+        self.assertEqual(logscan.scan_file(exact, self.plain, 1), [0])
+
+    def test_gzip_across_blocks(self):
+        pattern = logscan.compile_keywords(KEYWORDS)
+        block_size, logscan.BLOCK_SIZE = logscan.BLOCK_SIZE, 4
+        try:
+            self.assertEqual(logscan.scan_file(pattern, self.gz, 2), [1, 3])
+        finally:
+            logscan.BLOCK_SIZE = block_size
+
+    def test_scan_directory(self):
+        results = {path: counts for path, counts, error in logscan.scan(self.dir, KEYWORDS, processes=2)}
+        self.assertEqual(results, {self.plain: [2, 2], self.gz: [1, 3]})
+
+
+if __name__ == "__main__":
+    unittest.main()
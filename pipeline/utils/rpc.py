@@ -0,0 +1,145 @@
+"""
+Shared JSON-RPC client for the pipeline scripts.
+
+Keeps one pooled keep-alive session per endpoint and packs many calls
+into JSON-RPC batch arrays, so that scanning thousands of accounts costs
+a handful of HTTP round trips instead of one connection per lookup.
+"""
+
+import json
+from decimal import Decimal
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_TIMEOUT = 30
+POOL_SIZE = 32
+
+_sessions = {}
+_sessions_lock = Lock()
+_headers = {
+    'Content-Type': 'application/json'
+}
+
+
+class RPCError(RuntimeError):
+    """
+    Raised when an endpoint returns a JSON-RPC error or an unexpected reply.
+    """
+
+    def __init__(self, method, endpoint, error):
+        super().__init__(f"Error in reply from {endpoint}: {method} returned {error}")
+        self.method = method
+        self.endpoint = endpoint
+        self.error = error
+
+
+def get_session(endpoint):
+    """
+    Returns the shared keep-alive session for `endpoint`, creating it on first use.
+    """
+    with _sessions_lock:
+        session = _sessions.get(endpoint)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(_headers)
+            _sessions[endpoint] = session
+        return session
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _post(endpoint, payload, timeout):
+    response = get_session(endpoint).post(endpoint, data=json.dumps(payload),
+                                          allow_redirects=False, timeout=timeout)
+    return json.loads(response.content)
+
+
+def call(endpoint, method, params=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Single JSON-RPC call on the pooled session for `endpoint`.
+
+    Returns the `result` field of the reply, raises RPCError on a JSON-RPC error.
+    """
+    reply = _post(endpoint, {"id": "1", "jsonrpc": "2.0", "method": method, "params": params or []}, timeout)
+    if "error" in reply or "result" not in reply:
+        raise RPCError(method, endpoint, reply.get("error", reply))
+    return reply["result"]
+
+
+def batch_call(endpoint, calls, batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_TIMEOUT, error_ok=False):
+    """
+    Send `calls`, a list of (method, params) tuples, as JSON-RPC batch arrays of
+    at most `batch_size` elements each.
+
+    Returns the list of results in the same order as `calls`.
+    If `error_ok` is set, a failed element yields an RPCError in its slot instead of raising.
+    """
+    assert batch_size > 0, "batch size must be positive"
+    results = []
+    for start in range(0, len(calls), batch_size):
+        chunk = calls[start:start + batch_size]
+        payload = [{"id": i, "jsonrpc": "2.0", "method": method, "params": params}
+                   for i, (method, params) in enumerate(chunk)]
+        reply = _post(endpoint, payload, timeout)
+        if isinstance(reply, dict):  # Whole batch was rejected.
+            raise RPCError("batch", endpoint, reply.get("error", reply))
+        by_id = {el.get("id"): el for el in reply}
+        for i, (method, _) in enumerate(chunk):
+            el = by_id.get(i, {"error": "missing reply"})
+            if "error" in el or "result" not in el:
+                err = RPCError(method, endpoint, el.get("error", el))
+                if not error_ok:
+                    raise err
+                results.append(err)
+            else:
+                results.append(el["result"])
+    return results
+
+
+def atto_to_one(atto):
+    return float(Decimal(atto) / Decimal(1e18))
+
+
+def get_balance(endpoint, address, timeout=DEFAULT_TIMEOUT):
+    """
+    Returns the balance of `address` in ONE.
+    """
+    return atto_to_one(int(call(endpoint, "hmy_getBalance", [address, "latest"], timeout), 16))
+
+
+def get_nonce(endpoint, address, timeout=DEFAULT_TIMEOUT, block="latest"):
+    return int(call(endpoint, "hmy_getTransactionCount", [address, block], timeout), 16)
+
+
+def get_balances(endpoint, addresses, batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_TIMEOUT):
+    """
+    Batched balance lookup. Returns a dict of address -> balance in ONE.
+    """
+    addresses = list(dict.fromkeys(addresses))
+    results = batch_call(endpoint, [("hmy_getBalance", [a, "latest"]) for a in addresses], batch_size, timeout)
+    return {a: atto_to_one(int(r, 16)) for a, r in zip(addresses, results)}
+
+
+def get_nonces(endpoint, addresses, batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_TIMEOUT, block="latest"):
+    """
+    Batched nonce lookup. Returns a dict of address -> transaction count.
+    """
+    addresses = list(dict.fromkeys(addresses))
+    results = batch_call(endpoint, [("hmy_getTransactionCount", [a, block]) for a in addresses],
+                         batch_size, timeout)
+    return {a: int(r, 16) for a, r in zip(addresses, results)}
+
+
+def get_block_number(endpoint, timeout=DEFAULT_TIMEOUT):
+    return int(call(endpoint, "hmy_blockNumber", [], timeout), 16)
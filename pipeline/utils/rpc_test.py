@@ -0,0 +1,70 @@
+import unittest
+
+from utils import rpc
+from utils.sender_test import StubNode
+
+ADDR1 = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"
+ADDR2 = "one17dcjcyauyr43rqh29sa9zeyvfvqc54yzuwyd64"
+
+
+def echo(params):
+    if params[0] < 0:
+        return {"error": {"code": -32000, "message": "negative"}}
+    return {"result": params[0] * 2}
+
+
+class TestRPC(unittest.TestCase):
+
+    def serve(self, **kwargs):
+        node = StubNode(**kwargs)
+        server, endpoint = node.serve()
+        self.addCleanup(server.shutdown)
+        return node, endpoint
+
+    def test_call(self):
+        _, endpoint = self.serve(handlers={"echo": echo})
+        self.assertEqual(rpc.call(endpoint, "echo", [21]), 42)
+        with self.assertRaises(rpc.RPCError) as ctx:
+            rpc.call(endpoint, "echo", [-1])
+        self.assertEqual((ctx.exception.method, ctx.exception.error["message"]), ("echo", "negative"))
+
+    def test_batch_call(self):
+        node, endpoint = self.serve(handlers={"echo": echo})
+        self.assertEqual(rpc.batch_call(endpoint, [("echo", [i]) for i in range(250)], batch_size=100),
+                         [i * 2 for i in range(250)])
+        self.assertEqual(node.batch_sizes, [100, 100, 50])
+
+    def test_batch_errors(self):
+        _, endpoint = self.serve(handlers={"echo": echo, "silent": lambda params: None})
+        calls = [("echo", [1]), ("echo", [-1]), ("silent", []), ("echo", [3])]
+        with self.assertRaises(rpc.RPCError) as ctx:
+            rpc.batch_call(endpoint, calls)
+        self.assertEqual(ctx.exception.error["message"], "negative")
+        results = rpc.batch_call(endpoint, calls, error_ok=True)
+        self.assertEqual((results[0], results[3]), (2, 6))
+        self.assertIsInstance(results[1], rpc.RPCError)
+        # A call left out of the reply is an error in its own slot.
+        self.assertIsInstance(results[2], rpc.RPCError)
+        self.assertEqual((results[2].method, results[2].error), ("silent", "missing reply"))
+
+    def test_whole_batch_rejected(self):
+        _, endpoint = self.serve(handlers={"echo": echo}, batch_error={"code": -32600, "message": "too large"})
+        # Even with error_ok: there is no reply per call to report.
+        with self.assertRaises(rpc.RPCError) as ctx:
+            rpc.batch_call(endpoint, [("echo", [1])], error_ok=True)
+        self.assertEqual(ctx.exception.method, "batch")
+
+    def test_get_balances_and_nonces(self):
+        node, endpoint = self.serve(handlers={
+            "hmy_getBalance": lambda params: {"result": hex(10 ** 18 * (1 if params[0] == ADDR1 else 3) // 2)},
+            "hmy_getTransactionCount": lambda params: {"result": hex(7 if params[1] == "pending" else 5)},
+        })
+        self.assertEqual(rpc.get_balances(endpoint, [ADDR1, ADDR2, ADDR1]), {ADDR1: 0.5, ADDR2: 1.5})
+        # Duplicates are looked up once.
+        self.assertEqual(node.batch_sizes, [2])
+        self.assertEqual(rpc.get_nonces(endpoint, [ADDR1, ADDR2]), {ADDR1: 5, ADDR2: 5})
+        self.assertEqual(rpc.get_nonce(endpoint, ADDR1, block="pending"), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
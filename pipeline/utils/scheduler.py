@@ -0,0 +1,136 @@
+"""
+Shard parallel work scheduler.
+
+Every shard gets its own queue of work chunks and its own set of worker
+threads (bounded by a per-endpoint concurrency limit), so a slow shard
+never holds back the others. Failed chunks are retried with jittered
+exponential backoff and live throughput is printed while the run goes on.
+"""
+
+import random
+import sys
+import time
+from queue import Queue, Empty
+from threading import Thread, Lock, Event
+
+from pyhmy.util import (
+    Typgpy
+)
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1
+DEFAULT_REPORT_INTERVAL = 5
+
+
+def chunks(items, size):
+    assert size > 0, "chunk size must be positive"
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class ShardScheduler:
+    """
+    Runs `worker(shard, chunk)` over all chunks of all shards at once.
+
+    `worker` returns a list of result dicts, a result with an `error` key counts as failed.
+    `concurrency` is the max number of concurrent chunks per shard (1 for workers that share
+    per-shard state such as a nonce counter), a chunk whose worker raises is run again up to
+    `retries` times (0 for workers that are not safe to rerun).
+    """
+
+    def __init__(self, worker, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, report_interval=DEFAULT_REPORT_INTERVAL, verbose=True):
+        self.worker = worker
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.report_interval = report_interval
+        self.verbose = verbose
+        self._lock = Lock()
+        self._stats = {}
+
+    def _run_chunk(self, shard, chunk):
+        attempt = 0
+        while True:
+            try:
+                return self.worker(shard, chunk)
+            except Exception as e:  # Retry any error, a chunk should not halt the shard.
+                attempt += 1
+                if attempt > self.retries:
+                    return [{"chunk": chunk, "error": f"{e.__class__.__name__}: {e}"}]
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if self.verbose:
+                    print(f"{Typgpy.WARNING}Shard {shard}: chunk failed ({e}), "
+                          f"retry {attempt}/{self.retries} in {delay:.1f}s{Typgpy.ENDC}")
+                time.sleep(delay)
+
+    def _drain(self, shard, queue):
+        while True:
+            try:
+                chunk = queue.get_nowait()
+            except Empty:
+                return
+            results = self._run_chunk(shard, chunk) or []
+            with self._lock:
+                stats = self._stats[shard]
+                stats["results"].extend(results)
+                for res in results:
+                    stats["failed" if "error" in res else "sent"] += 1
+
+    def _run_shard(self, shard, shard_chunks, finalize):
+        queue = Queue()
+        for chunk in shard_chunks:
+            queue.put(chunk)
+        threads = [Thread(target=self._drain, args=(shard, queue), name=f"shard{shard}-{i}", daemon=True)
+                   for i in range(min(max(1, self.concurrency), max(len(shard_chunks), 1)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        try:
+            if finalize is not None:
+                extra = finalize(shard, self._stats[shard]["results"]) or {}
+                with self._lock:
+                    self._stats[shard].update(extra)
+        finally:
+            with self._lock:
+                self._stats[shard]["elapsed"] = time.time() - self._stats[shard]["start"]
+
+    def _report(self, done):
+        while not done.wait(self.report_interval):
+            with self._lock:
+                line = " | ".join(f"s{shard}: {s['sent']} sent "
+                                  f"({s['sent'] / max(s.get('elapsed', time.time() - s['start']), 1e-9):.1f} tx/s)"
+                                  + (" done" if "elapsed" in s else "")
+                                  for shard, s in sorted(self._stats.items()))
+            sys.stdout.write(f"{Typgpy.OKBLUE}{line}{Typgpy.ENDC}\n")
+            sys.stdout.flush()
+
+    def run(self, jobs, finalize=None):
+        """
+        `jobs` is a dict of shard -> list of chunks.
+        `finalize(shard, results)` is called once a shard's queue is drained (i.e: to wait for receipts),
+        it may return a dict of extra fields for that shard's result.
+
+        Returns a dict of shard -> {sent, failed, elapsed, results, ...}.
+        """
+        start = time.time()
+        for shard in jobs.keys():
+            self._stats[shard] = {"sent": 0, "failed": 0, "results": [], "start": start}
+        done = Event()
+        reporter = None
+        if self.verbose and self.report_interval:
+            reporter = Thread(target=self._report, args=(done,), name="scheduler-report", daemon=True)
+            reporter.start()
+        shard_threads = [Thread(target=self._run_shard, args=(shard, shard_chunks, finalize), name=f"shard{shard}")
+                         for shard, shard_chunks in jobs.items()]
+        for t in shard_threads:
+            t.start()
+        for t in shard_threads:
+            t.join()
+        done.set()
+        if reporter is not None:
+            reporter.join()
+        for stats in self._stats.values():
+            stats.pop("start")
+        return self._stats
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+from utils.scheduler import ShardScheduler, chunks
+
+
+class Worker:
+    """
+    Records the concurrent chunks per shard, raises for the first `failures[chunk[0]]` runs of a chunk.
+    """
+
+    def __init__(self, failures=None, delay=0.02):
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.runs = {}
+
+    def __call__(self, shard, chunk):
+        with self.lock:
+            self.runs[(shard, chunk[0])] = self.runs.get((shard, chunk[0]), 0) + 1
+            self.running[shard] = self.running.get(shard, 0) + 1
+            self.max_running[shard] = max(self.max_running.get(shard, 0), self.running[shard])
+            fail = self.failures.get(chunk[0], 0) >= self.runs[(shard, chunk[0])]
+        try:
+            time.sleep(self.delay)
+            if fail:
+                raise RuntimeError("connection reset")
+            return [{"item": item} for item in chunk]
+        finally:
+            with self.lock:
+                self.running[shard] -= 1
+
+
+class TestShardScheduler(unittest.TestCase):
+
+    def run_scheduler(self, worker, jobs, **kwargs):
+        scheduler = ShardScheduler(worker, backoff=0, report_interval=0, verbose=False, **kwargs)
+        return scheduler.run(jobs, finalize=lambda shard, results: {"finalized": len(results)})
+
+    def test_concurrency_per_shard(self):
+        worker = Worker()
+        res = self.run_scheduler(worker, {0: chunks(list(range(20)), 2), 1: chunks(list(range(3)), 1)},
+                                 concurrency=3)
+        self.assertEqual(worker.max_running, {0: 3, 1: 3})
+        self.assertEqual((res[0]["sent"], res[0]["finalized"], res[1]["sent"]), (20, 20, 3))
+        self.assertTrue(all("start" not in r and r["elapsed"] > 0 for r in res.values()))
+
+    def test_one_chunk_at_a_time(self):
+        worker = Worker()
+        self.run_scheduler(worker, {0: chunks(list(range(10)), 2)}, concurrency=1)
+        self.assertEqual(worker.max_running, {0: 1})
+
+    def test_retries(self):
+        # Chunk [0, 1] fails twice then goes through, chunk [2, 3] never does.
+        worker = Worker(failures={0: 2, 2: 10})
+        res = self.run_scheduler(worker, {0: chunks(list(range(4)), 2)}, retries=2)
+        self.assertEqual(worker.runs, {(0, 0): 3, (0, 2): 3})
+        self.assertEqual((res[0]["sent"], res[0]["failed"]), (2, 1))
+        failed = [r for r in res[0]["results"] if "error" in r]
+        self.assertEqual(failed, [{"chunk": [2, 3], "error": "RuntimeError: connection reset"}])
+
+    def test_no_retries(self):
+        worker = Worker(failures={0: 1})
+        res = self.run_scheduler(worker, {0: [[0]]}, retries=0)
+        self.assertEqual(worker.runs, {(0, 0): 1})
+        self.assertEqual(res[0]["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
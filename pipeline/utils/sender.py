@@ -0,0 +1,197 @@
+"""
+In-process transaction sender with a local nonce counter.
+
+Replaces writing a transfer file and shelling out to `hmy transfer --file`:
+transactions are signed locally and submitted as pipelined
+`hmy_sendRawTransaction` batches, with at most `window` transactions in flight.
+"""
+
+from threading import Lock
+
+from utils import (
+    rpc,
+    signing,
+)
+
+DEFAULT_WINDOW = 50
+DEFAULT_RETRIES = 3
+# Rejections where the transaction did not take its nonce, it is safe to re-sign it with a fresh one.
+_nonce_errors = ("nonce too low", "replacement transaction underpriced")
+# The very same signed transaction is already in the pool.
+_known_errors = ("known transaction", "already known")
+
+
+class SendError(Exception):
+    """
+    A window could not be submitted (i.e: transport error), `results` holds the results of the
+    transfers submitted before it, `window` the transfers of the failed window.
+    """
+
+    def __init__(self, cause, results, window):
+        super().__init__(f"{cause.__class__.__name__}: {cause}")
+        self.cause = cause
+        self.results = results
+        self.window = window
+
+
+class NonceManager:
+    """
+    Thread safe nonce counter for one account on one shard, seeded from `hmy_getTransactionCount`.
+    """
+
+    def __init__(self, endpoint, address):
+        self.endpoint = endpoint
+        self.address = address
+        self._lock = Lock()
+        self._nonce = None
+
+    def _fetch(self):
+        return rpc.get_nonce(self.endpoint, self.address, block="pending")
+
+    def seed(self, nonce):
+        """
+        Set the next nonce, i.e: from a batched `rpc.get_nonces` lookup.
+        """
+        with self._lock:
+            self._nonce = nonce
+
+    def take(self, count=1):
+        """
+        Reserve `count` consecutive nonces, returns the first one.
+        """
+        with self._lock:
+            if self._nonce is None:
+                self._nonce = self._fetch()
+            nonce = self._nonce
+            self._nonce += count
+            return nonce
+
+    def resync(self):
+        with self._lock:
+            self._nonce = self._fetch()
+            return self._nonce
+
+    def invalidate(self):
+        """
+        Forget the counter, the next `take` fetches the pending count again.
+        """
+        with self._lock:
+            self._nonce = None
+
+
+class TransactionSender:
+    """
+    Signs and submits transfers from one key on one shard.
+
+    Each transfer is a dict with a `to` address, an `amount` in ONE and optionally a `to-shard`.
+    """
+
+    def __init__(self, endpoint, private_key, shard, chain_id, window=DEFAULT_WINDOW, retries=DEFAULT_RETRIES,
+                 gas_price=signing.DEFAULT_GAS_PRICE, gas_limit=signing.DEFAULT_GAS_LIMIT):
+        assert window > 0, "window must be positive"
+        self.endpoint = endpoint
+        self.private_key = private_key
+        self.address = signing.get_address(private_key)
+        self.shard = shard
+        self.chain_id = signing.get_chain_id_number(chain_id)
+        self.window = window
+        self.retries = retries
+        self.gas_price = gas_price
+        self.gas_limit = gas_limit
+        self.nonces = NonceManager(endpoint, self.address)
+
+    def _sign(self, transfer, nonce):
+        return signing.sign_transfer(self.private_key, nonce, transfer['to'], signing.to_atto(transfer['amount']),
+                                     self.shard, int(transfer.get('to-shard', self.shard)), self.chain_id,
+                                     gas_price=self.gas_price, gas_limit=self.gas_limit)
+
+    def _submit_window(self, transfers, on_submit=None):
+        nonce = self.nonces.take(len(transfers))
+        signed = [self._sign(t, nonce + i) for i, t in enumerate(transfers)]
+        if on_submit is not None:
+            on_submit([dict(t, nonce=nonce + i, hash=tx_hash) for i, (t, (_, tx_hash))
+                       in enumerate(zip(transfers, signed))])
+        try:
+            replies = rpc.batch_call(self.endpoint, [("hmy_sendRawTransaction", [raw]) for raw, _ in signed],
+                                     batch_size=len(signed), error_ok=True)
+        except Exception:
+            # Unknown how much of the window got through, do not leave a nonce gap behind:
+            # the next window starts from the node's pending count.
+            self.nonces.invalidate()
+            raise
+        sent, rejected = [], []
+        for i, (transfer, (_, tx_hash), reply) in enumerate(zip(transfers, signed, replies)):
+            if not isinstance(reply, rpc.RPCError):
+                sent.append(dict(transfer, nonce=nonce + i, hash=reply or tx_hash))
+            elif _is_known(reply):
+                # Already in the pool from an earlier submission, same signed bytes hence same hash.
+                sent.append(dict(transfer, nonce=nonce + i, hash=tx_hash))
+            else:
+                rejected.append((transfer, reply, nonce + i))
+        return sent, rejected
+
+    def _fill_gap(self, nonce):
+        """
+        Zero value transfer to self at `nonce`, so that the transactions queued behind a rejected one
+        (which keep their signed nonces) get executed. Returns whether the node took it.
+        """
+        raw, _ = self._sign({'to': self.address, 'amount': 0}, nonce)
+        reply = rpc.batch_call(self.endpoint, [("hmy_sendRawTransaction", [raw])], batch_size=1, error_ok=True)[0]
+        return not isinstance(reply, rpc.RPCError) or _is_known(reply)
+
+    def send(self, transfers, on_submit=None, on_sent=None):
+        """
+        Sign and submit all `transfers`, `window` at a time.
+
+        A transfer the node already knows (same signed transaction in its pool) counts as sent.
+        Nonce related rejections (the nonce was taken by another transaction) are re-signed with a
+        resynced nonce and retried (up to `retries` times). Any other rejection is final, and if
+        transfers after it in the window were accepted its nonce is filled with a zero value transfer
+        to self so that they do not wait behind the gap.
+
+        `on_submit(transfers)` is called with the signed transfers of each window (with `nonce` and
+        `hash`) right before their first submission, retries are not reported again. `on_sent(results)`
+        is called with the final results of each window, so that callers can journal every submission.
+
+        Returns a list of result dicts: the transfer plus `nonce` and `hash`, or `error` if it was not accepted.
+        Raises SendError, holding the results so far, if a window could not be submitted.
+        """
+        results = []
+        for start in range(0, len(transfers), self.window):
+            pending, attempt = transfers[start:start + self.window], 0
+            while pending:
+                try:
+                    sent, rejected = self._submit_window(pending, on_submit if attempt == 0 else None)
+                except Exception as e:
+                    raise SendError(e, results, pending) from e
+                window_results = list(sent)
+                results.extend(sent)
+                if rejected:
+                    self._after_rejection(sent, rejected)
+                    attempt += 1
+                    pending = []
+                    for transfer, err, _ in rejected:
+                        if attempt <= self.retries and any(m in str(err.error).lower() for m in _nonce_errors):
+                            pending.append(transfer)
+                        else:
+                            window_results.append(dict(transfer, error=str(err)))
+                    results.extend(r for r in window_results if "error" in r)
+                else:
+                    pending = []
+                if on_sent is not None:
+                    on_sent(window_results)
+        return results
+
+    def _after_rejection(self, sent, rejected):
+        accepted = {r['nonce'] for r in sent}
+        for transfer, err, nonce in rejected:
+            final = not any(m in str(err.error).lower() for m in _nonce_errors)
+            if final and any(n > nonce for n in accepted):
+                # Later transfers of the window are queued behind this nonce.
+                if self._fill_gap(nonce):
+                    accepted.add(nonce)
+        self.nonces.resync()
+
+
+def _is_known(err):
+    return any(m in str(err.error).lower() for m in _known_errors)
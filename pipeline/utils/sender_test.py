@@ -0,0 +1,232 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import rlp
+from eth_keys import keys
+from eth_utils import keccak
+
+from utils import bech32
+from utils.sender import SendError, TransactionSender
+
+TEST_KEY = keys.PrivateKey(bytes.fromhex("0336e9be71c31d71d086d9f0887d13cb6701bc45d11b70bb7c14200c9feebe22"))
+TEST_TO = "one1zksj3evekayy90xt4psrz8h6j2v3hla4qwz4ur"
+
+
+class StubNode:
+    """
+    Local JSON-RPC stub that executes transactions in nonce order only, transactions past a nonce gap are queued.
+
+    Other methods are served by `handlers`, a dict of method -> handler(params) returning the reply
+    fields (`{"result": ...}` or `{"error": ...}`), None leaves the call out of the batch reply.
+    Every batch is rejected as a whole with `batch_error` if given.
+    """
+
+    def __init__(self, reject_nonces=(), fail_nonces=None, drop_batches=0, drop_after=0, drop_from=0,
+                 handlers=None, batch_error=None):
+        self.handlers = dict(handlers or {})
+        self.batch_error = batch_error
+        self.batch_sizes = []
+        self.drop_batches = drop_batches
+        self.drop_after = drop_after
+        # Batches let through before the dropped ones.
+        self.drop_from = drop_from
+        self.nonce = 0
+        self.requests = 0
+        self.accepted = []
+        self.queued = {}
+        self.seen = set()
+        self.reject_nonces = set(reject_nonces)
+        # nonce -> error message, rejected once without taking the nonce.
+        self.fail_nonces = dict(fail_nonces or {})
+        self.lock = threading.Lock()
+
+    def _execute(self, fields):
+        self.nonce += 1
+        self.accepted.append(fields)
+        while self.nonce in self.queued:
+            self.accepted.append(self.queued.pop(self.nonce))
+            self.nonce += 1
+
+    def handle(self, req):
+        if req["method"] in self.handlers:
+            fields = self.handlers[req["method"]](req["params"])
+            return None if fields is None else dict(fields, id=req["id"], jsonrpc="2.0")
+        if req["method"] == "hmy_getTransactionCount":
+            return {"id": req["id"], "jsonrpc": "2.0", "result": hex(self.nonce)}
+        assert req["method"] == "hmy_sendRawTransaction"
+        raw = req["params"][0]
+        fields = rlp.decode(bytes.fromhex(raw[2:]))
+        nonce = int.from_bytes(fields[0], 'big')
+        if raw in self.seen:
+            return {"id": req["id"], "jsonrpc": "2.0", "error": {"code": -32000, "message": "known transaction"}}
+        if nonce in self.reject_nonces:
+            self.reject_nonces.remove(nonce)
+            self.nonce += 1  # Simulate the nonce being used by another sender.
+            return {"id": req["id"], "jsonrpc": "2.0", "error": {"code": -32000, "message": "nonce too low"}}
+        if nonce in self.fail_nonces:
+            return {"id": req["id"], "jsonrpc": "2.0", "error": {"code": -32000, "message": self.fail_nonces.pop(nonce)}}
+        if nonce < self.nonce:
+            return {"id": req["id"], "jsonrpc": "2.0", "error": {"code": -32000, "message": "nonce too low"}}
+        self.seen.add(raw)
+        if nonce > self.nonce:
+            self.queued[nonce] = fields
+        else:
+            self._execute(fields)
+        return {"id": req["id"], "jsonrpc": "2.0", "result": "0x" + keccak(bytes.fromhex(raw[2:])).hex()}
+
+    def serve(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with node.lock:
+                    node.requests += 1
+                    if isinstance(body, list):
+                        node.batch_sizes.append(len(body))
+                    if isinstance(body, list) and node.drop_from:
+                        node.drop_from -= 1
+                    elif isinstance(body, list) and node.drop_batches:
+                        # Take the first `drop_after` transactions, then drop the connection without a reply.
+                        node.drop_batches -= 1
+                        for r in body[:node.drop_after]:
+                            node.handle(r)
+                        self.close_connection = True
+                        return
+                    if isinstance(body, list) and node.batch_error is not None:
+                        reply = {"id": None, "jsonrpc": "2.0", "error": node.batch_error}
+                    elif isinstance(body, list):
+                        reply = [el for el in map(node.handle, body) if el is not None]
+                    else:
+                        reply = node.handle(body)
+                data = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *_):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+class TestTransactionSender(unittest.TestCase):
+
+    def test_send_sequential_nonces(self):
+        node = StubNode()
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=50)
+            transfers = [{"to": TEST_TO, "amount": "1.5"} for _ in range(500)]
+            results = sender.send(transfers)
+        finally:
+            server.shutdown()
+        self.assertEqual(len(results), 500)
+        self.assertTrue(all("error" not in r for r in results))
+        self.assertEqual([r["nonce"] for r in results], list(range(500)))
+        # 1 nonce lookup + 1 round trip per window.
+        self.assertEqual(node.requests, 1 + 500 // 50)
+        fields = node.accepted[0]
+        self.assertEqual(fields[5], bech32.to_bytes(TEST_TO))
+        self.assertEqual(int.from_bytes(fields[6], 'big'), 15 * 10 ** 17)
+
+    def test_resync_on_rejected_nonce(self):
+        node = StubNode(reject_nonces={3})
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 1, 2, window=10)
+            results = sender.send([{"to": TEST_TO, "amount": 1} for _ in range(20)])
+        finally:
+            server.shutdown()
+        self.assertTrue(all("error" not in r for r in results))
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(node.accepted), 20)
+
+    def test_resync_after_transport_error(self):
+        node = StubNode(drop_batches=1, drop_after=4)
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=10)
+            with self.assertRaises(SendError):
+                sender.send([{"to": TEST_TO, "amount": 1} for _ in range(10)])
+            results = sender.send([{"to": TEST_TO, "amount": 1} for _ in range(5)])
+        finally:
+            server.shutdown()
+        # No gap: the next transactions continue right after the 4 the node took.
+        self.assertTrue(all("error" not in r for r in results))
+        self.assertEqual([r["nonce"] for r in results], list(range(4, 9)))
+        self.assertEqual(len(node.accepted), 9)
+        self.assertEqual(node.queued, {})
+
+    def test_partial_results_on_transport_error(self):
+        # The first two windows go through, the third one is dropped.
+        node = StubNode(drop_batches=1, drop_after=2, drop_from=2)
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=5)
+            submitted, sent = [], []
+            with self.assertRaises(SendError) as ctx:
+                sender.send([{"to": TEST_TO, "amount": 1} for _ in range(15)],
+                            on_submit=submitted.extend, on_sent=sent.extend)
+        finally:
+            server.shutdown()
+        self.assertEqual([r["nonce"] for r in ctx.exception.results], list(range(10)))
+        self.assertEqual(sent, ctx.exception.results)
+        self.assertEqual(len(ctx.exception.window), 5)
+        # The failed window was reported before its submission.
+        self.assertEqual([r["nonce"] for r in submitted], list(range(15)))
+
+    def test_known_transaction_is_sent(self):
+        node = StubNode()
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=5)
+            first = sender.send([{"to": TEST_TO, "amount": 1} for _ in range(3)])
+            # Same nonces, same signed bytes: the node already has them.
+            sender.nonces.seed(0)
+            again = sender.send([{"to": TEST_TO, "amount": 1} for _ in range(3)])
+        finally:
+            server.shutdown()
+        self.assertTrue(all("error" not in r for r in again))
+        self.assertEqual([r["hash"] for r in again], [r["hash"] for r in first])
+        self.assertEqual(len(node.accepted), 3)
+
+    def test_final_rejection_fills_the_gap(self):
+        node = StubNode(fail_nonces={2: "insufficient funds for gas * price + value"})
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=5)
+            results = sender.send([{"to": TEST_TO, "amount": i} for i in range(10)])
+        finally:
+            server.shutdown()
+        errors = [r for r in results if "error" in r]
+        self.assertEqual([r["amount"] for r in errors], [2])
+        self.assertIn("insufficient funds", errors[0]["error"])
+        # Nothing is left waiting behind nonce 2: a zero value transfer took it, the rest of the window executed.
+        self.assertEqual(node.queued, {})
+        self.assertEqual(len(node.accepted), 10)
+        self.assertEqual(int.from_bytes(node.accepted[2][6], 'big'), 0)
+        self.assertEqual(sorted(r["nonce"] for r in results if "error" not in r), [0, 1] + list(range(3, 10)))
+
+    def test_final_rejection_at_window_end(self):
+        node = StubNode(fail_nonces={4: "insufficient funds for gas * price + value"})
+        server, endpoint = node.serve()
+        try:
+            sender = TransactionSender(endpoint, TEST_KEY, 0, "testnet", window=5)
+            results = sender.send([{"to": TEST_TO, "amount": 1} for _ in range(10)])
+        finally:
+            server.shutdown()
+        # Nothing queued behind it: no filler, the next window reuses the nonce.
+        self.assertEqual(len([r for r in results if "error" in r]), 1)
+        self.assertEqual(len(node.accepted), 9)
+        self.assertEqual(node.queued, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Local signing of plain Harmony transfers.
+
+Harmony transactions are the Ethereum legacy transaction with two extra fields,
+the source and destination shard, signed with EIP-155 replay protection.
+"""
+
+import glob
+import json
+import os
+from decimal import Decimal
+
+import rlp
+from eth_account import Account
+from eth_keys import keys
+from eth_utils import keccak
+
+from utils import bech32
+
+DEFAULT_GAS_PRICE = 10 ** 9  # 1 Nano, same default as the CLI.
+DEFAULT_GAS_LIMIT = 21000
+CHAIN_IDS = {
+    "mainnet": 1,
+    "testnet": 2,
+    "localnet": 2,
+    "pangaea": 3,
+    "partner": 4,
+    "stressnet": 5,
+    "stress": 5,
+}
+
+
+def get_chain_id_number(chain_id):
+    """
+    Accepts either a CLI chain-id name (i.e: `testnet`) or a number.
+    """
+    if isinstance(chain_id, int):
+        return chain_id
+    if str(chain_id).isdigit():
+        return int(chain_id)
+    assert chain_id in CHAIN_IDS, f"unknown chain-id `{chain_id}`"
+    return CHAIN_IDS[chain_id]
+
+
+def to_atto(amount):
+    """
+    Convert an amount in ONE (float, str or Decimal) to atto.
+    """
+    return int(Decimal(str(amount)) * Decimal(10 ** 18))
+
+
+def load_private_key(keystore_file, passphrase=''):
+    with open(keystore_file, 'r') as f:
+        return keys.PrivateKey(Account.decrypt(json.load(f), passphrase))
+
+
+def load_private_key_from_cli(cli_keystore_dir, account_name, passphrase=''):
+    """
+    Decrypt the key that the CLI keeps under `account_name` in its keystore.
+    """
+    key_files = glob.glob(f"{cli_keystore_dir}/{account_name}/*")
+    assert len(key_files) == 1, f"expected 1 keystore file for `{account_name}`, got {key_files}"
+    return load_private_key(key_files[0], passphrase)
+
+
+def get_address(private_key):
+    return bech32.from_bytes(private_key.public_key.to_canonical_address())
+
+
+def sign_transfer(private_key, nonce, to, amount_atto, shard, to_shard, chain_id,
+                  gas_price=DEFAULT_GAS_PRICE, gas_limit=DEFAULT_GAS_LIMIT, data=b''):
+    """
+    Sign a transfer of `amount_atto` to the `one1...` address `to`.
+
+    Returns the raw transaction as a 0x prefixed hex string and its hash.
+    """
+    fields = [nonce, gas_price, gas_limit, shard, to_shard, bech32.to_bytes(to), amount_atto, data]
+    signature = private_key.sign_msg_hash(keccak(rlp.encode(fields + [chain_id, 0, 0])))
+    v = signature.v + 35 + 2 * chain_id
+    raw_tx = rlp.encode(fields + [v, signature.r, signature.s])
+    return "0x" + raw_tx.hex(), "0x" + keccak(raw_tx).hex()
@@ -1,26 +1,34 @@
-import utils
-import mylogger
+import datetime
+import math
+import threading
+import time
+
+from utils import launch_template, mylogger, utils
 
 LOGGER = mylogger.getLogger(__file__)
 
-def create_launch_specification(region_number, instanceType):
+def create_launch_specification(region_number, instanceType, region):
+    """
+    `region` is the region's entry of the region config.
+    """
+    user_data = utils.USER_DATA_BASE64
     return {
         # Region irrelevant fields
         'IamInstanceProfile': {
             'Name': utils.IAM_INSTANCE_PROFILE
         },
         'InstanceType': instanceType,
-        'UserData': utils.USER_DATA_BASE64,
+        'UserData': user_data.decode('ascii') if isinstance(user_data, bytes) else user_data,
         # Region relevant fields
         'SecurityGroups': [
             {
                 # In certain scenarios, we have to use group id instead of group name
                 # https://github.com/boto/boto/issues/350#issuecomment-27359492
-                'GroupId': utils.CONFIG[region_number][utils.REGION_SECURITY_GROUP_ID]
+                'GroupId': region[utils.REGION_SECURITY_GROUP_ID]
             }
         ],
-        'ImageId': utils.CONFIG[region_number][utils.REGION_AMI],
-        'KeyName': utils.CONFIG[region_number][utils.REGION_KEY],
+        'ImageId': region[utils.REGION_AMI],
+        'KeyName': region[utils.REGION_KEY],
         'TagSpecifications': [
             {
                 'ResourceType': 'instance',
@@ -39,15 +47,16 @@ def create_launch_specification(region_number, instanceType):
     }
 
 
-def create_launch_specification_list(region_number, instance_type_list):
-    return list(map(lambda type: create_launch_specification(region_number, type), instance_type_list))
+def create_launch_specification_list(region_number, instance_type_list, region_config='configuration.txt'):
+    region = utils.get_region_config(region_config)[region_number]
+    return list(map(lambda type: create_launch_specification(region_number, type, region), instance_type_list))
 
 
-def get_launch_template(region_number, instance_type):
+def get_launch_template(region_number, instance_type, version, region_config='configuration.txt'):
     return {
         'LaunchTemplateSpecification': {
-            'LaunchTemplateName': launch_template.get_launch_template_name(region_number),
-            'Version': '1'
+            'LaunchTemplateName': launch_template.get_launch_template_name(region_number, region_config),
+            'Version': version
         },
         'Overrides': [
             {
@@ -57,11 +66,11 @@ def get_launch_template(region_number, instance_type):
     }
 
 
-def get_launch_template_list(region_number, instance_type_list):
-    return list(map(lambda type: get_launch_template(region_number, type), instance_type_list))
+def get_launch_template_list(region_number, instance_type_list, version, region_config='configuration.txt'):
+    return list(map(lambda type: get_launch_template(region_number, type, version, region_config), instance_type_list))
 
 
-def request_spot_fleet(ec2_client, region_number, number_of_instances, instance_type_list):
+def request_spot_fleet(ec2_client, region_number, number_of_instances, instance_type_list, region_config='configuration.txt'):
     LOGGER.info("Requesting spot fleet")
     LOGGER.info("Creating node_name_tag: %s" %
                 utils.get_node_name_tag(region_number))
@@ -72,7 +81,7 @@ def request_spot_fleet(ec2_client, region_number, number_of_instances, instance_
             # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/spot-fleet.html#spot-fleet-allocation-strategy
             'AllocationStrategy': 'diversified',
             'IamFleetRole': 'arn:aws:iam::656503231766:role/RichardFleetRole',
-            'LaunchSpecifications': create_launch_specification_list(region_number, instance_type_list),
+            'LaunchSpecifications': create_launch_specification_list(region_number, instance_type_list, region_config),
             # 'SpotPrice': 'string', # The maximum price per unit hour that you are willing to pay for a Spot Instance. The default is the On-Demand price.
             'TargetCapacity': number_of_instances,
             'Type': 'maintain'
@@ -81,10 +90,13 @@ def request_spot_fleet(ec2_client, region_number, number_of_instances, instance_
     return response["SpotFleetRequestId"]
 
 
-def request_spot_fleet_with_on_demand(ec2_client, region_number, number_of_instances, number_of_on_demand, instance_type_list):
+def request_spot_fleet_with_on_demand(ec2_client, region_number, number_of_instances, number_of_on_demand, instance_type_list,
+                                      profile='default', region_config='configuration.txt'):
     LOGGER.info("Requesting spot fleet")
     LOGGER.info("Creating node_name_tag: %s" %
                 utils.get_node_name_tag(region_number))
+    # Current user data, a new template version is created only when it changed.
+    version = launch_template.get_version(ec2_client, region_number, profile, region_config)
     # https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#EC2.Client.request_spot_fleet
     response = ec2_client.request_spot_fleet(
         # DryRun=True,
@@ -92,7 +104,7 @@ def request_spot_fleet_with_on_demand(ec2_client, region_number, number_of_insta
             # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/spot-fleet.html#spot-fleet-allocation-strategy
             'AllocationStrategy': 'diversified',
             'IamFleetRole': 'arn:aws:iam::656503231766:role/RichardFleetRole',
-            'LaunchTemplateConfigs': get_launch_template_list(region_number, instance_type_list),
+            'LaunchTemplateConfigs': get_launch_template_list(region_number, instance_type_list, version, region_config),
             # 'SpotPrice': 'string', # The maximum price per unit hour that you are willing to pay for a Spot Instance. The default is the On-Demand price.
             'TargetCapacity': number_of_instances,
             'OnDemandTargetCapacity': number_of_on_demand,
@@ -101,18 +113,262 @@ def request_spot_fleet_with_on_demand(ec2_client, region_number, number_of_insta
     )
     return response
 
+FLEET_POLL_INTERVAL = 10
+# Seconds to wait for the fleet capacity, the regions still short by then are given up on.
+FLEET_TIMEOUT = 600
+# Spot fleet request states after which no more capacity arrives.
+FINAL_REQUEST_STATES = ['cancelled', 'cancelled_running', 'cancelled_terminating', 'expired', 'failed']
+
 def get_instance_ids(client, request_id):
-    res = client.describe_spot_fleet_instances(
-        SpotFleetRequestId=request_id
-    )
-    return [ inst["InstanceId"] for inst in res["ActiveInstances"] ]
+    """
+    Ids of the active instances of spot fleet `request_id`, every page.
+    """
+    instance_ids = []
+    kwargs = {'SpotFleetRequestId': request_id}
+    while True:
+        res = client.describe_spot_fleet_instances(**kwargs)
+        instance_ids.extend(inst["InstanceId"] for inst in res["ActiveInstances"])
+        if not res.get("NextToken"):
+            return instance_ids
+        kwargs['NextToken'] = res["NextToken"]
+
+def get_request_history(client, request_id, start_time):
+    """
+    Events of spot fleet `request_id` since `start_time`, every page.
+    Returns (events, last evaluated time), the latter is the `start_time` of the next call.
+    """
+    events = []
+    kwargs = {'SpotFleetRequestId': request_id, 'StartTime': start_time}
+    while True:
+        res = client.describe_spot_fleet_request_history(**kwargs)
+        events.extend(res.get("HistoryRecords", []))
+        start_time = res.get("LastEvaluatedTime", start_time)
+        if not res.get("NextToken"):
+            return events, start_time
+        kwargs['NextToken'] = res["NextToken"]
+
+def describe_instances(client, instance_ids):
+    """
+    InstanceId, PublicIpAddress and Name tag of `instance_ids`, in chunks of 100.
+    """
+    instances = []
+    for k in range(0, len(instance_ids), utils.MAX_INTANCES_FOR_WAITER):
+        kwargs = {'InstanceIds': instance_ids[k:k + utils.MAX_INTANCES_FOR_WAITER]}
+        while True:
+            res = client.describe_instances(**kwargs)
+            for reservation in res["Reservations"]:
+                for inst in reservation["Instances"]:
+                    tags = dict((tag["Key"], tag["Value"]) for tag in inst.get("Tags", []))
+                    instances.append({'InstanceId': inst["InstanceId"],
+                                      'PublicIpAddress': inst.get("PublicIpAddress"),
+                                      'Name': tags.get("Name")})
+            if not res.get("NextToken"):
+                break
+            kwargs['NextToken'] = res["NextToken"]
+    return instances
+
+class FleetProvisioner(object):
+    """
+    Tracks spot fleet requests of several regions until their capacity is launched.
+
+    `fleet` is a list of (region_number, ec2_client, request_id, target_capacity, submit_time), a
+    request_id of None is a region whose request failed: its capacity counts in the total but never arrives.
+    Every poll reads the request history since the previous poll, and lists the fleet
+    instances only when it reports instance changes. New instances are passed to
+    `on_instances(region_number, instances)` as soon as they have a public IP, instances
+    are dicts with InstanceId, PublicIpAddress and Name.
+    """
+
+    def __init__(self, fleet, poll_interval=FLEET_POLL_INTERVAL, on_instances=None):
+        self.regions = [{
+            'region_number': region_number,
+            'client': ec2_client,
+            'request_id': request_id,
+            'target': target_capacity,
+            'since': submit_time,
+            'state': 'submitted' if request_id is not None else 'failed',
+            'listed': False,
+            'awaiting_ip': set(),
+            'instances': {},
+        } for region_number, ec2_client, request_id, target_capacity, submit_time in fleet]
+        self.poll_interval = poll_interval
+        self.on_instances = on_instances
+        self.expired = False
+        self._lock = threading.Lock()
+
+    def total(self):
+        return sum(region['target'] for region in self.regions)
+
+    def instances(self):
+        """
+        Launched instances with a public IP, in order of arrival per region.
+        """
+        with self._lock:
+            return [inst for region in self.regions for inst in region['instances'].values()]
+
+    def short(self):
+        """
+        (region_number, launched, target) of the regions that did not launch their whole capacity.
+        """
+        with self._lock:
+            return [(region['region_number'], len(region['instances']), region['target']) for region in self.regions
+                    if len(region['instances']) < region['target']]
+
+    def done(self, region):
+        return region['state'] in FINAL_REQUEST_STATES or len(region['instances']) >= region['target']
+
+    def _poll_region(self, region):
+        client = region['client']
+        try:
+            events, region['since'] = get_request_history(client, region['request_id'], region['since'])
+            changed = not region['listed']
+            for event in events:
+                info = event.get('EventInformation', {})
+                if event.get('EventType') == 'error':
+                    LOGGER.warning("%s: %s %s" % (region['region_number'], info.get('EventSubType'),
+                                                  info.get('EventDescription', '')))
+                elif event.get('EventType') == 'fleetRequestChange':
+                    region['state'] = info.get('EventSubType', region['state'])
+                elif event.get('EventType') == 'instanceChange':
+                    changed = True
+            if changed:
+                active = set(get_instance_ids(client, region['request_id']))
+                region['listed'] = True
+                with self._lock:
+                    for instance_id in set(region['instances']) - active:
+                        del region['instances'][instance_id]
+                region['awaiting_ip'] = (region['awaiting_ip'] | active) - set(region['instances'])
+            if not region['awaiting_ip']:
+                return
+            arrived = [inst for inst in describe_instances(client, sorted(region['awaiting_ip']))
+                       if inst['PublicIpAddress']]
+        except Exception as e:  # i.e: throttling or ids not visible yet, retry next round
+            LOGGER.warning("%s: polling spot fleet %s failed: %s" % (region['region_number'], region['request_id'], e))
+            return
+        if not arrived:
+            return
+        with self._lock:
+            for inst in arrived:
+                region['instances'][inst['InstanceId']] = inst
+                region['awaiting_ip'].discard(inst['InstanceId'])
+        if self.on_instances is not None:
+            self.on_instances(region['region_number'], arrived)
+
+    def poll(self):
+        """
+        One round over the regions that still wait for capacity, all at once.
+        """
+        thread_pool = [threading.Thread(target=self._poll_region, args=(region,))
+                       for region in self.regions if not self.done(region)]
+        for t in thread_pool:
+            t.start()
+        for t in thread_pool:
+            t.join()
+
+    def wait(self, fraction=1.0, timeout=FLEET_TIMEOUT):
+        """
+        Poll until `fraction` of the total capacity is launched, for at most `timeout` seconds
+        (None waits as long as some region may still launch instances).
+
+        Returns True once enough instances arrived, False on timeout (`expired` is then set) or when every
+        region is done without reaching it.
+        """
+        self.expired = False
+        needed = int(math.ceil(fraction * self.total()))
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.poll()
+            if len(self.instances()) >= needed:
+                return True
+            if all(self.done(region) for region in self.regions):
+                return False
+            if deadline is not None and time.time() + self.poll_interval > deadline:
+                self.expired = True
+                return False
+            time.sleep(self.poll_interval)
+
+def submit(profile, instances_per_region, instance_type_list, region_config='configuration.txt'):
+    """
+    Requests a spot fleet in every region of `instances_per_region` (region number -> count) at once.
+    Returns the fleet list of FleetProvisioner, regions whose request failed are in it without a request id.
+    """
+    fleet = []
+    errors = []
+    lock = threading.Lock()
+
+    def request(region_number, number_of_instances):
+        try:
+            ec2_client, _ = utils.create_ec2_client(profile, region_number, region_config)
+            # Some slack for the local clock, history events before the request are harmless.
+            submit_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+            request_id = request_spot_fleet(ec2_client, region_number, number_of_instances, instance_type_list,
+                                            region_config)
+            with lock:
+                fleet.append((region_number, ec2_client, request_id, number_of_instances, submit_time))
+        except Exception as e:
+            LOGGER.error("%s: spot fleet request failed: %s" % (region_number, e))
+            with lock:
+                errors.append(region_number)
+                fleet.append((region_number, None, None, number_of_instances, None))
+
+    thread_pool = [threading.Thread(target=request, args=(region_number, int(number_of_instances)))
+                   for region_number, number_of_instances in sorted(instances_per_region.items())]
+    for t in thread_pool:
+        t.start()
+    for t in thread_pool:
+        t.join()
+    if errors:
+        LOGGER.error("spot fleet request failed in region(s) %s" % ", ".join(sorted(errors)))
+    return sorted(fleet, key=lambda region: region[0])
+
+def run(profile, instances_per_region, instance_type_list, fout, fout2, region_config='configuration.txt',
+        fraction=1.0, timeout=FLEET_TIMEOUT, poll_interval=FLEET_POLL_INTERVAL):
+    """
+    Provisions the spot fleets of all regions at once and streams every instance as soon as it has
+    a public IP: `ip node_name_tag region` to `fout` (the raw_ip.txt inventory format) and its id to `fout2`.
+    Returns the inventory lines. After `timeout` seconds these are the instances launched so far
+    (the regions still short are logged), and None when every region is done with less than `fraction`
+    of the capacity.
+    """
+    ip_list = []
+
+    def stream(region_number, instances):
+        lines = ["%s %s %s\n" % (inst['PublicIpAddress'], inst['Name'] or utils.get_node_name_tag(region_number),
+                                 region_number) for inst in instances]
+        ip_list.extend(line.strip() for line in lines)
+        fout.write("".join(lines))
+        fout.flush()
+        fout2.write("".join("%s\n" % inst['InstanceId'] for inst in instances))
+        fout2.flush()
+        LOGGER.info("%s: %d new instance(s), %d total" % (region_number, len(instances), len(ip_list)))
+
+    provisioner = FleetProvisioner(submit(profile, instances_per_region, instance_type_list, region_config),
+                                   poll_interval, on_instances=stream)
+    if not provisioner.wait(fraction, timeout):
+        LOGGER.error("only %d/%d spot instance(s) launched, short in region(s) %s" % (
+            len(provisioner.instances()), provisioner.total(),
+            ", ".join("%s (%d/%d)" % region for region in provisioner.short())))
+        if not provisioner.expired:
+            return None
+        LOGGER.warning("timed out after %ss, going on with the partial fleet" % timeout)
+    return ip_list
+
+def run_distribution(profile, instances_per_region, instance_type_list, fout, fout2, shard_number, explorer_number,
+                     client_number, distribution_config, commander_number=0, region_config='configuration.txt',
+                     fraction=1.0, timeout=FLEET_TIMEOUT, poll_interval=FLEET_POLL_INTERVAL):
+    """
+    run, then generates the distribution config of whatever launched, without waiting for the slowest regions
+    once `fraction` of the capacity is up.
+    """
+    ip_list = run(profile, instances_per_region, instance_type_list, fout, fout2, region_config, fraction, timeout,
+                  poll_interval)
+    if ip_list is None:
+        return False
+    return utils.generate_distribution_config(shard_number, explorer_number, client_number, ip_list,
+                                              distribution_config, commander_number)
 
-def run_one_region(region_number, number_of_instances, fout, fout2):
-    client = utils.create_client(utils.CONFIG, region_number)
+def run_one_region(region_number, number_of_instances, fout, fout2, profile='default', region_config='configuration.txt'):
     instance_type_list = ['t2.micro', 't2.small', 'm3.medium']
     # node_name_tag = request_spot_fleet_with_on_demand(
     #     client, region_number, int(number_of_instances), 1, instance_type_list)
-    request_id = request_spot_fleet(
-        client, region_number, int(number_of_instances), instance_type_list)
-    instance_ids = get_instance_ids(client, request_id)
-    print(instance_ids) # TODO@ricl, no data here since the request is not fulfilled.
+    return run(profile, {region_number: number_of_instances}, instance_type_list, fout, fout2, region_config)
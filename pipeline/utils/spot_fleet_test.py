@@ -0,0 +1,159 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import spot_fleet, utils
+
+
+class StubEC2:
+    """
+    EC2 client stub for one region. Every history call launches `per_poll` more instances, an instance gets
+    its public IP one describe_instances call after it shows up. Results are paged `page_size` at a time.
+    """
+
+    def __init__(self, region_number, per_poll=3, page_size=2):
+        self.region_number = region_number
+        self.per_poll = per_poll
+        self.page_size = page_size
+        self.target = 0
+        self.launched = []
+        self.seen = set()
+        self.calls = {'history': 0, 'instances': 0, 'describe': 0}
+
+    def request_spot_fleet(self, SpotFleetRequestConfig):
+        self.config = SpotFleetRequestConfig
+        self.target = SpotFleetRequestConfig['TargetCapacity']
+        return {"SpotFleetRequestId": "sfr-%s" % self.region_number}
+
+    def _page(self, items, token):
+        start = int(token or 0)
+        return items[start:start + self.page_size], (str(start + self.page_size)
+                                                     if start + self.page_size < len(items) else None)
+
+    def describe_spot_fleet_request_history(self, SpotFleetRequestId, StartTime, NextToken=None):
+        if NextToken is None:
+            self.calls['history'] += 1
+            new = min(self.per_poll, self.target - len(self.launched))
+            self.launched.extend("i-%s-%d" % (self.region_number, len(self.launched) + k) for k in range(new))
+            self.events = [{"EventType": "instanceChange", "EventInformation": {"EventSubType": "launched"}}] * new
+        records, token = self._page(self.events, NextToken)
+        res = {"HistoryRecords": records, "LastEvaluatedTime": self.calls['history']}
+        if token:
+            res["NextToken"] = token
+        return res
+
+    def describe_spot_fleet_instances(self, SpotFleetRequestId, NextToken=None):
+        self.calls['instances'] += 1
+        ids, token = self._page(self.launched, NextToken)
+        res = {"ActiveInstances": [{"InstanceId": i} for i in ids]}
+        if token:
+            res["NextToken"] = token
+        return res
+
+    def describe_instances(self, InstanceIds, NextToken=None):
+        self.calls['describe'] += 1
+        instances = []
+        for i in InstanceIds:
+            inst = {"InstanceId": i, "Tags": [{"Key": "Name", "Value": "%s-NODE-test" % self.region_number}]}
+            if i in self.seen:
+                inst["PublicIpAddress"] = "10.%s.0.%s" % (self.region_number, i.rsplit("-", 1)[1])
+            self.seen.add(i)
+            instances.append(inst)
+        return {"Reservations": [{"Instances": instances}]}
+
+
+class FailingEC2(StubEC2):
+
+    def request_spot_fleet(self, SpotFleetRequestConfig):
+        raise RuntimeError("MaxSpotFleetRequestCountExceeded")
+
+
+class TestFleetProvisioner(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.region_config = os.path.join(self.dir, "configuration.txt")
+        with open(self.region_config, "w") as f:
+            f.write("1,us-east-1,key-1,sg-1,virginia,ami-1,sg-id-1\n2,us-west-2,key-2,sg-2,oregon,ami-2,sg-id-2\n")
+        userdata = os.path.join(self.dir, "userdata.sh")
+        with open(userdata, "w") as f:
+            f.write("userdata")
+        utils.get_user_data(userdata)
+        self.clients = {}
+        # Only the boto3 client is stubbed, regions are resolved through the region config.
+        self.get_ec2_client = utils.get_ec2_client
+        regions = {"us-east-1": "1", "us-west-2": "2"}
+        utils.get_ec2_client = lambda profile, region_name: (self.clients[regions[region_name]], None)
+
+    def tearDown(self):
+        utils.get_ec2_client = self.get_ec2_client
+        shutil.rmtree(self.dir)
+
+    def run_distribution(self, clients, fraction=1.0, timeout=spot_fleet.FLEET_TIMEOUT):
+        self.clients = clients
+        self.raw_ip, self.ids = io.StringIO(), io.StringIO()
+        return spot_fleet.run_distribution("default", {"1": 4, "2": 4}, ["t2.micro"], self.raw_ip, self.ids, 1, 0, 0,
+                                           os.path.join(self.dir, "distribution_config.txt"),
+                                           region_config=self.region_config, fraction=fraction, timeout=timeout,
+                                           poll_interval=0)
+
+    def test_streams_instances_as_they_arrive(self):
+        fast, slow = StubEC2("1", per_poll=5), StubEC2("2", per_poll=1)
+        for client, target in ((fast, 5), (slow, 3)):
+            client.request_spot_fleet({'TargetCapacity': target})
+        arrived = []
+        provisioner = spot_fleet.FleetProvisioner([("1", fast, "sfr-1", 5, 0), ("2", slow, "sfr-2", 3, 0)],
+                                                  poll_interval=0, on_instances=lambda r, i: arrived.append((r, i)))
+        self.assertTrue(provisioner.wait())
+        self.assertEqual(len(provisioner.instances()), 8)
+        # The fast region streamed all of its capacity in the second round, before the slow one was done.
+        self.assertEqual(arrived[0][0], "1")
+        self.assertEqual(len(arrived[0][1]), 5)
+        # Once fulfilled a region is not polled any more.
+        self.assertEqual(fast.calls['history'], 2)
+        self.assertEqual(slow.calls['history'], 4)
+
+    def test_skips_listing_without_instance_changes(self):
+        client = StubEC2("1", per_poll=2)
+        client.request_spot_fleet({'TargetCapacity': 2})
+        provisioner = spot_fleet.FleetProvisioner([("1", client, "sfr-1", 2, 0)], poll_interval=0)
+        provisioner.poll()
+        provisioner.poll()
+        provisioner.poll()
+        # Listed on the first poll only, the later history pages were empty.
+        self.assertEqual(client.calls['instances'], 1)
+        self.assertEqual(len(provisioner.instances()), 2)
+
+    def test_run_distribution(self):
+        rows = self.run_distribution({"1": StubEC2("1", per_poll=4), "2": StubEC2("2", per_poll=4)})
+        self.assertEqual(len(self.raw_ip.getvalue().splitlines()), 8)
+        self.assertEqual(len(self.ids.getvalue().splitlines()), 8)
+        self.assertEqual(sorted(role for _, role, _ in rows).count("leader"), 1)
+        spec = self.clients["2"].config['LaunchSpecifications'][0]
+        self.assertEqual((spec['ImageId'], spec['KeyName'], spec['UserData']), ("ami-2", "key-2", "dXNlcmRhdGE="))
+
+    def test_failed_regions_count_in_the_capacity(self):
+        # Half of the capacity cannot come, a full fleet is never reached.
+        self.assertFalse(self.run_distribution({"1": StubEC2("1", per_poll=4), "2": FailingEC2("2")}))
+        self.assertEqual(len(self.raw_ip.getvalue().splitlines()), 4)
+        self.assertEqual(len(self.run_distribution({"1": StubEC2("1", per_poll=4), "2": FailingEC2("2")},
+                                                   fraction=0.5)), 4)
+
+    def test_timeout_returns_partial_fleet(self):
+        # Region 2 never launches anything and its request never ends.
+        stuck = StubEC2("2", per_poll=0)
+        with self.assertLogs(spot_fleet.LOGGER, "ERROR") as logs:
+            rows = self.run_distribution({"1": StubEC2("1", per_poll=4), "2": stuck}, timeout=0.2)
+        self.assertEqual(len(rows), 4)
+        self.assertIn("short in region(s) 2 (0/4)", logs.output[0])
+
+    def test_all_regions_fail(self):
+        self.assertFalse(self.run_distribution({"1": FailingEC2("1"), "2": FailingEC2("2")}))
+        self.assertIsNone(spot_fleet.run("default", {"1": 4, "2": 4}, ["t2.micro"], io.StringIO(), io.StringIO(),
+                                         self.region_config, poll_interval=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,12 @@
+"""
+Summary statistics shared by the report scripts.
+"""
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank `p` percentile of the already sorted `sorted_values`, 0 if empty.
+    """
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(round(p / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)]
@@ -0,0 +1,142 @@
+"""
+Consensus and TPS statistics from leader and validator logs.
+
+Each log file is read once: HOORAY (leader committed a block), BINGO
+(validator committed a block) and TPS report lines are all picked up in the
+same pass, and files are processed in parallel.
+
+The headline numbers follow cal_tps.sh: a file's average TPS is the mean over
+every line containing `TPS` of the number that follows the first `:`
+(0 if there is none), and the total TPS is the sum of the rounded averages.
+"""
+
+import os
+import re
+from datetime import datetime, timezone
+from multiprocessing import Pool, cpu_count
+
+from utils.stats import percentile
+
+_number = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_time = re.compile(r'"time":"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[-+]\d\d:?\d\d)?"')
+_name = re.compile(r'zerolog-\w+-(.+)-\d+\.log')
+
+
+def _awk_number(text):
+    """
+    Numeric value of the first whitespace separated field of `text`, the way awk converts it.
+    """
+    fields = text.split()
+    if not fields:
+        return 0.0
+    m = _number.match(fields[0])
+    return float(m.group(0)) if m else 0.0
+
+
+def report_tps(line):
+    """
+    TPS value of a line the way `cut -f 2 -d: | cut -f 1 -d ,` followed by awk reads it.
+    """
+    parts = line.split(':', 1)
+    return _awk_number(parts[1].split(',', 1)[0]) if len(parts) > 1 else 0.0
+
+
+def parse_time(line):
+    """
+    Returns the zerolog `time` field of `line` as a unix timestamp or None.
+    """
+    m = _time.search(line)
+    if not m:
+        return None
+    stamp = datetime.strptime(m.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    offset = m.group(3)
+    if offset and offset != 'Z':
+        digits = offset[1:].replace(':', '')
+        stamp -= (-1 if offset[0] == '-' else 1) * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return stamp + (float(m.group(2)) if m.group(2) else 0.0)
+
+
+def node_name(path):
+    m = _name.search(os.path.basename(path))
+    return m.group(1) if m else os.path.basename(path)
+
+
+def parse_log(path):
+    """
+    Single pass over one log file.
+
+    Returns a dict with the number of HOORAY and BINGO lines, the TPS report values
+    and the timestamps of the HOORAY lines.
+    """
+    stats = {'path': path, 'node': node_name(path), 'hooray': 0, 'bingo': 0, 'tps': [], 'block-times': []}
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            if 'HOORAY' in line:
+                stats['hooray'] += 1
+                stamp = parse_time(line)
+                if stamp is not None:
+                    stats['block-times'].append(stamp)
+            elif 'BINGO' in line:
+                stats['bingo'] += 1
+            if 'TPS' in line:
+                stats['tps'].append(report_tps(line))
+    return stats
+
+
+def distribution(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else 0,
+        'p50': percentile(values, 50),
+        'p99': percentile(values, 99),
+        'min': values[0] if values else 0,
+        'max': values[-1] if values else 0,
+    }
+
+
+def block_gaps(stats):
+    times = stats['block-times']
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def summarize_leader(stats):
+    if stats['hooray'] > 0 and stats['tps']:
+        avg_tps = sum(stats['tps']) / len(stats['tps'])
+    else:
+        avg_tps = 0
+    return {
+        'node': stats['node'],
+        'path': stats['path'],
+        'consensus': stats['hooray'],
+        'avg-tps': avg_tps,
+        'tps': distribution(stats['tps'] if stats['hooray'] > 0 else []),
+        'block-time': distribution(block_gaps(stats)),
+    }
+
+
+def analyze(leaders, validators=(), processes=None):
+    """
+    Parse all `leaders` and `validators` log files in parallel and return the summary dict.
+    """
+    leaders = list(leaders)
+    paths = leaders + list(validators)
+    if paths:
+        with Pool(min(processes or cpu_count(), len(paths))) as pool:
+            parsed = pool.map(parse_log, paths, chunksize=1)
+    else:
+        parsed = []
+    leader_stats = parsed[:len(leaders)]
+    shards = [summarize_leader(s) for s in leader_stats]
+    return {
+        'shards': len(leaders),
+        'consensus': sum(s['consensus'] for s in shards),
+        # cal_tps.sh adds up the per leader averages rounded to integers.
+        'total-tps': sum(int(round(s['avg-tps'])) for s in shards),
+        'nodes': len(paths),
+        'tps': distribution([v for s in leader_stats if s['hooray'] > 0 for v in s['tps']]),
+        'block-time': distribution([v for s in leader_stats for v in block_gaps(s)]),
+        'leaders': shards,
+        'validators': [{'node': s['node'], 'path': s['path'], 'consensus': s['bingo']}
+                       for s in parsed[len(leaders):]],
+    }
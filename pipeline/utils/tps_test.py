@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils import tps
+
+
+class TestTps(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.leader = os.path.join(self.dir, "zerolog-validator-1.2.3.4-9000.log")
+        with open(self.leader, "w") as f:
+            for i, value in enumerate([100, 201, 300]):
+                f.write('{"level":"info","time":"2019-06-13T21:00:%02d.5+02:00","message":"HOORAY"}\n' % (i * 2))
+                f.write('{"TPS":%d,"ConsensusTime":1.2,"message":"TPS Report"}\n' % value)
+        self.validator = os.path.join(self.dir, "zerolog-validator-5.6.7.8-9000.log")
+        with open(self.validator, "w") as f:
+            f.write('{"message":"BINGO"}\n' * 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_report_tps_matches_cut(self):
+        self.assertEqual(tps.report_tps('{"TPS":123.5,"x":1}'), 123.5)
+        self.assertEqual(tps.report_tps('{"level":"info","TPS":1}'), 0)
+        self.assertEqual(tps.report_tps('no colon TPS'), 0)
+
+    def test_parse_time(self):
+        self.assertEqual(tps.parse_time('"time":"1970-01-01T02:00:01.25+02:00"'), 1.25)
+        self.assertEqual(tps.parse_time('"time":"1970-01-01T00:00:01Z"'), 1)
+
+    def test_analyze(self):
+        summary = tps.analyze([self.leader], [self.validator], processes=2)
+        self.assertEqual((summary['shards'], summary['consensus'], summary['total-tps'], summary['nodes']),
+                         (1, 3, 200, 2))
+        self.assertEqual(summary['leaders'][0]['node'], "1.2.3.4")
+        self.assertEqual(summary['tps']['p50'], 201)
+        self.assertEqual(summary['block-time']['mean'], 2)
+        self.assertEqual(summary['validators'][0]['consensus'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import boto3
 import datetime
 import json
+import math
 import sys
 import time
 import base64
@@ -73,34 +74,114 @@ def get_ip_list(response):
     else:
         return []
 
+# One session/client per (profile, region) for the whole process, boto3 clients are thread safe.
+EC2_CLIENTS = {}
+EC2_CLIENTS_LOCK = threading.Lock()
+REGION_CONFIGS = {}
+# Seconds a fleet inventory sweep is reused for.
+INVENTORY_TTL = 30
+INVENTORY = {}
+INVENTORY_LOCK = threading.Lock()
+# Only what the pipeline needs out of describe_instances.
+INVENTORY_PROJECTION = ('Reservations[].Instances[].{InstanceId: InstanceId, PublicIpAddress: PublicIpAddress, '
+                        'State: State.Name, Tags: Tags}')
+LIVE_STATES = ['pending', 'running']
+
+def get_region_config(region_config='configuration.txt'):
+    """
+    read_region_config, parsed once per file.
+    """
+    if region_config not in REGION_CONFIGS:
+        REGION_CONFIGS[region_config] = read_region_config(region_config)
+    return REGION_CONFIGS[region_config]
+
+def get_ec2_client(profile, region_name):
+    """
+    Returns the shared (client, session) for `profile` in `region_name`.
+    """
+    with EC2_CLIENTS_LOCK:
+        if (profile, region_name) not in EC2_CLIENTS:
+            if profile == 'default':
+                session = boto3.Session(region_name=region_name)
+            else:
+                session = boto3.Session(profile_name=profile, region_name=region_name)
+            ec2config = Config(
+                retries = dict(
+                    max_attempts = 10
+                )
+            )
+            EC2_CLIENTS[(profile, region_name)] = (session.client('ec2', config=ec2config), session)
+        return EC2_CLIENTS[(profile, region_name)]
+
 def create_ec2_client(profile, region_number, region_config):
-    config = read_region_config(region_config)
-    region_name = config[region_number][REGION_NAME]
-    # Create session.
-    if profile == 'default':
-        session = boto3.Session(region_name=region_name)
-    else:
-        session = boto3.Session(profile_name=profile, region_name=region_name)
-    ec2config = Config(
-        retries = dict(
-            max_attempts = 10
-        )
-    )
-    return session.client('ec2', config=ec2config), session
+    config = get_region_config(region_config)
+    return get_ec2_client(profile, config[region_number][REGION_NAME])
+
+def describe_fleet(ec2_client, node_name_tag, states=LIVE_STATES):
+    """
+    All instances tagged `node_name_tag` in `states`, every page of describe_instances.
+    Returns a list of dicts with InstanceId, PublicIpAddress, State and Tags.
+    """
+    filters = [{'Name': 'tag:Name', 'Values': [node_name_tag]}]
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    paginator = ec2_client.get_paginator('describe_instances')
+    return list(paginator.paginate(Filters=filters).search(INVENTORY_PROJECTION))
+
+def collect_inventory(profile, node_name_tag, region_config='configuration.txt', region_numbers=None,
+                      ttl=INVENTORY_TTL):
+    """
+    Fleet inventory of all configured regions (or `region_numbers`), one thread per region.
+    Sweeps are cached for `ttl` seconds, returns a dict of region number -> describe_fleet list.
+    """
+    config = get_region_config(region_config)
+    region_numbers = sorted(config.keys()) if region_numbers is None else region_numbers
+    now = time.time()
+    inventory, missing = {}, []
+    with INVENTORY_LOCK:
+        for region_number in region_numbers:
+            key = (profile, config[region_number][REGION_NAME], node_name_tag)
+            if key in INVENTORY and now - INVENTORY[key][0] < ttl:
+                inventory[region_number] = INVENTORY[key][1]
+            else:
+                missing.append(region_number)
+
+    def sweep(region_number):
+        ec2_client, _ = create_ec2_client(profile, region_number, region_config)
+        instances = describe_fleet(ec2_client, node_name_tag)
+        with INVENTORY_LOCK:
+            INVENTORY[(profile, config[region_number][REGION_NAME], node_name_tag)] = (time.time(), instances)
+            inventory[region_number] = instances
+
+    thread_pool = [threading.Thread(target=sweep, args=(region_number,)) for region_number in missing]
+    for t in thread_pool:
+        t.start()
+    for t in thread_pool:
+        t.join()
+    unswept = [region_number for region_number in missing if region_number not in inventory]
+    if unswept:
+        raise RuntimeError("inventory sweep failed in region(s) %s" % ", ".join(unswept))
+    return inventory
+
+def invalidate_inventory():
+    with INVENTORY_LOCK:
+        INVENTORY.clear()
 
 def collect_public_ips_from_ec2_client(ec2_client, node_name_tag):
-    filters = [{'Name': 'tag:Name','Values': [node_name_tag]}]
-    response = ec2_client.describe_instances(Filters=filters)
-    ip_list = []
-    if response.get('Reservations'):
-        for reservation in response[u'Reservations']:
-            ip_list.extend(instance['PublicIpAddress'] for instance in reservation['Instances'] if instance.get('PublicIpAddress'))
-    return ip_list
+    return [instance['PublicIpAddress'] for instance in describe_fleet(ec2_client, node_name_tag)
+            if instance.get('PublicIpAddress')]
 
 def collect_public_ips(profile, region_number, node_name_tag, region_config):
-    ec2_client, _ = create_ec2_client(profile, region_number, region_config)
-    ip_list = collect_public_ips_from_ec2_client(ec2_client, node_name_tag)
-    return ip_list
+    instances = collect_inventory(profile, node_name_tag, region_config, [region_number])[region_number]
+    return [instance['PublicIpAddress'] for instance in instances if instance.get('PublicIpAddress')]
+
+def collect_all_public_ips(profile, node_name_tag, region_config='configuration.txt'):
+    """
+    Public IPs of the fleet in every configured region, from a single parallel sweep.
+    Returns a dict of region number -> list of IPs.
+    """
+    return {region_number: [instance['PublicIpAddress'] for instance in instances if instance.get('PublicIpAddress')]
+            for region_number, instances in collect_inventory(profile, node_name_tag, region_config).items()}
 
 def get_application(codedeploy, application_name):
     response = codedeploy.list_applications()
@@ -137,43 +218,37 @@ def create_deployment_group(codedeploy, region_number,application_name, deployme
         )
         return response['deploymentGroupId']
 
-def generate_distribution_config2(region_number, node_name_tag, region_config,
+def generate_distribution_config2(profile, region_number, node_name_tag, region_config,
                                   shard_number, explorer_number, client_number, distribution_config, commander_number):
-    ip_list = collect_public_ips(region_number, node_name_tag, region_config)
-    generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number)
+    instances = collect_inventory(profile, node_name_tag, region_config, [region_number])[region_number]
+    ip_list = ["%s %s %s" % (instance['PublicIpAddress'], node_name_tag, region_number)
+               for instance in instances if instance.get('PublicIpAddress')]
+    return generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number)
 
 def generate_distribution_config3(shard_number, explorer_number, client_number, ip_list_file, distribution_config, commander_number):
     with open(ip_list_file, "r") as fin:
-        lines = fin.readlines()
-        ip_list = [line.strip() for line in lines]
-    generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number)
+        ip_list = fin.readlines()
+    return generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number)
 
-def generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number):
-    if len(ip_list) < shard_number * 2 + explorer_number + client_number + 1:
+def generate_distribution_config(shard_number, explorer_number, client_number, ip_list, distribution_config, commander_number=0):
+    """
+    Writes the distribution config of the `ip node_name_tag [region [cloud]]` lines of `ip_list`,
+    validators and clients of every region are spread evenly over the shards (see utils/distribution.py).
+    Returns the planned rows, or False when there are not enough nodes.
+    """
+    # Imported here: this module is also loaded flat as `utils` (legacy scripts, utils_test.py),
+    # where `from utils import distribution` at the top would import itself.
+    try:
+        from utils import distribution
+    except ImportError:
+        import distribution
+    rows = distribution.plan(distribution.parse_inventory(ip_list), shard_number, explorer_number,
+                             client_number, commander_number)
+    if rows is None:
         print("Not enough nodes to generate a config file")
         return False
-
-    # Create ip for clients.
-    commander_id, client_id, leader_id, explorer_node_id, validator_id = 0, 0, 0, 0, 0
-    validator_number = len(ip_list) - client_number - shard_number - explorer_number - commander_number
-    with open(distribution_config, "w") as fout:
-        for i in range(len(ip_list)):
-            ip, node_name_tag = ip_list[i].split(" ")
-            if commander_id < commander_number:
-                fout.write("%s 9000 commander %d %s\n" % (ip, commander_id, node_name_tag))
-                commander_id = commander_id + 1
-            elif leader_id < shard_number:
-                fout.write("%s 9000 leader %d %s\n" % (ip, leader_id, node_name_tag))
-                leader_id = leader_id + 1
-            elif explorer_node_id < explorer_number:
-                fout.write("%s 9000 explorer_node %d %s\n" % (ip, explorer_node_id, node_name_tag))
-                explorer_node_id = explorer_node_id + 1
-            elif validator_id < validator_number:
-                fout.write("%s 9000 validator %d %s\n" % (ip, validator_id % shard_number, node_name_tag))
-                validator_id = validator_id + 1
-            elif client_id < client_number:
-                fout.write("%s 9000 client %d %s\n" % (ip, client_id % shard_number, node_name_tag))
-                client_id = client_id + 1
+    distribution.write(rows, distribution_config)
+    return rows
 
 def get_availability_zones(ec2_client):
     response = ec2_client.describe_availability_zones()
@@ -203,26 +278,141 @@ def get_instance_ids(describe_instances_response):
             instance_ids.extend(instance["InstanceId"] for instance in reservation["Instances"] if instance.get("InstanceId"))
     return instance_ids
 
-WAITER_LOCK = threading.Lock() 
-def run_waiter_100_instances_for_status(ec2_client, status, instance_ids):
-    time.sleep(10)
-    WAITER_LOCK.acquire()
-    waiter = ec2_client.get_waiter('instance_running')
-    WAITER_LOCK.release()
-    waiter.wait(InstanceIds=instance_ids)
-
-def run_waiter_for_status(ec2_client, status, instance_ids):
-    thread_pool = []
-    i = 0
-    while i < len(instance_ids):
-        j = i + min(len(instance_ids), i + MAX_INTANCES_FOR_WAITER)
-        t = threading.Thread(target=run_waiter_100_instances_for_status, args=(
-                            ec2_client, status, instance_ids[i:j]))
-        t.start()
-        thread_pool.append(t)
-        i = i + MAX_INTANCES_FOR_WAITER
-    for t in thread_pool:
-        t.join()
+READINESS_POLL_INTERVAL = 5
+# Seconds to wait for a fleet to get ready.
+READINESS_TIMEOUT = 600
+# Consecutive polls an instance may be missing from describe_instance_status (or its region
+# may fail) before it counts as failed, a minute at the default poll interval.
+READINESS_MAX_MISSES = 12
+# Instance states that never lead to another target state.
+FINAL_STATES = ['shutting-down', 'terminated']
+
+def _status_name(status):
+    # Accept waiter names such as `instance_running`.
+    return status[len('instance_'):] if status.startswith('instance_') else status
+
+def _instance_status(status):
+    """
+    `ok` when both status checks passed, otherwise the instance state name.
+    """
+    state = status['InstanceState']['Name']
+    if state == 'running' and status.get('InstanceStatus', {}).get('Status') == 'ok' \
+            and status.get('SystemStatus', {}).get('Status') == 'ok':
+        return 'ok'
+    return state
+
+class FleetReadiness(object):
+    """
+    Tracks the state of a fleet of instances, possibly across regions, until enough of it reaches a target status.
+
+    `fleet` is a list of (ec2_client, instance_ids) pairs, one per region.
+    `status` is any instance state name (`running`, `stopped`, `terminated`, ...) or `ok` for
+    running instances that passed their status checks; waiter names like `instance_running` are accepted.
+    `on_change(instance_id, old, new)` is called for every state change seen, old is None on first sight.
+    An instance that is not reported for `max_misses` polls in a row, because it is unknown or its region
+    keeps erroring, counts as failed until it shows up again.
+    """
+
+    def __init__(self, fleet, status='running', poll_interval=READINESS_POLL_INTERVAL, on_change=None,
+                 max_misses=READINESS_MAX_MISSES):
+        self.fleet = [(ec2_client, list(instance_ids)) for ec2_client, instance_ids in fleet]
+        self.status = _status_name(status)
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.max_misses = max_misses
+        self.states = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    def total(self):
+        return sum(len(instance_ids) for _, instance_ids in self.fleet)
+
+    def ready(self):
+        with self._lock:
+            return sorted(i for i, state in self.states.items() if self._reached(state))
+
+    def failed(self):
+        """
+        Instances that can no longer reach the target status.
+        """
+        with self._lock:
+            failed = set(i for i, state in self.states.items() if state in FINAL_STATES and not self._reached(state))
+            failed.update(i for i, misses in self.misses.items() if misses >= self.max_misses)
+            return sorted(failed)
+
+    def _reached(self, state):
+        return state == self.status or (self.status == 'running' and state == 'ok')
+
+    def _poll_region(self, ec2_client, instance_ids):
+        pending = [i for i in instance_ids if not self._reached(self.states.get(i))]
+        for k in range(0, len(pending), MAX_INTANCES_FOR_WAITER):
+            chunk = pending[k:k + MAX_INTANCES_FOR_WAITER]
+            try:
+                paginator = ec2_client.get_paginator('describe_instance_status')
+                statuses = [status for page in paginator.paginate(InstanceIds=chunk, IncludeAllInstances=True)
+                            for status in page['InstanceStatuses']]
+            except Exception as e:  # i.e: ids not visible yet (eventual consistency), retry next round
+                print("describe_instance_status failed for %d instance(s): %s" % (len(chunk), e))
+                statuses = []
+            for status in statuses:
+                self._update(status['InstanceId'], _instance_status(status))
+            seen = set(status['InstanceId'] for status in statuses)
+            with self._lock:
+                for instance_id in chunk:
+                    self.misses[instance_id] = 0 if instance_id in seen else self.misses.get(instance_id, 0) + 1
+
+    def _update(self, instance_id, state):
+        with self._lock:
+            old = self.states.get(instance_id)
+            if old == state:
+                return
+            self.states[instance_id] = state
+        if self.on_change is not None:
+            self.on_change(instance_id, old, state)
+
+    def poll(self):
+        """
+        One round over the whole fleet, all regions at once.
+        """
+        thread_pool = [threading.Thread(target=self._poll_region, args=(ec2_client, instance_ids))
+                       for ec2_client, instance_ids in self.fleet]
+        for t in thread_pool:
+            t.start()
+        for t in thread_pool:
+            t.join()
+
+    def wait(self, fraction=1.0, timeout=READINESS_TIMEOUT):
+        """
+        Poll until `fraction` of the fleet reached the target status, for at most `timeout` seconds.
+
+        Returns True once enough of the fleet is ready, False on timeout or when
+        too many instances reached a final state to ever get there.
+        """
+        needed = int(math.ceil(fraction * self.total()))
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            self.poll()
+            ready = len(self.ready())
+            if ready >= needed:
+                return True
+            if self.total() - len(self.failed()) < needed:
+                return False
+            if deadline is not None and time.time() + self.poll_interval > deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+def print_state_change(instance_id, old, new):
+    print("%s: %s -> %s" % (instance_id, old or 'unknown', new))
+
+def run_waiter_for_status(ec2_client, status, instance_ids, fraction=1.0, timeout=READINESS_TIMEOUT):
+    """
+    Wait until `fraction` of `instance_ids` reached `status`, returns the ids that did.
+    """
+    tracker = FleetReadiness([(ec2_client, instance_ids)], status, on_change=print_state_change)
+    if not tracker.wait(fraction, timeout):
+        raise RuntimeError("only %d/%d instance(s) reached %s" % (len(tracker.ready()), tracker.total(),
+                                                                    tracker.status))
+    return tracker.ready()
 
 # used for testing only.
 # if __name__ == "__main__":
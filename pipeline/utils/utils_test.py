@@ -1,13 +1,45 @@
+import os
+import shutil
+import tempfile
 import unittest
 
-from utils import generate_distribution_config
+from utils.utils import FleetReadiness, generate_distribution_config
+
+class StubStatusClient(object):
+    """
+    describe_instance_status paginator of one region, `states` maps the known ids to their state,
+    the others are left out of the reply. Raises `error` if given.
+    """
+
+    def __init__(self, states, error=None):
+        self.states = states
+        self.error = error
+        self.calls = 0
+
+    def get_paginator(self, name):
+        assert name == 'describe_instance_status'
+        return self
+
+    def paginate(self, InstanceIds, IncludeAllInstances):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return [{'InstanceStatuses': [{'InstanceId': i, 'InstanceState': {'Name': self.states[i]}}
+                                      for i in InstanceIds if i in self.states]}]
 
 class TestCreateAndDeploy(unittest.TestCase):
 
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
     def test_generate_config_file(self):
-        ips = ["102.000.000.1", "102.000.000.2", "102.000.000.3", "102.000.000.4", "102.000.000.5", "102.000.000.6"]
-        generate_distribution_config(2, 2, ips, "config_test.txt")
-        with open("config_test.txt", "r") as fin:
+        ips = ["102.000.000.%d 1-NODE-test" % i for i in range(1, 8)]
+        config = os.path.join(self.dir, "config_test.txt")
+        self.assertTrue(generate_distribution_config(2, 0, 2, ips, config))
+        with open(config, "r") as fin:
             lines = fin.readlines()
             collection = {}
             collection['ip'] = []
@@ -23,9 +55,36 @@ class TestCreateAndDeploy(unittest.TestCase):
                     leader_count = leader_count + 1
                 elif strs[2] == "validator":
                     validator_count = validator_count + 1
-            assert(validator_count == 2)
+            assert(validator_count == 3)
             assert(leader_count == 2)
             assert(client_count == 2)
 
+    def test_not_enough_nodes(self):
+        ips = ["102.000.000.%d 1-NODE-test" % i for i in range(1, 7)]
+        self.assertFalse(generate_distribution_config(2, 0, 2, ips, os.path.join(self.dir, "config_test.txt")))
+
+class TestFleetReadiness(unittest.TestCase):
+
+    def test_ready(self):
+        client = StubStatusClient({'i-1': 'running', 'i-2': 'pending'})
+        tracker = FleetReadiness([(client, ['i-1', 'i-2'])], 'instance_running', poll_interval=0)
+        self.assertFalse(tracker.wait(timeout=0))
+        client.states['i-2'] = 'running'
+        self.assertTrue(tracker.wait())
+        self.assertEqual(tracker.ready(), ['i-1', 'i-2'])
+
+    def test_missing_and_erroring_count_as_failed(self):
+        found = StubStatusClient({'i-1': 'running'})
+        broken = StubStatusClient({}, error=RuntimeError("RequestLimitExceeded"))
+        tracker = FleetReadiness([(found, ['i-1', 'i-2']), (broken, ['i-3'])], poll_interval=0, max_misses=3)
+        # Gives up once i-2 and i-3 were missed 3 times, long before the default timeout.
+        self.assertFalse(tracker.wait())
+        self.assertEqual(tracker.failed(), ['i-2', 'i-3'])
+        self.assertEqual(broken.calls, 3)
+        # Back in the running once it shows up.
+        found.states['i-2'] = 'running'
+        self.assertTrue(tracker.wait(fraction=0.6))
+        self.assertEqual(tracker.failed(), ['i-3'])
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -33,6 +33,8 @@ COMMAND:
    extract        extract relevant logs from all log files
    report         analyze the logs and report latency
 
+See pipeline/net_stats.py for a faster single pass version with 50/90/100% propagation curves.
+
 EXAMPLES:
    $ME -p p2 -D 20181109.215322 extract
 